@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+"""
+Compares the throughput of the per-word clean_utterance/is_valid_utterance functions against the batch
+UtteranceCleaner engine used by clean_json_data, on a synthetic corpus. Both must produce identical output.
+
+Usage: python3 -m benchmarks.benchmark_clean_json [-h] [-n UTTERANCES] [-s SEED]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import random
+import string
+import time
+from typing import Dict, List
+from kaldi_helpers.input_scripts.clean_json import clean_utterance, is_valid_utterance, UtteranceCleaner
+
+PUNCTUATION = string.punctuation + "…’“–”‘°"
+SPECIAL_CASES = ["<silence>"]
+ENGLISH_WORDS = {"house", "water", "dinner", "morning", "where"}
+
+
+def generate_corpus(utterance_count: int, seed: int) -> List[Dict[str, str]]:
+    """
+    Builds a synthetic corpus mixing plain words, punctuation, English words, digits and special cases.
+    :param utterance_count: number of utterances to generate
+    :param seed: seed for the random number generator
+    :return: a list of utterances
+    """
+    generator = random.Random(seed)
+    vocabulary = ["".join(generator.choice("aeiouptkmnslrwy") for _ in range(generator.randint(2, 9)))
+                  for _ in range(5000)] + sorted(ENGLISH_WORDS)
+    extras = ["<silence>", "@eng@", "3", "a1b", "Hello,", "“quoted”", "wait…", "?"]
+    corpus = []
+    for _ in range(utterance_count):
+        words = [generator.choice(vocabulary) for _ in range(generator.randint(3, 15))]
+        if generator.random() < 0.05:
+            words.insert(generator.randrange(len(words)), generator.choice(extras))
+        if generator.random() < 0.3:
+            words[-1] += generator.choice(".!?,")
+        corpus.append({"transcript": " ".join(words)})
+    return corpus
+
+
+def reference_clean(corpus: List[Dict[str, str]]) -> List[str]:
+    """
+    Cleans the corpus one word at a time with clean_utterance and is_valid_utterance.
+    """
+    cleaned = []
+    for utterance in corpus:
+        clean_words, english_word_count = clean_utterance(utterance,
+                                                          remove_english=True,
+                                                          english_words=ENGLISH_WORDS,
+                                                          punctuation=PUNCTUATION,
+                                                          special_cases=SPECIAL_CASES)
+        if is_valid_utterance(clean_words, english_word_count, True, False, None):
+            cleaned.append(" ".join(clean_words).strip())
+    return cleaned
+
+
+def batch_clean(corpus: List[Dict[str, str]]) -> List[str]:
+    """
+    Cleans the corpus with the batch UtteranceCleaner engine.
+    """
+    cleaner = UtteranceCleaner(remove_english=True,
+                               english_words=ENGLISH_WORDS,
+                               punctuation=PUNCTUATION,
+                               special_cases=SPECIAL_CASES)
+    return [utterance["transcript"] for utterance in cleaner.clean(dict(utterance) for utterance in corpus)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark clean_json cleaning engines.")
+    parser.add_argument("-n", "--utterances", type=int, default=1000000, help="Number of synthetic utterances")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed for the synthetic corpus")
+    arguments = parser.parse_args()
+
+    corpus = generate_corpus(arguments.utterances, arguments.seed)
+
+    results = {}
+    for name, engine in [("clean_utterance", reference_clean), ("UtteranceCleaner", batch_clean)]:
+        start = time.perf_counter()
+        results[name] = engine(corpus)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>18}: {elapsed:8.2f}s  {arguments.utterances / elapsed:12,.0f} utterances/s")
+
+    assert results["clean_utterance"] == results["UtteranceCleaner"], "engines produced different output"
+    print(f"Identical output, {len(results['UtteranceCleaner'])} utterances kept.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+"""
+Compares the time and peak memory of reading one tier of a large, multi-tier ELAN file with a full pympi Eaf object,
+as elan_to_json originally did, against the streaming read_eaf_tier reader. Both must give identical annotations.
+
+Usage: python3 -m benchmarks.benchmark_elan_to_json [-h] [-a ANNOTATIONS] [-t TIERS]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from pympi.Elan import Eaf
+from kaldi_helpers.script_utilities import read_eaf_tier
+
+
+def write_eaf(file_name: str, annotations: int, tiers: int) -> None:
+    """
+    Writes a synthetic eaf file with a Phrase tier, a reference Gloss tier and a number of other aligned tiers.
+    :param file_name: path of the file to write
+    :param annotations: number of annotations in each tier
+    :param tiers: number of other aligned tiers
+    """
+    tier_names = ["Phrase"] + [f"Tier {tier}" for tier in range(tiers)]
+    with open(file_name, "w", encoding="utf-8") as eaf_file:
+        eaf_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<ANNOTATION_DOCUMENT AUTHOR="" DATE="" FORMAT="3.0" '
+                       'VERSION="3.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                       'xsi:noNamespaceSchemaLocation="http://www.mpi.nl/tools/elan/EAFv3.0.xsd">\n<HEADER MEDIA_FILE="" TIME_UNITS="milliseconds"/>\n<TIME_ORDER>\n')
+        for tier_index in range(len(tier_names)):
+            for index in range(annotations):
+                start = index * 1000 + tier_index
+                eaf_file.write(f'<TIME_SLOT TIME_SLOT_ID="ts{tier_index}_{index}a" TIME_VALUE="{start}"/>\n'
+                               f'<TIME_SLOT TIME_SLOT_ID="ts{tier_index}_{index}b" TIME_VALUE="{start + 800}"/>\n')
+        eaf_file.write("</TIME_ORDER>\n")
+        for tier_index, tier_name in enumerate(tier_names):
+            participant = ' PARTICIPANT="Speaker A"' if tier_name == "Phrase" else ""
+            eaf_file.write(f'<TIER TIER_ID="{tier_name}" LINGUISTIC_TYPE_REF="default-lt"{participant}>\n')
+            for index in range(annotations):
+                eaf_file.write(f'<ANNOTATION><ALIGNABLE_ANNOTATION ANNOTATION_ID="a{tier_index}_{index}" '
+                               f'TIME_SLOT_REF1="ts{tier_index}_{index}a" TIME_SLOT_REF2="ts{tier_index}_{index}b">'
+                               f'<ANNOTATION_VALUE>{tier_name} number {index}</ANNOTATION_VALUE>'
+                               f'</ALIGNABLE_ANNOTATION></ANNOTATION>\n')
+            eaf_file.write("</TIER>\n")
+        eaf_file.write('<TIER TIER_ID="Gloss" LINGUISTIC_TYPE_REF="gloss-lt" PARENT_REF="Phrase">\n')
+        for index in range(annotations):
+            eaf_file.write(f'<ANNOTATION><REF_ANNOTATION ANNOTATION_ID="r{index}" ANNOTATION_REF="a0_{index}">'
+                           f'<ANNOTATION_VALUE>gloss number {index}</ANNOTATION_VALUE></REF_ANNOTATION>'
+                           f'</ANNOTATION>\n')
+        eaf_file.write('</TIER>\n<LINGUISTIC_TYPE LINGUISTIC_TYPE_ID="default-lt" TIME_ALIGNABLE="true"/>\n'
+                       '<LINGUISTIC_TYPE LINGUISTIC_TYPE_ID="gloss-lt" TIME_ALIGNABLE="false" '
+                       'CONSTRAINTS="Symbolic_Association"/>\n'
+                       '<CONSTRAINT STEREOTYPE="Symbolic_Association" DESCRIPTION=""/>\n</ANNOTATION_DOCUMENT>\n')
+
+
+def pympi_tier(file_name: str, tier_name: str) -> list:
+    """
+    Reads a tier through a full Eaf object.
+    """
+    return sorted(Eaf(file_name).get_annotation_data_for_tier(tier_name))
+
+
+def streamed_tier(file_name: str, tier_name: str) -> list:
+    """
+    Reads a tier with read_eaf_tier.
+    """
+    return sorted(read_eaf_tier(file_name, tier_name)[0])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark reading one tier of an eaf file.")
+    parser.add_argument("-a", "--annotations", type=int, default=10000, help="Number of annotations per tier")
+    parser.add_argument("-t", "--tiers", type=int, default=10, help="Number of other aligned tiers")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "large.eaf")
+        write_eaf(file_name, arguments.annotations, arguments.tiers)
+        print(f"{os.path.getsize(file_name) / 2 ** 20:.1f} MiB eaf file, {arguments.tiers + 2} tiers")
+
+        for tier_name in ["Phrase", "Gloss"]:
+            results = []
+            for name, reader in [("pympi", pympi_tier), ("read_eaf_tier", streamed_tier)]:
+                start = time.perf_counter()
+                results.append(reader(file_name, tier_name))
+                elapsed = time.perf_counter() - start
+                tracemalloc.start()
+                reader(file_name, tier_name)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"{tier_name:>7} {name:>14}: {elapsed:8.2f}s  peak {peak / 2 ** 20:8.1f} MiB")
+            assert results[0] == results[1], "readers produced different annotations"
+    print("Identical annotations.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+"""
+Compares the throughput of the per-symbol generate_sound_mapping search against the compiled SoundMapper engine
+used by make_prn_dict, on a synthetic word list. Both must produce identical lexicons.
+
+Usage: python3 -m benchmarks.benchmark_make_prn_dict [-h] [-n WORDS] [-s SEED]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import io
+import random
+import time
+from typing import List, Tuple
+from kaldi_helpers.input_scripts.make_prn_dict import generate_sound_mapping, SoundMapper
+
+SOUND_MAP = [("a", "a"), ("aa", "aː"), ("e", "e"), ("i", "i"), ("ii", "iː"), ("o", "o"), ("u", "u"), ("uu", "uː"),
+             ("p", "p"), ("t", "t"), ("k", "k"), ("m", "m"), ("n", "n"), ("ng", "ŋ"), ("ny", "ɲ"), ("nh", "n̪"),
+             ("th", "t̪"), ("dh", "t̪"), ("tj", "c"), ("dj", "c"), ("rr", "r"), ("r", "ɻ"), ("rl", "ɭ"), ("rn", "ɳ"),
+             ("rt", "ʈ"), ("l", "l"), ("ly", "ʎ"), ("w", "w"), ("y", "j"), ("b", "p"), ("d", "t"), ("g", "k"),
+             ("j", "c"), ("h", "h"), ("'", "ʔ"), ("-", "")]
+
+
+def generate_words(word_count: int, seed: int) -> List[str]:
+    """
+    Builds a synthetic word list from the symbols of the sound map, with the occasional unknown character.
+    :param word_count: number of words to generate
+    :param seed: seed for the random number generator
+    :return: a list of words
+    """
+    generator = random.Random(seed)
+    symbols = [symbol for symbol, _ in SOUND_MAP] + ["x", "q"]
+    return ["".join(generator.choice(symbols) for _ in range(generator.randint(2, 8))).capitalize()
+            for _ in range(word_count)]
+
+
+def reference_lexicon(words: List[str], sound_map: List[Tuple[str, str]]) -> str:
+    """
+    Maps every word with generate_sound_mapping.
+    """
+    sorted_map = sorted(sound_map, key=lambda x: len(x[0]), reverse=True)
+    output_file = io.StringIO()
+    for word in words:
+        generate_sound_mapping(word, sorted_map, output_file, set())
+    return output_file.getvalue()
+
+
+def compiled_lexicon(words: List[str], sound_map: List[Tuple[str, str]]) -> str:
+    """
+    Maps every word with SoundMapper.
+    """
+    sound_mapper = SoundMapper(sorted(sound_map, key=lambda x: len(x[0]), reverse=True))
+    missing_characters = set()
+    return "".join(sound_mapper.map_word(word, missing_characters) + "\n" for word in words)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark make_prn_dict letter to sound engines.")
+    parser.add_argument("-n", "--words", type=int, default=1000000, help="Number of synthetic words")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed for the synthetic word list")
+    arguments = parser.parse_args()
+
+    words = generate_words(arguments.words, arguments.seed)
+
+    results = {}
+    for name, engine in [("generate_sound_mapping", reference_lexicon), ("SoundMapper", compiled_lexicon)]:
+        start = time.perf_counter()
+        results[name] = engine(words, SOUND_MAP)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>22}: {elapsed:8.2f}s  {arguments.words / elapsed:12,.0f} words/s")
+
+    assert results["generate_sound_mapping"] == results["SoundMapper"], "engines produced different lexicons"
+    print("Identical lexicons.")
+
+
+if __name__ == "__main__":
+    main()
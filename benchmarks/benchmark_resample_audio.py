@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+"""
+Compares the time taken by the sox and native resample_audio backends to convert a corpus of short synthetic
+stereo 44.1 kHz clips to 16 bit mono WAVs. The sox backend is skipped if sox is not installed.
+
+Usage: python3 -m benchmarks.benchmark_resample_audio [-h] [-n CLIPS] [-d DURATION] [-r SAMPLE_RATE] [-j JOBS]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from kaldi_helpers.input_scripts.resample_audio import resample_corpus
+from kaldi_helpers.script_utilities import write_wav
+from kaldi_helpers.script_utilities.globals import SOX_PATH
+
+
+def generate_clips(directory: str, clip_count: int, duration: float) -> None:
+    """
+    Writes clips of noise to a directory.
+    :param directory: directory to write the clips to
+    :param clip_count: number of clips to write
+    :param duration: length of each clip in seconds
+    """
+    generator = np.random.RandomState(0)
+    for index in range(clip_count):
+        samples = 0.1 * generator.randn(int(44100 * duration), 2)
+        write_wav(os.path.join(directory, f"clip_{index}.wav"), samples, 44100)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark resample_audio backends.")
+    parser.add_argument("-n", "--clips", type=int, default=1000, help="Number of synthetic clips")
+    parser.add_argument("-d", "--duration", type=float, default=3.0, help="Length of each clip in seconds")
+    parser.add_argument("-r", "--sample_rate", type=int, default=16000, help="Target sample rate in Hz")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Number of workers")
+    arguments = parser.parse_args()
+
+    backends = ["native"] + (["sox"] if os.path.exists(SOX_PATH) else [])
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as directory:
+            generate_clips(directory, arguments.clips, arguments.duration)
+            audio = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+            start = time.perf_counter()
+            converted, skipped, failed = resample_corpus(audio,
+                                                         sample_rate=arguments.sample_rate,
+                                                         jobs=arguments.jobs,
+                                                         backend=backend,
+                                                         verbose=False)
+            elapsed = time.perf_counter() - start
+            assert not failed, failed
+            print(f"{backend:>6}: {elapsed:8.2f}s  {arguments.clips / elapsed:10,.1f} clips/s")
+    if len(backends) == 1:
+        print(f"sox not found at {SOX_PATH}, only the native backend was timed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+Compares finding the files of a given extension in a synthetic corpus tree with the original glob("**") listing
+filtered by extension, against scan_directory, both on its own and reading from a warm directory index.
+
+Usage: python3 -m benchmarks.benchmark_scan_directory [-h] [-f FILES] [-d DIRECTORIES]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+from typing import Callable, Set
+from kaldi_helpers.script_utilities import DirectoryIndex, scan_directory
+
+EXTENSIONS = [".wav", ".eaf", ".trs", ".TextGrid", ".txt"]
+
+
+def write_tree(root: str, files: int, directories: int) -> None:
+    """
+    Writes a corpus of empty files spread evenly over two levels of directories.
+    :param root: directory to write the corpus in
+    :param files: number of files
+    :param directories: number of leaf directories
+    """
+    for file_number in range(files):
+        session = file_number % directories
+        directory = os.path.join(root, f"speaker_{session % 10}", f"session_{session}")
+        if file_number < directories:
+            os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, f"file_{file_number}{EXTENSIONS[file_number % len(EXTENSIONS)]}"), "w").close()
+
+
+def measure(name: str, finder: Callable[[], Set[str]]) -> Set[str]:
+    """
+    Runs a file finder, reporting how long it takes.
+    """
+    start = time.perf_counter()
+    found = finder()
+    print(f"{name:>22}: {len(found):8,} files in {time.perf_counter() - start:8.3f}s")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark directory scanning.")
+    parser.add_argument("-f", "--files", type=int, default=100000, help="Number of files in the synthetic corpus")
+    parser.add_argument("-d", "--directories", type=int, default=1000, help="Number of leaf directories")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = os.path.join(directory, "corpus")
+        write_tree(corpus, arguments.files, arguments.directories)
+        index_path = os.path.join(directory, "index.json")
+
+        reference = measure("glob", lambda: {file_ for file_ in glob.glob(os.path.join(corpus, "**"), recursive=True)
+                                             if file_.endswith(".wav")})
+        assert measure("scan_directory", lambda: set(scan_directory(corpus, {".wav"}))) == reference
+
+        index = DirectoryIndex(index_path)
+        assert measure("cold index", lambda: set(scan_directory(corpus, {".wav"}, index=index))) == reference
+        index.save()
+        index = DirectoryIndex(index_path)
+        assert measure("warm index", lambda: set(scan_directory(corpus, {".wav"}, index=index))) == reference
+        print("Identical files found.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+"""
+Compares the throughput of reading TextGrid files with praatio, as textgrid_to_json originally did, against the
+native long format parser, serially and across a pool of worker processes, on a directory of synthetic TextGrids.
+All must produce identical intervals.
+
+Usage: python3 -m benchmarks.benchmark_textgrid_to_json [-h] [-f FILES] [-i INTERVALS] [-n JOBS] [-s SEED]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from praatio import tgio
+from typing import Dict, List, Union
+from kaldi_helpers.input_scripts.textgrid_to_json import find_textgrid_files, iterate_textgrid_files, \
+    seconds_to_milliseconds
+
+WORDS = ["hello", "I", "love", "bikes", "want", "to", "visit", "Iceland", "Switzerland", "would", "be", "nice"]
+
+
+def write_textgrids(directory: str, files: int, intervals: int, seed: int) -> None:
+    """
+    Writes synthetic long format TextGrids, each with a Speech tier, a Turns tier and a Notes tier.
+    :param directory: directory to write the files to
+    :param files: number of files
+    :param intervals: number of intervals in the Speech tier of each file
+    :param seed: seed for the random number generator
+    """
+    generator = random.Random(seed)
+    for file_index in range(files):
+        speech, notes = [], []
+        time_s = 0.0
+        for _ in range(intervals):
+            stop = round(time_s + generator.uniform(0.5, 5.0), 3)
+            label = " ".join(generator.choice(WORDS) for _ in range(generator.randint(1, 8)))
+            speech.append((time_s, stop, label if generator.random() > 0.1 else ""))
+            notes.append((time_s, stop, generator.choice(WORDS)))
+            time_s = stop
+        text_grid = tgio.Textgrid()
+        text_grid.addTier(tgio.IntervalTier("Turns", [(0, time_s, "speaker")], 0, time_s))
+        text_grid.addTier(tgio.IntervalTier("Speech", [entry for entry in speech if entry[2]], 0, time_s))
+        text_grid.addTier(tgio.IntervalTier("Notes", notes, 0, time_s))
+        text_grid.save(os.path.join(directory, f"recording_{file_index}.TextGrid"), useShortForm=False)
+
+
+def praatio_intervals(file_names: List[str]) -> List[Dict[str, Union[str, int]]]:
+    """
+    Reads the Speech tier of every file with praatio, the way textgrid_to_json originally did.
+    """
+    intervals = []
+    for file_name in file_names:
+        basename = os.path.splitext(os.path.basename(file_name))[0]
+        for start, stop, label in tgio.openTextgrid(file_name).tierDict["Speech"].entryList:
+            intervals.append({"audio_file_name": os.path.join(".", basename + ".wav"),
+                              "transcript": label.replace('"', ''),
+                              "start_ms": seconds_to_milliseconds(float(start)),
+                              "stop_ms": seconds_to_milliseconds(float(stop))})
+    return intervals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark textgrid_to_json parsers.")
+    parser.add_argument("-f", "--files", type=int, default=2000, help="Number of synthetic TextGrid files")
+    parser.add_argument("-i", "--intervals", type=int, default=200, help="Number of Speech intervals per file")
+    parser.add_argument("-n", "--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed for the synthetic files")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_textgrids(directory, arguments.files, arguments.intervals, arguments.seed)
+        file_names = find_textgrid_files(directory)
+
+        engines = [("praatio", praatio_intervals),
+                   ("native", lambda names: list(iterate_textgrid_files(names))),
+                   (f"native x{arguments.jobs}", lambda names: list(iterate_textgrid_files(names,
+                                                                                           jobs=arguments.jobs)))]
+        results = {}
+        for name, engine in engines:
+            start = time.perf_counter()
+            results[name] = engine(file_names)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>12}: {elapsed:8.2f}s  {arguments.files / elapsed:10,.0f} files/s")
+
+    reference = results.pop("praatio")
+    assert all(result == reference for result in results.values()), "parsers produced different intervals"
+    print(f"Identical intervals ({len(reference):,}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+"""
+Compares the throughput of the original tree-based .trs parser, which searched the whole tree for the speaker of
+every turn and concatenated lists, against the streaming process_trs used by trs_to_json, on a synthetic Transcriber
+file. The original parser is quadratic, so it is only run on the first --reference_turns turns, where both parsers
+must produce identical utterances.
+
+Usage: python3 -m benchmarks.benchmark_trs_to_json [-h] [-t TURNS] [-r REFERENCE_TURNS] [-s SPEAKERS] [--seed SEED]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Union
+from xml.sax.saxutils import escape
+from kaldi_helpers.input_scripts.trs_to_json import process_trs
+
+WORDS = ["language", "learning", "is", "fun", "it", "helps", "to", "learn", "about", "other", "cultures", "<silence>"]
+
+
+def write_trs(file_name: str, turns: int, speakers: int, seed: int) -> None:
+    """
+    Writes a synthetic Transcriber file with the given number of turns, each of one to four synchronised phrases.
+    :param file_name: path of the file to write
+    :param turns: number of turns
+    :param speakers: number of speakers the turns are shared between
+    :param seed: seed for the random number generator
+    """
+    generator = random.Random(seed)
+    with open(file_name, "w", encoding="utf-8") as trs_file:
+        trs_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<Trans audio_filename="synthetic">\n<Speakers>\n')
+        for speaker in range(speakers):
+            trs_file.write(f'<Speaker id="spk{speaker}" name="Speaker {speaker}"/>\n')
+        trs_file.write('</Speakers>\n<Episode>\n<Section type="report" startTime="0" endTime="0">\n')
+        time_s = 0.0
+        for _ in range(turns):
+            turn_start = time_s
+            phrases = []
+            for _ in range(generator.randint(1, 4)):
+                text = " ".join(generator.choice(WORDS) for _ in range(generator.randint(1, 8)))
+                phrases.append(f'<Sync time="{time_s:.3f}"/>\n{escape(text)}\n')
+                time_s += round(generator.uniform(0.5, 5.0), 3)
+            trs_file.write(f'<Turn startTime="{turn_start:.3f}" endTime="{time_s:.3f}" '
+                           f'speaker="spk{generator.randrange(speakers)}">\n{"".join(phrases)}</Turn>\n')
+        trs_file.write("</Section>\n</Episode>\n</Trans>\n")
+
+
+def reference_process_trs(file_name: str) -> List[Dict[str, Union[str, float]]]:
+    """
+    Parses a .trs file the way trs_to_json originally did.
+    """
+    utterances = []
+    tree = ET.parse(file_name)
+    wave_name = tree.getroot().attrib["audio_filename"] + ".wav"
+    for turn_node in tree.findall(".//Turn"):
+        turn_end = float(turn_node.attrib["endTime"])
+        speaker_name = tree.find(".//Speaker[@id='%s']" % turn_node.get("speaker", "")).attrib["name"]
+        items = [(element.attrib["time"], element.tail.strip()) for element in turn_node.findall("./Sync")]
+        result = []
+        for i, (time_str, transcription_str) in enumerate(items):
+            end_time = float(items[i + 1][0]) if i < len(items) - 1 else turn_end
+            result.append({"speaker_id": speaker_name,
+                           "audio_file_name": os.path.join(".", wave_name),
+                           "transcript": transcription_str,
+                           "start_ms": float(time_str) * 1000.0,
+                           "stop_ms": end_time * 1000.0})
+        utterances = utterances + result
+    return utterances
+
+
+def measure(name: str, parser, file_name: str, turns: int) -> List[Dict[str, Union[str, float]]]:
+    """
+    Runs a parser, reporting its throughput and then, in a second run, its peak memory use.
+    """
+    start = time.perf_counter()
+    utterances = parser(file_name)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    parser(file_name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>14}: {turns:8,} turns {elapsed:8.2f}s  {turns / elapsed:10,.0f} turns/s  "
+          f"peak {peak / 2 ** 20:8.1f} MiB")
+    return utterances
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark trs_to_json parsers.")
+    parser.add_argument("-t", "--turns", type=int, default=100000, help="Number of turns in the synthetic file")
+    parser.add_argument("-r", "--reference_turns", type=int, default=5000,
+                        help="Number of turns to run the original, quadratic parser on")
+    parser.add_argument("-s", "--speakers", type=int, default=20, help="Number of speakers")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic file")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        small_file = os.path.join(directory, "small.trs")
+        large_file = os.path.join(directory, "large.trs")
+        write_trs(small_file, arguments.reference_turns, arguments.speakers, arguments.seed)
+        write_trs(large_file, arguments.turns, arguments.speakers, arguments.seed)
+
+        reference = measure("original", reference_process_trs, small_file, arguments.reference_turns)
+        streamed = measure("process_trs", lambda file_name: process_trs(file_name, False), small_file,
+                           arguments.reference_turns)
+        assert reference == streamed, "parsers produced different utterances"
+        print("Identical utterances.")
+        measure("process_trs", lambda file_name: process_trs(file_name, False), large_file, arguments.turns)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,11 @@ Given a json file with transcript information these tools can perform
 - exclude english/punctuation.
 - Optionally provide the output_scripts json file name with -j
 
-Usage: python3 clean_json.py [-h] [--i INFILE] [--o OUTFILE] [-r] [-u]
+The English word list is read from a prebuilt lookup file (see --english_lexicon), which is built from the nltk
+words corpus the first time it is needed. Copy that file to machines without internet access and run with --offline.
+
+Usage: python3 clean_json.py [-h] [--i INFILE] [--o OUTFILE] [-r] [-u] [-c CACHE_DIR] [-e ENGLISH_LEXICON]
+                             [--offline] [-l LANGID_CACHE] [-n LANGID_JOBS]
 
 Copyright: University of Queensland, 2019
 Contributors:
@@ -15,25 +19,126 @@ Contributors:
               Nicholas Lambourne - (The University of Queensland, 2019)
 """
 
+import json
+import os
 import re
 import string
 import sys
 import nltk
 from argparse import ArgumentParser
+from functools import lru_cache
+from itertools import groupby, islice
+from multiprocessing import Pool
 from langid.langid import LanguageIdentifier, model
 from nltk.corpus import words
-from typing import Dict, List, Set
-from kaldi_helpers.script_utilities import load_json_file, write_data_to_json_file
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from kaldi_helpers.script_utilities import load_jsonl_file, load_utterances, write_utterances
+from kaldi_helpers.script_utilities import hash_data, UtteranceCache
+from kaldi_helpers.script_utilities import build_word_lookup_file, WordLookup
+from kaldi_helpers.script_utilities.globals import ENGLISH_LEXICON_PATH
+
+
+@lru_cache(maxsize=None)
+def get_english_words(lexicon_path: str = ENGLISH_LEXICON_PATH, offline: bool = False) -> WordLookup:
+    """
+    Gets a set-like lookup of English words from the nltk corpora (~235k words), memory mapped from a prebuilt
+    lookup file so that loading is effectively instant. The lookup is only opened once per process.
+    N.B: if the lookup file does not exist yet, it is built from the nltk word list, which will be downloaded
+    if not already available (~740kB) and requires internet.
+    :param lexicon_path: path of the prebuilt English word lookup file.
+    :param offline: never call out to nltk, fail instead if the lookup file does not exist.
+    :return: a set-like lookup containing the English words
+    """
+    if not os.path.isfile(lexicon_path):
+        if offline:
+            raise FileNotFoundError(f"English word lookup file not found at {lexicon_path}. Build it by running "
+                                    f"clean_json.py with --remove_eng on a machine with internet access, then "
+                                    f"copy it across.")
+        nltk.download("words")  # Will only download if not locally available.
+        build_word_lookup_file(words.words(), lexicon_path)
+    return WordLookup(lexicon_path)
+
+
+@lru_cache(maxsize=None)
+def get_langid_identifier() -> LanguageIdentifier:
+    """
+    Gets a langid language identifier with normalised probabilities. The model is only loaded once per process.
+    :return: the language identifier
+    """
+    return LanguageIdentifier.from_modelstring(model, norm_probs=True)
 
 
-def get_english_words() -> Set[str]:
+def classify_transcript(transcript: str) -> Tuple[str, float]:
     """
-    Gets a list of English words from the nltk corpora (~235k words).
-    N.B: will download the word list if not already available (~740kB), requires internet.
-    :return: a set containing the English words
+    Classifies the language of a transcript with this process' langid identifier, for use in a worker pool.
+    :param transcript: the transcript to classify.
+    :return: a tuple of (language code, probability).
     """
-    nltk.download("words")  # Will only download if not locally available.
-    return set(words.words())
+    return get_langid_identifier().classify(transcript)
+
+
+class LanguageIdCache:
+    """
+    Memo of langid decisions keyed on the exact transcript, optionally persisted to a JSON Lines file so the same
+    decisions are reused across runs. langid's byte n-gram features depend on case and whitespace, so transcripts
+    are not normalised, and a cached decision is always the one langid would make. Transcripts missing from the
+    cache can be classified in bulk across a pool of worker processes.
+    """
+
+    def __init__(self, cache_file: str = None) -> None:
+        self.cache_file = cache_file
+        self.decisions: Dict[str, Tuple[str, float]] = {}
+        self.new_transcripts: List[str] = []
+        if cache_file and os.path.isfile(cache_file):
+            for entry in load_jsonl_file(cache_file):
+                self.decisions[entry["transcript"]] = (entry["language"], entry["probability"])
+
+    def classify(self, transcript: str, langid_identifier: LanguageIdentifier) -> Tuple[str, float]:
+        """
+        Classifies the language of a single transcript, using the cached decision if there is one.
+        :param transcript: the transcript to classify.
+        :param langid_identifier: language identifier object to use on a cache miss.
+        :return: a tuple of (language code, probability).
+        """
+        decision = self.decisions.get(transcript)
+        if decision is None:
+            decision = tuple(langid_identifier.classify(transcript))
+            self.decisions[transcript] = decision
+            self.new_transcripts.append(transcript)
+        return decision
+
+    def classify_all(self, transcripts: Iterable[str], pool: Pool = None) -> None:
+        """
+        Classifies every transcript that is not cached yet, in bulk across the given worker pool if any.
+        :param transcripts: the transcripts to classify.
+        :param pool: an optional pool of worker processes to classify with.
+        """
+        missing = list(dict.fromkeys(transcript for transcript in transcripts if transcript not in self.decisions))
+        if not missing:
+            return
+        if pool:
+            decisions = pool.map(classify_transcript, missing, chunksize=64)
+        else:
+            decisions = map(classify_transcript, missing)
+        for transcript, decision in zip(missing, decisions):
+            self.decisions[transcript] = tuple(decision)
+        self.new_transcripts.extend(missing)
+
+    def save(self) -> None:
+        """
+        Appends the decisions made since the cache was loaded (or last saved) to the cache file.
+        """
+        if not self.cache_file or not self.new_transcripts:
+            return
+        directory = os.path.dirname(self.cache_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.cache_file, "a", encoding="utf-8") as file:
+            for transcript in self.new_transcripts:
+                language, probability = self.decisions[transcript]
+                file.write(json.dumps({"transcript": transcript, "language": language, "probability": probability},
+                                      ensure_ascii=False) + "\n")
+        self.new_transcripts = []
 
 
 def clean_utterance(utterance: Dict[str, str],
@@ -77,7 +182,8 @@ def is_valid_utterance(clean_words: List[str],
                        english_word_count: int,
                        remove_english: bool,
                        use_langid: bool,
-                       langid_identifier: LanguageIdentifier) -> bool:
+                       langid_identifier: LanguageIdentifier,
+                       langid_cache: LanguageIdCache = None) -> bool:
     """
     Determines whether a cleaned utterance (list of words) is valid based on the provided parameters.
     :param clean_words: a list of clean word strings.
@@ -85,6 +191,7 @@ def is_valid_utterance(clean_words: List[str],
     :param remove_english: whether or not to remove english words.
     :param use_langid: whether or not to use the langid library to determine if a word is English.
     :param langid_identifier: language identifier object to use with langid library.
+    :param langid_cache: an optional cache of previous langid decisions to reuse.
     :return: True if utterance is valid, false otherwise.
     """
     # Exclude utterance if empty after cleaning
@@ -99,68 +206,269 @@ def is_valid_utterance(clean_words: List[str],
 
     # Exclude utterance if langid thinks its english
     if remove_english and use_langid:
-        lang, prob = langid_identifier.classify(cleaned_transcription)
+        if langid_cache is not None:
+            lang, prob = langid_cache.classify(cleaned_transcription, langid_identifier)
+        else:
+            lang, prob = langid_identifier.classify(cleaned_transcription)
         if lang == "en" and prob > 0.5:
             return False
     return True
 
 
-def clean_json_data(json_data: List[Dict[str, str]],
-                    remove_english: bool = False,
-                    use_langid: bool = False) -> List[Dict[str, str]]:
+class UtteranceCleaner:
     """
-    Clean a list of utterances (Python dictionaries) based on the given parameters.
-    :param json_data: list of Python dictionaries, each must have a 'transcription' key-value.
+    Batch engine applying the same rules as clean_utterance and is_valid_utterance to a stream of utterances.
+    The punctuation is compiled into a single str.translate table, the special cases into a set and the digit
+    regex is compiled once, rather than being rebuilt or rescanned for every word. When langid is used, utterances
+    are cleaned in batches and each batch's transcripts are classified together, through a LanguageIdCache and
+    optionally across a pool of worker processes.
+    """
+
+    translation_tags = frozenset({"@eng@", "<ind:", "<eng:"})
+
+    def __init__(self,
+                 remove_english: bool = False,
+                 use_langid: bool = False,
+                 english_words: Set[str] = None,
+                 punctuation: str = None,
+                 special_cases: List[str] = None,
+                 langid_identifier: LanguageIdentifier = None,
+                 langid_cache: LanguageIdCache = None,
+                 langid_jobs: int = 1,
+                 batch_size: int = 10000) -> None:
+        self.remove_english = remove_english
+        self.use_langid = remove_english and use_langid
+        self.english_words = english_words if english_words is not None else set()
+        self.punctuation_table = str.maketrans("", "", punctuation) if punctuation else None
+        self.special_cases = frozenset(special_cases) if special_cases else frozenset()
+        self.langid_identifier = langid_identifier
+        self.langid_cache = langid_cache if langid_cache is not None else LanguageIdCache()
+        self.langid_jobs = langid_jobs
+        self.batch_size = batch_size
+        self._pool: Optional[Pool] = None
+        self.digit_search = re.compile(r"\d").search
+
+    def clean_words(self, transcript: str) -> (List[str], int):
+        """
+        Cleans a single transcript, see clean_utterance.
+        :param transcript: the raw transcript string.
+        :return: a tuple with a list of 'cleaned' words and the number of English words removed.
+        """
+        transcript = transcript.lower()
+        # Most transcripts contain no digits at all, so only look for them word by word when there are some
+        check_digits = self.digit_search(transcript) is not None
+        special_cases = self.special_cases
+        translation_tags = self.translation_tags
+        punctuation_table = self.punctuation_table
+        remove_english = self.remove_english
+        english_words = self.english_words
+        clean_words = []
+        english_word_count = 0
+        for word in transcript.split():
+            if word in special_cases:
+                continue
+            if word in translation_tags:  # Translations / ignore
+                return [], 0
+            # If a word contains a digit, throw out whole utterance
+            if check_digits and self.digit_search(word) and not word.isdigit():
+                return [], 0
+            if punctuation_table:
+                word = word.translate(punctuation_table)
+            if remove_english and len(word) > 3 and word in english_words:
+                english_word_count += 1
+                continue
+            clean_words.append(word)
+        return clean_words, english_word_count
+
+    def clean_transcript_text(self, transcript: str) -> Optional[str]:
+        """
+        Cleans and validates a single transcript, applying every rule of is_valid_utterance except langid.
+        :param transcript: the raw transcript string.
+        :return: the cleaned transcript, or None if the utterance should be excluded.
+        """
+        clean_words, english_word_count = self.clean_words(transcript)
+        cleaned_transcript = " ".join(clean_words).strip()
+        if cleaned_transcript == "":
+            return None
+        # Exclude utterance if > 10% english
+        if self.remove_english and english_word_count / len(clean_words) > 0.1:
+            return None
+        return cleaned_transcript
+
+    def is_english(self, cleaned_transcript: str) -> bool:
+        """
+        Determines whether langid thinks a cleaned transcript is English, using the cached decision if there is one.
+        :param cleaned_transcript: the cleaned transcript string.
+        :return: True if the transcript is English, False otherwise.
+        """
+        lang, prob = self.langid_cache.classify(cleaned_transcript, self.langid_identifier)
+        return lang == "en" and prob > 0.5
+
+    def clean_transcript(self, transcript: str) -> Optional[str]:
+        """
+        Cleans and validates a single transcript, see is_valid_utterance.
+        :param transcript: the raw transcript string.
+        :return: the cleaned transcript, or None if the utterance should be excluded.
+        """
+        cleaned_transcript = self.clean_transcript_text(transcript)
+        # Exclude utterance if langid thinks its english
+        if cleaned_transcript is not None and self.use_langid and self.is_english(cleaned_transcript):
+            return None
+        return cleaned_transcript
+
+    def clean(self, utterances: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+        """
+        Lazily cleans a stream of utterances, updating the transcript of each valid utterance in place.
+        :param utterances: iterable of Python dictionaries, each must have a 'transcript' key-value.
+        :return: an iterator over the valid, cleaned utterances.
+        """
+        if self.use_langid:
+            yield from self._clean_with_langid(utterances)
+            return
+        clean_transcript = self.clean_transcript
+        for utterance in utterances:
+            cleaned_transcript = clean_transcript(utterance.get("transcript"))
+            if cleaned_transcript is not None:
+                utterance["transcript"] = cleaned_transcript
+                yield utterance
+
+    def _clean_with_langid(self, utterances: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+        if self.langid_jobs > 1 and self._pool is None:
+            self._pool = Pool(processes=self.langid_jobs)
+        iterator = iter(utterances)
+        for chunk in iter(lambda: list(islice(iterator, self.batch_size)), []):
+            batch = [(utterance, self.clean_transcript_text(utterance.get("transcript"))) for utterance in chunk]
+            batch = [(utterance, cleaned_transcript) for utterance, cleaned_transcript in batch
+                     if cleaned_transcript is not None]
+            self.langid_cache.classify_all((cleaned_transcript for _, cleaned_transcript in batch), self._pool)
+            for utterance, cleaned_transcript in batch:
+                if not self.is_english(cleaned_transcript):
+                    utterance["transcript"] = cleaned_transcript
+                    yield utterance
+
+    def close(self) -> None:
+        """
+        Shuts down the langid worker pool, if one was started.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+def create_utterance_cleaner(remove_english: bool = False,
+                             use_langid: bool = False,
+                             english_lexicon: str = ENGLISH_LEXICON_PATH,
+                             offline: bool = False,
+                             langid_cache: LanguageIdCache = None,
+                             langid_jobs: int = 1) -> UtteranceCleaner:
+    """
+    Creates an UtteranceCleaner with the default clean_json punctuation and special cases.
     :param remove_english: whether or not to remove English from the utterances.
     :param use_langid: whether or not to use the langid library to identify English to remove.
-    :return: cleaned list of utterances (list of dictionaries).
+    :param english_lexicon: path of the prebuilt English word lookup file.
+    :param offline: never call out to nltk for the English word list.
+    :param langid_cache: an optional cache of previous langid decisions to reuse and add to.
+    :param langid_jobs: number of worker processes to run langid in.
+    :return: the utterance cleaner.
     """
     punctuation_to_remove = string.punctuation + "…’“–”‘°"
     special_cases = ["<silence>"]  # Any words you want to ignore
     langid_identifier = None
 
     if remove_english:
-        english_words = get_english_words()  # pre-load English corpus
+        english_words = get_english_words(english_lexicon, offline)  # pre-load English corpus
         if use_langid:
-            langid_identifier = LanguageIdentifier.from_modelstring(model,
-                                                                    norm_probs=True)
+            langid_identifier = get_langid_identifier()
     else:
         english_words = set()
 
-    cleaned_data = []
-    for utterance in json_data:
-        clean_words, english_word_count = clean_utterance(utterance=utterance,
-                                                          remove_english=remove_english,
-                                                          english_words=english_words,
-                                                          punctuation=punctuation_to_remove,
-                                                          special_cases=special_cases)
+    return UtteranceCleaner(remove_english=remove_english,
+                            use_langid=use_langid,
+                            english_words=english_words,
+                            punctuation=punctuation_to_remove,
+                            special_cases=special_cases,
+                            langid_identifier=langid_identifier,
+                            langid_cache=langid_cache,
+                            langid_jobs=langid_jobs)
 
-        if is_valid_utterance(clean_words,
-                              english_word_count,
-                              remove_english,
-                              use_langid,
-                              langid_identifier):
-            cleaned_transcript = " ".join(clean_words).strip()
-            utterance["transcript"] = cleaned_transcript
-            cleaned_data.append(utterance)
 
-    return cleaned_data
+def clean_json_data(json_data: Iterable[Dict[str, str]],
+                    remove_english: bool = False,
+                    use_langid: bool = False,
+                    english_lexicon: str = ENGLISH_LEXICON_PATH,
+                    offline: bool = False) -> List[Dict[str, str]]:
+    """
+    Clean a list of utterances (Python dictionaries) based on the given parameters.
+    :param json_data: list of Python dictionaries, each must have a 'transcription' key-value.
+    :param remove_english: whether or not to remove English from the utterances.
+    :param use_langid: whether or not to use the langid library to identify English to remove.
+    :param english_lexicon: path of the prebuilt English word lookup file.
+    :param offline: never call out to nltk for the English word list.
+    :return: cleaned list of utterances (list of dictionaries).
+    """
+    cleaner = create_utterance_cleaner(remove_english, use_langid, english_lexicon, offline)
+    return list(iterate_clean_json_data(json_data, cleaner))
+
+
+def iterate_clean_json_data(json_data: Iterable[Dict[str, str]],
+                            cleaner: UtteranceCleaner) -> Iterator[Dict[str, str]]:
+    """
+    Lazily clean an iterable of utterances (Python dictionaries) with the given cleaner, yielding
+    each valid utterance as soon as it has been cleaned. The cleaner is closed once all utterances are cleaned.
+    :param json_data: iterable of Python dictionaries, each must have a 'transcription' key-value.
+    :param cleaner: the utterance cleaner to apply, see create_utterance_cleaner.
+    :return: an iterator over the cleaned utterances.
+    """
+    try:
+        yield from cleaner.clean(json_data)
+    finally:
+        cleaner.close()
+
+
+def iterate_cached_clean_json_data(json_data: Iterable[Dict[str, str]],
+                                   cleaner: UtteranceCleaner,
+                                   cache_directory: str) -> Iterator[Dict[str, str]]:
+    """
+    Lazily clean an iterable of utterances like iterate_clean_json_data, caching the result for each source
+    file. Consecutive utterances sharing an audio file are cleaned as a group, keyed on a hash of the dirty
+    utterances and the cleaning options, so only groups that changed since the last run are cleaned again.
+    :param json_data: iterable of Python dictionaries, each must have a 'transcription' key-value.
+    :param cleaner: the utterance cleaner to apply, see create_utterance_cleaner.
+    :param cache_directory: directory holding the per-file cache.
+    :return: an iterator over the cleaned utterances.
+    """
+    cache = UtteranceCache(cache_directory)
+    options = {"stage": "clean_json", "remove_english": cleaner.remove_english, "use_langid": cleaner.use_langid}
+    try:
+        for audio_file_name, utterances in groupby(json_data,
+                                                   key=lambda utterance: utterance.get("audio_file_name")):
+            utterances = list(utterances)
+            key = hash_data(utterances, options)
+            cleaned_utterances = cache.get(key)
+            if cleaned_utterances is None:
+                cleaned_utterances = list(cleaner.clean(utterances))
+                cache.put(key, cleaned_utterances)
+            yield from cleaned_utterances
+    finally:
+        cleaner.close()
 
 
 def main() -> None:
     """
     Run the entire clean_json process as a command line utility.
 
-    Usage: python3 clean_json.py [--i INFILE] [--o OUTFILE] [-r] [-u]
+    Usage: python3 clean_json.py [--i INFILE] [--o OUTFILE] [-r] [-u] [-c CACHE_DIR] [-e ENGLISH_LEXICON]
+                                 [--offline] [-l LANGID_CACHE] [-n LANGID_JOBS]
     """
     parser: ArgumentParser = ArgumentParser()
     parser.add_argument("-i", "--infile",
                         type=str,
-                        help="The path to the dirty json file to clean.",
+                        help="The path to the dirty json (or .jsonl) file to clean.",
                         required=True)
     parser.add_argument("-o", "--outfile",
                         type=str,
-                        help="The path to the clean json file to write to",
+                        help="The path to the clean json file to write to, use a .jsonl extension to stream "
+                             "JSON Lines",
                         required=True)
     parser.add_argument("-r", "--remove_eng",
                         help="Remove english like utterances",
@@ -168,21 +476,51 @@ def main() -> None:
     parser.add_argument("-u", "--use_lang_id",
                         help="Use langid library to detect English",
                         action="store_true")
+    parser.add_argument("-c", "--cache_dir",
+                        type=str,
+                        help="Directory in which to cache the cleaned utterances of each source file, "
+                             "unchanged files are read from the cache instead of being cleaned again")
+    parser.add_argument("-e", "--english_lexicon",
+                        type=str,
+                        help="Path to the prebuilt English word lookup file, built from nltk if it does not exist",
+                        default=ENGLISH_LEXICON_PATH)
+    parser.add_argument("--offline",
+                        help="Never download the English word list, requires an existing English lexicon",
+                        action="store_true")
+    parser.add_argument("-l", "--langid_cache",
+                        type=str,
+                        help="JSON Lines file in which to remember langid decisions across runs")
+    parser.add_argument("-n", "--langid_jobs",
+                        type=int,
+                        help="Number of worker processes to run langid in",
+                        default=1)
 
     arguments = parser.parse_args()
-    dirty_json_data: List[Dict[str, str]] = load_json_file(arguments.infile)
+    dirty_json_data: Iterator[Dict[str, str]] = load_utterances(arguments.infile)
     outfile = arguments.outfile if arguments.outfile else sys.stdout
 
     print(f"Filtering dirty json data {arguments.infile}...")
 
-    filtered_data = clean_json_data(json_data=dirty_json_data,
-                                    remove_english=arguments.remove_eng,
-                                    use_langid=arguments.use_lang_id)
+    langid_cache = LanguageIdCache(arguments.langid_cache)
+    cleaner = create_utterance_cleaner(remove_english=arguments.remove_eng,
+                                       use_langid=arguments.use_lang_id,
+                                       english_lexicon=arguments.english_lexicon,
+                                       offline=arguments.offline,
+                                       langid_cache=langid_cache,
+                                       langid_jobs=arguments.langid_jobs)
+    if arguments.cache_dir:
+        filtered_data = iterate_cached_clean_json_data(json_data=dirty_json_data,
+                                                       cleaner=cleaner,
+                                                       cache_directory=arguments.cache_dir)
+    else:
+        filtered_data = iterate_clean_json_data(json_data=dirty_json_data,
+                                                cleaner=cleaner)
 
-    write_data_to_json_file(data=list(filtered_data),
-                            output=outfile)
+    utterance_count = write_utterances(utterances=filtered_data,
+                                       output=outfile)
+    langid_cache.save()
 
-    print(f"Finished! Wrote {str(len(filtered_data))} transcriptions.")
+    print(f"Finished! Wrote {str(utterance_count)} transcriptions.")
 
 
 if __name__ == "__main__":
@@ -4,24 +4,48 @@
 Get all files in the repository can use recursive atm as long as we don't need numpy
 pass in corpus path throw an error if matching file wav isn"t found in the corpus directory
 
-Usage: python3 elan_to_json.py [-h] [-i INPUT_DIR] [-o OUTPUT_DIR] [-t TIER] [-j OUTPUT_JSON]
+Only the requested tier is read from each eaf file, with a streaming reader rather than a full pympi Eaf object.
+With --audio_index, the WAV files are looked up in an audio index built from their headers, rather than checked one
+by one.
+
+Usage: python3 elan_to_json.py [-h] [-i INPUT_DIR] [-o OUTPUT_DIR] [-t TIER] [-j OUTPUT_JSON] [-n JOBS]
+                               [-c CACHE_DIR] [-a AUDIO_INDEX]
 
 Copyright: University of Queensland, 2019
 Contributors:
               Nicholas Lambourne - (The University of Queensland, 2018)
 """
 
-import glob
 import sys
 import os
 import argparse
-from pympi.Elan import Eaf
-from typing import List
-from kaldi_helpers.script_utilities import find_files_by_extensions
-from kaldi_helpers.script_utilities import write_data_to_json_file
+from typing import Iterable, Iterator, List, Tuple
+from kaldi_helpers.script_utilities import scan_directory
+from kaldi_helpers.script_utilities import iterate_safely, write_utterances
+from kaldi_helpers.script_utilities import hash_file, paired_audio_path, read_eaf_tier, AudioIndex, UtteranceCache
+
+
+def check_paired_audio(input_elan_file: str, audio_index: AudioIndex = None) -> None:
+    """
+    Checks that there is a wav file next to an eaf file, with the same name.
+    :param input_elan_file: name of input_scripts elan file
+    :param audio_index: optional index to look the wav file up in, instead of checking that it exists
+    :raises ValueError: if the wav file is missing
+    """
+    input_directory, full_file_name = os.path.split(input_elan_file)
+    file_name, extension = os.path.splitext(full_file_name)
+    if audio_index is not None:
+        has_audio = audio_index.paired_audio(input_elan_file) is not None
+    else:
+        has_audio = os.path.isfile(os.path.join(input_directory, file_name + ".wav"))
+    if has_audio:
+        print("WAV file found for " + file_name, file=sys.stderr)
+    else:
+        raise ValueError(f"WAV file not found for {full_file_name}. "
+                         f"Please put it next to the eaf file in {input_directory}.")
 
 
-def process_eaf(input_elan_file: str, tier_name: str) -> List[dict]:
+def process_eaf(input_elan_file: str, tier_name: str, audio_index: AudioIndex = None) -> List[dict]:
     """
     Method to process a particular tier in an eaf file (ELAN Annotation Format). It stores the transcriptions in the 
     following format:
@@ -33,24 +57,27 @@ def process_eaf(input_elan_file: str, tier_name: str) -> List[dict]:
                     
     :param input_elan_file: name of input_scripts elan file
     :param tier_name: name of the elan tier to process. these tiers are nodes from the tree structure in the .eaf file.
+    :param audio_index: optional index to look the wav file up in, instead of checking that it exists
     :return: a list of dictionaries, where each dictionary is an annotation
     """
-    # Get paths to files
-    input_directory, full_file_name = os.path.split(input_elan_file)
-    file_name, extension = os.path.splitext(full_file_name)
+    # Look for wav file matching the eaf file in same directory
+    check_paired_audio(input_elan_file, audio_index)
+    return extract_eaf_annotations(input_elan_file, tier_name)
 
-    input_eaf = Eaf(input_elan_file)
 
-    # Look for wav file matching the eaf file in same directory
-    if os.path.isfile(os.path.join(input_directory, file_name + ".wav")):
-        print("WAV file found for " + file_name, file=sys.stderr)
-    else:
-        raise ValueError(f"WAV file not found for {full_file_name}. "
-                         f"Please put it next to the eaf file in {input_directory}.")
+def extract_eaf_annotations(input_elan_file: str, tier_name: str) -> List[dict]:
+    """
+    Extracts the annotations of a tier of an eaf file, in the format described in process_eaf, without checking for
+    its wav file.
+    :param input_elan_file: name of input_scripts elan file
+    :param tier_name: name of the elan tier to process
+    :return: a list of dictionaries, where each dictionary is an annotation
+    """
+    file_name, extension = os.path.splitext(os.path.basename(input_elan_file))
 
     # Get annotations and parameters (things like speaker id) on the target tier
-    annotations = sorted(input_eaf.get_annotation_data_for_tier(tier_name))
-    parameters = input_eaf.get_parameters_for_tier(tier_name)
+    annotations, parameters = read_eaf_tier(input_elan_file, tier_name)
+    annotations = sorted(annotations)
     speaker_id = parameters.get("PARTICIPANT", "")
 
     annotations_data = []
@@ -74,13 +101,82 @@ def process_eaf(input_elan_file: str, tier_name: str) -> List[dict]:
     return annotations_data
 
 
+def process_eaf_cached(input_elan_file: str,
+                       tier_name: str,
+                       cache_directory: str = None,
+                       audio_index: AudioIndex = None) -> List[dict]:
+    """
+    Processes an eaf file, reusing the annotations stored in the cache directory if the file contents and tier
+    are unchanged since they were last extracted. The wav file is checked for before the cache is, so a cached file
+    whose audio has since been removed still fails.
+    :param input_elan_file: name of input_scripts elan file
+    :param tier_name: name of the elan tier to process
+    :param cache_directory: directory holding the per-file cache, no caching is done if not given
+    :param audio_index: optional index to look the wav file up in, see process_eaf
+    :return: a list of dictionaries, where each dictionary is an annotation
+    """
+    check_paired_audio(input_elan_file, audio_index)
+    if not cache_directory:
+        return extract_eaf_annotations(input_elan_file, tier_name)
+    cache = UtteranceCache(cache_directory)
+    key = hash_file(input_elan_file, {"stage": "elan_to_json", "tier": tier_name})
+    annotations_data = cache.get(key)
+    if annotations_data is None:
+        annotations_data = extract_eaf_annotations(input_elan_file, tier_name)
+        cache.put(key, annotations_data)
+    return annotations_data
+
+
+def iterate_eaf_files(input_elan_files: Iterable[str],
+                      tier_name: str,
+                      jobs: int = 1,
+                      failed_files: List[Tuple[str, str]] = None,
+                      cache_directory: str = None,
+                      audio_index: AudioIndex = None) -> Iterator[dict]:
+    """
+    Lazily processes a collection of eaf files, optionally across a pool of worker processes. Files are processed in
+    sorted order and their annotations are yielded in that same order, so the output does not depend on the number
+    of jobs.
+    :param input_elan_files: paths of the eaf files to process
+    :param tier_name: name of the elan tier to process in each file
+    :param jobs: number of worker processes to use, 1 processes the files in the current process
+    :param failed_files: an optional list to append (file name, error message) to for each file that failed
+    :param cache_directory: directory holding the per-file cache, no caching is done if not given
+    :param audio_index: optional index to look the wav files up in, see process_eaf. Each file is only sent the
+                        entry of its own wav file
+    :return: an iterator over the annotations of all files
+    """
+    arguments = [(input_elan_file,
+                  tier_name,
+                  cache_directory,
+                  None if audio_index is None else audio_index.subset([paired_audio_path(input_elan_file)]))
+                 for input_elan_file in sorted(input_elan_files)]
+    yield from iterate_safely(process_eaf_cached, arguments, jobs, failed_files, chunksize=8)
+
+
+def process_eaf_files(input_elan_files: Iterable[str],
+                      tier_name: str,
+                      jobs: int = 1) -> Tuple[List[dict], List[Tuple[str, str]]]:
+    """
+    Processes a collection of eaf files, see iterate_eaf_files.
+    :param input_elan_files: paths of the eaf files to process
+    :param tier_name: name of the elan tier to process in each file
+    :param jobs: number of worker processes to use, 1 processes the files in the current process
+    :return: a tuple of (all annotations, list of (file name, error message) for each file that failed)
+    """
+    failed_files: List[Tuple[str, str]] = []
+    annotations_data = list(iterate_eaf_files(input_elan_files, tier_name, jobs, failed_files))
+    return annotations_data, failed_files
+
+
 def main():
 
     """ 
     Run the entire elan_to_json.py as a command line utility. It extracts information on speaker, audio file, 
     transcription etc. from the given tier of the specified .eaf file. 
     
-    Usage: python3 elan_to_json.py [-h] [-i INPUT_DIR] [-o OUTPUT_DIR] [-t TIER] [-j OUTPUT_JSON]
+    Usage: python3 elan_to_json.py [-h] [-i INPUT_DIR] [-o OUTPUT_DIR] [-t TIER] [-j OUTPUT_JSON] [-n JOBS]
+                                   [-c CACHE_DIR] [-a AUDIO_INDEX]
     """
 
     parser: argparse.ArgumentParser = argparse.ArgumentParser(
@@ -97,22 +193,44 @@ def main():
                         help="Target language tier name",
                         default="Phrase")
     parser.add_argument("-j", "--output_json",
-                        help="File path to output json")
+                        help="File path to output json, use a .jsonl extension to stream JSON Lines")
+    parser.add_argument("-n", "--jobs",
+                        type=int,
+                        help="Number of worker processes used to parse eaf files",
+                        default=1)
+    parser.add_argument("-c", "--cache_dir",
+                        help="Directory in which to cache the annotations of each eaf file, unchanged files are "
+                             "read from the cache instead of being parsed again")
+    parser.add_argument("-a", "--audio_index",
+                        help="Audio index file, only the headers of new or changed wav files are read")
     arguments: argparse.Namespace = parser.parse_args()
 
     # Build output_scripts directory if needed
     if not os.path.exists(arguments.output_dir):
         os.makedirs(arguments.output_dir)
 
-    all_files_in_directory = set(glob.glob(os.path.join(arguments.input_dir, "**"), recursive=True))
-    input_eafs_files = [ file_ for file_ in all_files_in_directory if file_.endswith(".eaf") ]
-
-    annotations_data = []
-
-    for input_eaf_file in input_eafs_files:
-        annotations_data.extend(process_eaf(input_eaf_file, arguments.tier))
-
-    write_data_to_json_file(annotations_data, arguments.output_json)
+    input_eafs_files = list(scan_directory(arguments.input_dir, {".eaf"}))
+
+    audio_index = None
+    if arguments.audio_index:
+        audio_index = AudioIndex(arguments.audio_index)
+        audio_index.update(arguments.input_dir)
+        audio_index.save()
+
+    failed_files: List[Tuple[str, str]] = []
+    annotations_data = iterate_eaf_files(input_eafs_files,
+                                         arguments.tier,
+                                         arguments.jobs,
+                                         failed_files,
+                                         arguments.cache_dir,
+                                         audio_index)
+    write_utterances(annotations_data, arguments.output_json)
+
+    for input_eaf_file, error in failed_files:
+        print(f"Failed to process {input_eaf_file}: {error}", file=sys.stderr)
+    if failed_files:
+        print(f"{len(failed_files)} of {len(input_eafs_files)} eaf files could not be processed.", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
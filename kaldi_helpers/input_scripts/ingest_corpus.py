@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+"""
+Ingests a corpus of mixed transcription formats into a single JSON file in one pass.
+
+The corpus directory is walked once with os.scandir, and each file is handed to the parser registered for its
+extension (ELAN .eaf, Transcriber .trs and Praat .TextGrid files by default). Every file, whatever its format, is
+parsed on one shared pool of worker processes, and the utterances are written in sorted file order, so the output
+does not depend on the number of jobs. Further formats can be added with register_parser. With --index, the listings
+of unchanged directories are read from a directory index instead, for repeated runs over the same corpus, and with
+--audio_index the WAV files paired with eaf and TextGrid files are looked up in an audio index built from their headers.
+
+Usage: python3 ingest_corpus.py [-h] [-i INPUT_DIR] -j OUTPUT_JSON [-f FORMAT [FORMAT ...]] [-t TIER]
+                                [-g TEXTGRID_TIER [TEXTGRID_TIER ...]] [-n JOBS] [-c CACHE_DIR] [-x INDEX]
+                                [-a AUDIO_INDEX]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import os
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from kaldi_helpers.input_scripts.elan_to_json import process_eaf_cached
+from kaldi_helpers.input_scripts.textgrid_to_json import DEFAULT_TIERS, process_textgrid_file
+from kaldi_helpers.input_scripts.trs_to_json import process_trs
+from kaldi_helpers.script_utilities import iterate_safely, paired_audio_path, scan_directory, write_utterances
+from kaldi_helpers.script_utilities import AudioIndex, DirectoryIndex
+
+# A parser takes the path of a transcription file and the ingestion options, and returns its utterances
+Parser = Callable[[str, dict], List[dict]]
+
+PARSERS: Dict[str, Parser] = {}
+
+
+def register_parser(extension: str, parser: Parser) -> None:
+    """
+    Registers the parser for files with the given extension. Extensions are matched case insensitively, and a later
+    registration replaces an earlier one.
+    :param extension: the file extension, including the dot, e.g. ".eaf"
+    :param parser: function taking (file name, options) and returning a list of utterances
+    """
+    PARSERS[extension.lower()] = parser
+
+
+def parse_eaf(file_name: str, options: dict) -> List[dict]:
+    """
+    Parses an ELAN file, see elan_to_json.process_eaf_cached.
+    :param file_name: path of the eaf file
+    :param options: ingestion options, using "tier", "cache_dir" and "audio_index"
+    :return: the utterances of the file
+    """
+    return process_eaf_cached(file_name, options.get("tier", "Phrase"), options.get("cache_dir"),
+                              options.get("audio_index"))
+
+
+def parse_trs(file_name: str, options: dict) -> List[dict]:
+    """
+    Parses a Transcriber file, see trs_to_json.process_trs.
+    :param file_name: path of the trs file
+    :param options: ingestion options, using "verbose"
+    :return: the utterances of the file
+    """
+    return process_trs(file_name, options.get("verbose", False))
+
+
+def parse_textgrid(file_name: str, options: dict) -> List[dict]:
+    """
+    Parses a Praat TextGrid file, see textgrid_to_json.process_textgrid_file.
+    :param file_name: path of the TextGrid file
+    :param options: ingestion options, using "textgrid_tiers" and "audio_index"
+    :return: the utterances of the file
+    """
+    return process_textgrid_file(file_name, options.get("textgrid_tiers", DEFAULT_TIERS), options.get("audio_index"))
+
+
+register_parser(".eaf", parse_eaf)
+register_parser(".trs", parse_trs)
+register_parser(".textgrid", parse_textgrid)
+
+
+def ingest_file(file_name: str, parser: Parser, options: dict) -> List[dict]:
+    """
+    Parses a single file. The parser is passed along with the file rather than looked up in the worker, so parsers
+    registered at runtime are also used by workers that were started rather than forked.
+    :param file_name: path of the file
+    :param parser: the parser registered for the extension of the file
+    :param options: options passed to the parser, see iterate_corpus
+    :return: the utterances of the file
+    """
+    return parser(file_name, options)
+
+
+def iterate_corpus(input_directory: str,
+                   options: dict = None,
+                   extensions: Iterable[str] = None,
+                   jobs: int = 1,
+                   failed_files: List[Tuple[str, str]] = None,
+                   index: DirectoryIndex = None,
+                   audio_index: AudioIndex = None) -> Iterator[dict]:
+    """
+    Lazily ingests every transcription file in a corpus, optionally across a pool of worker processes shared by all
+    formats. Files are parsed in sorted order and their utterances are yielded in that same order.
+    :param input_directory: root of the corpus
+    :param options: options passed to every parser: "tier" (ELAN tier), "textgrid_tiers" (TextGrid tier names),
+                    "cache_dir" (ELAN cache directory) and "verbose" (log TRS processing)
+    :param extensions: the extensions to ingest, defaults to every registered extension
+    :param jobs: number of worker processes to use, 1 parses the files in the current process
+    :param failed_files: an optional list to append (file name, error message) to for each file that failed
+    :param index: optional directory index to read unchanged directory listings from
+    :param audio_index: optional index to look up the audio paired with each file in, passed to the parsers as the
+                        "audio_index" option. Each file is only sent the entry of its own audio
+    :return: an iterator over the utterances of all files
+    """
+    extensions = PARSERS.keys() if extensions is None else [extension.lower() for extension in extensions]
+    unknown_extensions = set(extensions) - PARSERS.keys()
+    if unknown_extensions:
+        raise ValueError(f"No parser registered for {', '.join(sorted(unknown_extensions))}")
+    file_names = sorted(scan_directory(input_directory, extensions, index=index))
+    options = options or {}
+    arguments = []
+    for file_name in file_names:
+        file_options = options
+        if audio_index is not None:
+            file_options = dict(options, audio_index=audio_index.subset([paired_audio_path(file_name)]))
+        arguments.append((file_name, PARSERS[os.path.splitext(file_name)[1].lower()], file_options))
+    yield from iterate_safely(ingest_file, arguments, jobs, failed_files, chunksize=8)
+
+
+def main() -> None:
+    """
+    Run the entire ingest_corpus.py as a command line utility.
+
+    Usage: python3 ingest_corpus.py [-h] [-i INPUT_DIR] -j OUTPUT_JSON [-f FORMAT [FORMAT ...]] [-t TIER]
+                                    [-g TEXTGRID_TIER [TEXTGRID_TIER ...]] [-n JOBS] [-c CACHE_DIR] [-x INDEX]
+                                    [-a AUDIO_INDEX]
+    """
+    parser = argparse.ArgumentParser(description="Convert a folder of .eaf, .trs and .TextGrid files to a single "
+                                                 "JSON file in one pass.")
+    parser.add_argument("-i", "--input_dir",
+                        help="Directory of audio and transcription files",
+                        default="working_dir/input/data/")
+    parser.add_argument("-j", "--output_json",
+                        help="File path to output json, use a .jsonl extension to stream JSON Lines",
+                        required=True)
+    parser.add_argument("-f", "--format",
+                        nargs="+",
+                        help="Extensions of the formats to ingest, defaults to all of them",
+                        choices=sorted(PARSERS),
+                        type=str.lower)
+    parser.add_argument("-t", "--tier",
+                        help="Target language tier name of the eaf files",
+                        default="Phrase")
+    parser.add_argument("-g", "--textgrid_tier",
+                        nargs="+",
+                        help="Names of the TextGrid tiers to extract",
+                        default=DEFAULT_TIERS)
+    parser.add_argument("-n", "--jobs",
+                        type=int,
+                        help="Number of worker processes used to parse files",
+                        default=1)
+    parser.add_argument("-c", "--cache_dir",
+                        help="Directory in which to cache the annotations of each eaf file")
+    parser.add_argument("-x", "--index",
+                        help="Directory index file, unchanged directories are read from it instead of being listed")
+    parser.add_argument("-a", "--audio_index",
+                        help="Audio index file, only the headers of new or changed wav files are read")
+    parser.add_argument("-v", "--verbose",
+                        help="Log the processing of each trs file",
+                        action="store_true")
+    arguments = parser.parse_args()
+
+    options = {"tier": arguments.tier,
+               "textgrid_tiers": arguments.textgrid_tier,
+               "cache_dir": arguments.cache_dir,
+               "verbose": arguments.verbose}
+    index = DirectoryIndex(arguments.index) if arguments.index else None
+    audio_index = None
+    if arguments.audio_index:
+        audio_index = AudioIndex(arguments.audio_index)
+        audio_index.update(arguments.input_dir, index)
+        audio_index.save()
+    failed_files: List[Tuple[str, str]] = []
+    utterances = iterate_corpus(arguments.input_dir, options, arguments.format, arguments.jobs, failed_files, index,
+                                audio_index)
+    write_utterances(utterances, arguments.output_json)
+    if index is not None:
+        index.save()
+
+    for file_name, error in failed_files:
+        print(f"Failed to process {file_name}: {error}", file=sys.stderr)
+    if failed_files:
+        print(f"{len(failed_files)} files could not be processed.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
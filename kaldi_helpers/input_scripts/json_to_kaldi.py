@@ -10,7 +10,13 @@ testing :
     corpus.txt, text, segments, wav.scp, utt2spk, spk2utt
             
 The training folder is for the model creation using Kaldi, whereas the testing folder is used for verifying the 
-reliability of the model.
+reliability of the model. By default every tenth utterance goes to testing; the split can instead group utterances
+by speaker or recording, be stratified by duration and use a seeded hash (see DataSplitter). The speaker or
+recording groups of a split can be saved to a split manifest so later builds reuse it.
+
+By default speaker, recording and utterance ids are random. With --deterministic_ids they are instead derived from
+the audio file name, speaker and start/stop times, so rebuilding from the same data gives identical Kaldi files and
+Kaldi's feature extraction outputs can be reused between builds.
 
 Copyright: University of Queensland, 2019
 Contributors:
@@ -19,13 +25,16 @@ Contributors:
 """
 
 import argparse
-import glob
-import json
 import os
 import re
 import uuid
-from typing import Dict, List
+from typing import Dict, Iterator, List
 from _io import TextIOWrapper
+from kaldi_helpers.script_utilities import load_utterances, scan_directory, ExternalSorter, DEFAULT_BUFFER_LINES
+from kaldi_helpers.script_utilities import DataSplitter, GROUP_BY_OPTIONS, SPLIT_METHODS, TESTING
+
+# Namespace for the name based (version 5) uuids used as deterministic ids
+KALDI_ID_NAMESPACE = uuid.UUID("5f3c4d0e-7a8b-5c61-9d2e-4b7f1a6c8e90")
 
 
 def extract_additional_corpora(file_name: str, kaldi_corpus: str) -> None:
@@ -64,24 +73,32 @@ def clean_corpus_file(corpus_file_path: str) -> List[str]:
 
 class KaldiInput:
     """
-    Class to store information for the training and testing data sets.     
+    Class to store information for the training and testing data sets. Lines for each Kaldi file are collected
+    in an ExternalSorter, so at most buffer_lines lines per file are held in memory and the rest are spilled to
+    sorted temporary files which are merged when the Kaldi files are written.
     """
 
-    def __init__(self, output_folder: str) -> None:
+    def __init__(self,
+                 output_folder: str,
+                 deterministic_ids: bool = False,
+                 buffer_lines: int = DEFAULT_BUFFER_LINES) -> None:
 
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
+        self.deterministic_ids = deterministic_ids
+        self.id_counts: Dict[str, int] = {}
+
         self.speakers: Dict[str, str] = {}
         self.recordings: Dict[str, str] = {}
         self.utterances: Dict[str, str] = {}
 
-        self.segments_list: List[str] = []
-        self.transcripts_list: List[str] = []
-        self.speakers_list: List[str] = []
-        self.recordings_list: List[str] = []
-        self.utt2spk_list: List[str] = []
-        self.corpus_list: List[str] = []
+        self.segments_list = ExternalSorter(buffer_lines)
+        self.transcripts_list = ExternalSorter(buffer_lines)
+        self.speakers_list = ExternalSorter(buffer_lines)
+        self.recordings_list = ExternalSorter(buffer_lines)
+        self.utt2spk_list = ExternalSorter(buffer_lines)
+        self.corpus_list = ExternalSorter(buffer_lines)
 
         self.segments_file: TextIOWrapper = open(f"{output_folder}/segments", "w", encoding="utf-8")
         self.transcripts_file: TextIOWrapper = open(f"{output_folder}/text", "w", encoding="utf-8")
@@ -90,6 +107,27 @@ class KaldiInput:
         self.utt2spk_file: TextIOWrapper = open(f"{output_folder}/utt2spk", "w", encoding="utf-8")
         self.corpus_file: TextIOWrapper = open(f"{output_folder}/corpus.txt", "w", encoding="utf-8")
 
+    def make_id(self, kind: str, *parts: object, numbered: bool = False) -> str:
+        """
+        Creates a new id. In deterministic mode the id is a name based uuid of the kind and parts, otherwise a
+        random uuid. The name only depends on the item itself, so ids survive other items being added or removed.
+        Exact repeats of items that can repeat, such as utterances, are numbered so that their ids stay unique.
+
+        :param kind: what the id is for, e.g. "speaker", "recording" or "utterance"
+        :param parts: the values identifying the item, e.g. audio file name and start/stop times
+        :param numbered: number repeats of the same kind and parts
+        :return: the id
+        """
+        if not self.deterministic_ids:
+            return str(uuid.uuid4())
+        name = "|".join([kind] + [str(part) for part in parts])
+        if numbered:
+            count = self.id_counts.get(name, 0)
+            self.id_counts[name] = count + 1
+            if count:
+                name = f"{name}|{count}"
+        return str(uuid.uuid5(KALDI_ID_NAMESPACE, name))
+
     def add_speaker(self, speaker_id: str) -> str:
         """
         Adds a speaker element if it is not already present.
@@ -98,7 +136,7 @@ class KaldiInput:
         :return: returns the correctly formatted speaker id 
         """
         if speaker_id not in self.speakers:
-            self.speakers[speaker_id] = str(uuid.uuid4())  # create speaker id
+            self.speakers[speaker_id] = self.make_id("speaker", speaker_id)  # create speaker id
             self.speakers_list.append(f"{self.speakers[speaker_id]} \n")  # writing gender
         return self.speakers[speaker_id]
 
@@ -110,7 +148,7 @@ class KaldiInput:
         :return: returns a correctly formatted audio file description
         """
         if audio_file not in self.recordings:
-            self.recordings[audio_file] = str(uuid.uuid4())  # Create recording id
+            self.recordings[audio_file] = self.make_id("recording", audio_file)  # Create recording id
             self.recordings_list.append(f"{self.recordings[audio_file]} ./{audio_file}\n")
         return self.recordings[audio_file]
 
@@ -143,32 +181,18 @@ class KaldiInput:
     def write_and_close(self) -> None:
         """
         After parsing the json file and populating the segments, transcripts, speakers, recordings, utt2spk and corpus 
-        lists with data, this function performs the final write to their respective files.
+        lists with data, this function performs the final sorted write to their respective files.
         """
 
-        self.segments_list.sort()
-        self.segments_file.write("".join(self.segments_list))
-        self.segments_file.close()
-
-        self.transcripts_list.sort()
-        self.transcripts_file.write("".join(self.transcripts_list))
-        self.transcripts_file.close()
-
-        self.speakers_list.sort()
-        self.speakers_file.write("".join(self.speakers_list))
-        self.speakers_file.close()
-
-        self.recordings_list.sort()
-        self.recordings_file.write("".join(self.recordings_list))
-        self.recordings_file.close()
-
-        self.utt2spk_list.sort()
-        self.utt2spk_file.write("".join(self.utt2spk_list))
-        self.utt2spk_file.close()
-
-        self.corpus_list.sort()
-        self.corpus_file.write("".join(self.corpus_list))
-        self.corpus_file.close()
+        for sorter, file in [(self.segments_list, self.segments_file),
+                             (self.transcripts_list, self.transcripts_file),
+                             (self.speakers_list, self.speakers_file),
+                             (self.recordings_list, self.recordings_file),
+                             (self.utt2spk_list, self.utt2spk_file),
+                             (self.corpus_list, self.corpus_file)]:
+            sorter.write_to(file)
+            sorter.close()
+            file.close()
 
 
 def extract_transcript(input_set: KaldiInput,
@@ -184,17 +208,22 @@ def extract_transcript(input_set: KaldiInput,
     start_ms: int = json_transcript.get("start_ms", 0)
     stop_ms: int = json_transcript.get("stop_ms", 0)
 
+    audio_file: str = json_transcript.get("audio_file_name", "").replace("\\", "/")
+
     # Speaker ID is not available in textgrid files
     if "speaker_id" in json_transcript:
         speaker_id: str = json_transcript.get("speaker_id", "")
     else:
-        speaker_id: str = str(uuid.uuid4())
-
-    audio_file: str = json_transcript.get("audio_file_name", "").replace("\\", "/")
+        speaker_id: str = input_set.make_id("unknown speaker", audio_file, start_ms, stop_ms, numbered=True)
 
     speaker_id = input_set.add_speaker(speaker_id)  # add speaker id
     recording_id: str = input_set.add_recording(audio_file)  # add audio file name
-    utterance_id: str = speaker_id + "-" + str(uuid.uuid4())  # add utterance id
+    utterance_id: str = speaker_id + "-" + input_set.make_id("utterance",
+                                                             audio_file,
+                                                             speaker_id,
+                                                             start_ms,
+                                                             stop_ms,
+                                                             numbered=True)  # add utterance id
     input_set.add(recording_id,
                   speaker_id,
                   utterance_id,
@@ -208,31 +237,41 @@ def create_kaldi_structure(input_json: str,
                            output_folder: str,
                            silence_markers: bool,
                            text_corpus: str,
-                           corpus_file: str) -> None:
+                           corpus_file: str,
+                           deterministic_ids: bool = False,
+                           buffer_lines: int = DEFAULT_BUFFER_LINES,
+                           splitter: DataSplitter = None) -> None:
     """
     Create a full Kaldi input structure based upon a json list of transcriptions and an optional
     text corpus.
-    :param input_json: the path to a json file with a list of transcriptions
+    :param input_json: the path to a json (or .jsonl) file with a list of transcriptions
     :param output_folder: the folder in which to create the kaldi file stucture
     :param silence_markers: boolean condition indicating whether to include silence markers
     :param text_corpus: path to the directory containing the text corpus
     :param corpus_file: the path to the file to write all corpus examples to
+    :param deterministic_ids: derive ids from the transcriptions rather than generating random ones
+    :param buffer_lines: number of lines per Kaldi file to sort in memory before spilling to disk
+    :param splitter: assigns utterances to the training or testing set, defaults to every tenth utterance testing
     """
-    testing_input = KaldiInput(output_folder=f"{output_folder}/testing")
-    training_input = KaldiInput(output_folder=f"{output_folder}/training")
-
-    try:
-        with open(input_json, "r") as input_file:
-            json_transcripts: str = json.loads(input_file.read())
-    except FileNotFoundError:
+    testing_input = KaldiInput(output_folder=f"{output_folder}/testing",
+                               deterministic_ids=deterministic_ids,
+                               buffer_lines=buffer_lines)
+    training_input = KaldiInput(output_folder=f"{output_folder}/training",
+                                deterministic_ids=deterministic_ids,
+                                buffer_lines=buffer_lines)
+
+    if not os.path.isfile(input_json):
         print(f"JSON file could not be found: {input_json}")
         return
+    json_transcripts: Iterator[dict] = load_utterances(input_json)
 
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for i, json_transcript in enumerate(json_transcripts):
-        if i % 10 == 0:
+    if splitter is None:
+        splitter = DataSplitter()
+    for json_transcript in json_transcripts:
+        if splitter.assign(json_transcript) == TESTING:
             extract_transcript(input_set=testing_input,
                                json_transcript=json_transcript,
                                silence_markers=silence_markers)
@@ -244,18 +283,14 @@ def create_kaldi_structure(input_json: str,
     if text_corpus:
         text_corpus_directory = text_corpus
         print(f"Using additional text corpus at {text_corpus_directory}")
-        all_files_in_dir = set(glob.glob(os.path.join(text_corpus_directory, "**"), recursive=True))
-        only_text = []
-        for file_ in all_files_in_dir:
-            file_name, extension = os.path.splitext(file_)
-            if extension == ".txt":
-                only_text.append(file_)
-        for corpora_file in only_text:
+        for corpora_file in scan_directory(text_corpus_directory, {".txt"}):
             extract_additional_corpora(corpora_file, corpus_file)
             training_input.corpus_list.extend(clean_corpus_file(corpora_file))
     else:
         print("No additional text corpus provided.")
 
+    splitter.save()
+
     testing_input.write_and_close()
     training_input.write_and_close()
 
@@ -264,13 +299,16 @@ def main() -> None:
     """ 
     Run the entire json_to_kaldi.py as a command line utility. 
     
-    Usage: python3 json_to_kaldi.py -i INPUT_JSON -o OUTPUT_FOLDER [-s] [-t TEXT_CORPUS] [-c CORPUS_FILE]
+    Usage: python3 json_to_kaldi.py -i INPUT_JSON -o OUTPUT_FOLDER [-s] [-t TEXT_CORPUS] [-c CORPUS_FILE] [-d]
+                                   [-b BUFFER_LINES] [--test_fraction TEST_FRACTION] [--group_by GROUP_BY]
+                                   [--split_method SPLIT_METHOD] [--duration_bins DURATION_BINS] [--seed SEED]
+                                   [-m SPLIT_MANIFEST]
     """
     parser = argparse.ArgumentParser(description="Convert json from stdin to Kaldi input_scripts files "
                                                  "(in output_scripts-folder).")
     parser.add_argument("-i", "--input_json",
                         type=str,
-                        help="The input_scripts json file",
+                        help="The input_scripts json (or .jsonl) file",
                         required=True)
     parser.add_argument("-o", "--output_folder",
                         type=str,
@@ -287,13 +325,55 @@ def main() -> None:
                         type=str,
                         help="Path to the corpus.txt file to write text examples to",
                         required=False)
+    parser.add_argument("-d", "--deterministic_ids",
+                        action="store_true",
+                        help="Derive speaker, recording and utterance ids from the data so rebuilds are identical",
+                        required=False)
+    parser.add_argument("-b", "--buffer_lines",
+                        type=int,
+                        help="Number of lines per Kaldi file to sort in memory before spilling to temporary files",
+                        default=DEFAULT_BUFFER_LINES)
+    parser.add_argument("--test_fraction",
+                        type=float,
+                        help="Fraction of utterance groups to put in the testing set",
+                        default=0.1)
+    parser.add_argument("--group_by",
+                        choices=GROUP_BY_OPTIONS,
+                        help="Keep all utterances of a speaker or recording in the same set",
+                        default="utterance")
+    parser.add_argument("--split_method",
+                        choices=SPLIT_METHODS,
+                        help="interleave sends every n-th group to testing, hash uses a seeded hash of each group",
+                        default="interleave")
+    parser.add_argument("--duration_bins",
+                        type=str,
+                        help="Comma separated utterance durations in ms at which to stratify the split, e.g. 2000,5000",
+                        default="")
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Seed for the hash split method",
+                        default=0)
+    parser.add_argument("-m", "--split_manifest",
+                        type=str,
+                        help="JSON file to save the speaker or recording groups of the split to, and to reuse them "
+                             "from on later builds",
+                        required=False)
     arguments = parser.parse_args()
 
+    splitter = DataSplitter(test_fraction=arguments.test_fraction,
+                            group_by=arguments.group_by,
+                            method=arguments.split_method,
+                            duration_bins=[int(duration) for duration in arguments.duration_bins.split(",") if duration],
+                            seed=arguments.seed,
+                            manifest_file=arguments.split_manifest)
     create_kaldi_structure(input_json=arguments.input_json,
                            output_folder=arguments.output_folder,
                            silence_markers=arguments.silence_markers,
                            text_corpus=arguments.text_corpus,
-                           corpus_file=arguments.corpus_file)
+                           corpus_file=arguments.corpus_file,
+                           deterministic_ids=arguments.deterministic_ids,
+                           buffer_lines=arguments.buffer_lines,
+                           splitter=splitter)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+
+"""
+Builds an n-gram count index from cleaned utterances and text corpora, and writes the counts in the SRILM counts
+format read by `ngram-count -read`, so the language model no longer has to be counted from corpus.txt by run.sh.
+
+Each source file (a .json/.jsonl file of utterances, or a text file with one sentence per line) is counted into its
+own shard. Counts are held as numpy arrays of word ids sorted by n-gram, so shards are compact and are merged by
+sorting and summing. With --cache_dir each shard is stored under a hash of its source file and the n-gram order, so
+when text is added only new or changed sources are counted again.
+
+Usage: python3 make_ngram_counts.py [-h] -i INPUT [INPUT ...] -o OUTFILE [-n ORDER] [-c CACHE_DIR]
+
+Copyright: University of Queensland, 2019
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, TextIO, Tuple
+from kaldi_helpers.script_utilities import hash_file, is_jsonl_file, load_utterances
+
+SENTENCE_START = "<s>"
+SENTENCE_END = "</s>"
+KEY_TYPE = np.uint32
+COUNT_TYPE = np.uint64
+
+
+def merge_sorted_counts(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sorts n-grams and sums the counts of repeated n-grams.
+    :param keys: array of shape (number of n-grams, n) holding the word ids of each n-gram
+    :param counts: array of the count of each n-gram
+    :return: the sorted, unique keys and their summed counts
+    """
+    if len(keys) == 0:
+        return keys, counts
+    order = np.lexsort(keys.T[::-1])
+    keys, counts = keys[order], counts[order]
+    starts = np.concatenate(([True], np.any(keys[1:] != keys[:-1], axis=1)))
+    return keys[starts], np.add.reduceat(counts, np.flatnonzero(starts))
+
+
+class NGramCounts:
+    """
+    Counts of every n-gram up to a given order. Words are mapped to integer ids, and for each order the n-grams are
+    kept as a sorted array of word ids with an array of counts. New sentences are buffered as word ids and counted
+    into the arrays by compact, which add_sentences calls every so often to bound memory use.
+    """
+
+    def __init__(self, order: int = 3) -> None:
+        self.order = order
+        self.vocabulary: Dict[str, int] = {}
+        self.words: List[str] = []
+        self.keys = [np.zeros((0, n), dtype=KEY_TYPE) for n in range(1, order + 1)]
+        self.counts = [np.zeros(0, dtype=COUNT_TYPE) for _ in range(order)]
+        self.pending: List[int] = []
+        self.pending_sentences: List[int] = []
+
+    def word_id(self, word: str) -> int:
+        """
+        Gives the id of a word, adding it to the vocabulary if needed.
+        :param word: the word
+        :return: the word id
+        """
+        word_id = self.vocabulary.get(word)
+        if word_id is None:
+            word_id = self.vocabulary[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def add_sentence(self, words: List[str]) -> None:
+        """
+        Counts the n-grams of a sentence, including the sentence start and end markers.
+        :param words: the words of the sentence
+        """
+        word_id = self.word_id
+        sentence = len(self.pending_sentences) and self.pending_sentences[-1] + 1
+        self.pending.append(word_id(SENTENCE_START))
+        self.pending.extend(word_id(word) for word in words)
+        self.pending.append(word_id(SENTENCE_END))
+        self.pending_sentences.extend([sentence] * (len(words) + 2))
+
+    def add_sentences(self, sentences: Iterable[List[str]], compact_every: int = 100000) -> None:
+        """
+        Counts the n-grams of many sentences.
+        :param sentences: the sentences, each a list of words
+        :param compact_every: number of sentences after which pending counts are merged into the arrays
+        """
+        for index, words in enumerate(sentences, start=1):
+            self.add_sentence(words)
+            if index % compact_every == 0:
+                self.compact()
+        self.compact()
+
+    def compact(self) -> None:
+        """
+        Counts the buffered sentences into the sorted arrays.
+        """
+        if not self.pending:
+            return
+        word_ids = np.array(self.pending, dtype=KEY_TYPE)
+        sentences = np.array(self.pending_sentences, dtype=np.int64)
+        for n in range(1, self.order + 1):
+            length = len(word_ids) - n + 1
+            if length <= 0:
+                break
+            # Only keep n-grams that start and end in the same sentence
+            within_sentence = sentences[:length] == sentences[n - 1:]
+            pending_keys = np.stack([word_ids[i:i + length] for i in range(n)], axis=1)[within_sentence]
+            self.keys[n - 1], self.counts[n - 1] = merge_sorted_counts(
+                np.concatenate((self.keys[n - 1], pending_keys)),
+                np.concatenate((self.counts[n - 1], np.ones(len(pending_keys), dtype=COUNT_TYPE))))
+        self.pending = []
+        self.pending_sentences = []
+
+    def merge(self, other: "NGramCounts") -> None:
+        """
+        Adds the counts of another index, e.g. a shard counted from another source file.
+        :param other: the counts to add, of at least this order
+        """
+        self.compact()
+        other.compact()
+        id_map = np.array([self.word_id(word) for word in other.words], dtype=KEY_TYPE)
+        for n in range(1, self.order + 1):
+            if len(other.keys[n - 1]) == 0:
+                continue
+            self.keys[n - 1], self.counts[n - 1] = merge_sorted_counts(
+                np.concatenate((self.keys[n - 1], id_map[other.keys[n - 1]])),
+                np.concatenate((self.counts[n - 1], other.counts[n - 1])))
+
+    def totals(self) -> List[int]:
+        """
+        Gives the number of distinct n-grams of each order, as listed in the \\data\\ section of an ARPA file.
+        :return: a list of totals, unigrams first
+        """
+        self.compact()
+        return [len(keys) for keys in self.keys]
+
+    def iterate_counts(self) -> Iterator[Tuple[Tuple[str, ...], int]]:
+        """
+        Lazily yields every n-gram with its count, unigrams first.
+        :return: an iterator over (words, count) tuples
+        """
+        self.compact()
+        words = self.words
+        for keys, counts in zip(self.keys, self.counts):
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                yield tuple(words[word_id] for word_id in key), count
+
+    def write_counts(self, output_file: TextIO) -> int:
+        """
+        Writes the counts in the SRILM counts format, one n-gram per line followed by a tab and its count.
+        :param output_file: open text file to write to
+        :return: the number of n-grams written
+        """
+        written = 0
+        for words, count in self.iterate_counts():
+            output_file.write(f"{' '.join(words)}\t{count}\n")
+            written += 1
+        return written
+
+    def save(self, file_path: str) -> None:
+        """
+        Saves the counts to a numpy .npz file. It is written to a temporary file first and then moved into place.
+        :param file_path: path of the file to write
+        """
+        self.compact()
+        directory = os.path.dirname(file_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        arrays = {"words": np.array(self.words, dtype=str)}
+        for n in range(1, self.order + 1):
+            arrays[f"keys_{n}"] = self.keys[n - 1]
+            arrays[f"counts_{n}"] = self.counts[n - 1]
+        temporary_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "NGramCounts":
+        """
+        Loads counts saved by save.
+        :param file_path: path of the file to read
+        :return: the counts
+        """
+        with np.load(file_path) as arrays:
+            order = sum(1 for name in arrays.files if name.startswith("keys_"))
+            counts = cls(order)
+            counts.words = arrays["words"].tolist()
+            counts.vocabulary = {word: word_id for word_id, word in enumerate(counts.words)}
+            for n in range(1, order + 1):
+                counts.keys[n - 1] = arrays[f"keys_{n}"].reshape(-1, n).astype(KEY_TYPE)
+                counts.counts[n - 1] = arrays[f"counts_{n}"].astype(COUNT_TYPE)
+        return counts
+
+
+def iterate_sentences(file_name: str) -> Iterator[List[str]]:
+    """
+    Lazily yields the sentences of a source file: the transcripts of a .json or .jsonl file of utterances, or
+    otherwise the lines of a text file.
+    :param file_name: path of the source file
+    :return: an iterator over sentences, each a list of words
+    """
+    if is_jsonl_file(file_name) or file_name.endswith(".json"):
+        for utterance in load_utterances(file_name):
+            words = utterance.get("transcript", "").split()
+            if words:
+                yield words
+    else:
+        with open(file_name, "r", encoding="utf-8") as file:
+            for line in file:
+                words = line.split()
+                if words:
+                    yield words
+
+
+def shard_path(cache_directory: str, key: str) -> str:
+    """
+    Gives the path of the cached shard for a key, sharded by the first two characters of the key.
+    :param cache_directory: directory holding the cached shards
+    :param key: a hash produced by hash_file
+    :return: the path of the shard
+    """
+    return os.path.join(cache_directory, key[:2], key + ".npz")
+
+
+def count_source(file_name: str, order: int, cache_directory: str = None) -> NGramCounts:
+    """
+    Counts the n-grams of a single source file, reusing the cached shard if the file has not changed.
+    :param file_name: path of the source file
+    :param order: the highest n-gram order to count
+    :param cache_directory: optional directory in which to cache the shard
+    :return: the counts of the source file
+    """
+    path = None
+    if cache_directory:
+        path = shard_path(cache_directory, hash_file(file_name, {"stage": "make_ngram_counts", "order": order}))
+        if os.path.isfile(path):
+            return NGramCounts.load(path)
+    counts = NGramCounts(order)
+    counts.add_sentences(iterate_sentences(file_name))
+    if path:
+        counts.save(path)
+    return counts
+
+
+def build_ngram_counts(file_names: List[str], order: int = 3, cache_directory: str = None) -> NGramCounts:
+    """
+    Counts the n-grams of every source file and merges the shards.
+    :param file_names: paths of the source files
+    :param order: the highest n-gram order to count
+    :param cache_directory: optional directory in which to cache the shard of each source file
+    :return: the merged counts
+    """
+    counts = NGramCounts(order)
+    for file_name in sorted(file_names):
+        counts.merge(count_source(file_name, order, cache_directory))
+    return counts
+
+
+def main() -> None:
+    """
+    Run the entire make_ngram_counts.py as a command line utility.
+
+    Usage: python3 make_ngram_counts.py [-h] -i INPUT [INPUT ...] -o OUTFILE [-n ORDER] [-c CACHE_DIR]
+    """
+    parser = argparse.ArgumentParser(description="Count n-grams of utterances and text corpora for ngram-count.")
+    parser.add_argument("-i", "--input",
+                        type=str,
+                        nargs="+",
+                        required=True,
+                        help="Source files: .json/.jsonl utterances or text files with one sentence per line")
+    parser.add_argument("-o", "--outfile",
+                        type=str,
+                        required=True,
+                        help="The path of the file to write the counts to")
+    parser.add_argument("-n", "--order",
+                        type=int,
+                        default=3,
+                        help="The highest n-gram order to count")
+    parser.add_argument("-c", "--cache_dir",
+                        type=str,
+                        required=False,
+                        help="Directory in which to cache the counts of each source file")
+    arguments = parser.parse_args()
+
+    file_names = [file_name for file_name in arguments.input if os.path.isfile(file_name)]
+    for file_name in set(arguments.input) - set(file_names):
+        print(f"WARNING: Source file {file_name} does not exist, skipping!", file=sys.stderr)
+
+    counts = build_ngram_counts(file_names, arguments.order, arguments.cache_dir)
+    with open(arguments.outfile, "w", encoding="utf-8") as output_file:
+        counts.write_counts(output_file)
+
+    totals = ", ".join(f"{n}-grams: {total}" for n, total in enumerate(counts.totals(), start=1))
+    print(f"Wrote counts to {arguments.outfile} ({totals})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
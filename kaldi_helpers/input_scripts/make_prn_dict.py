@@ -3,14 +3,24 @@
 """
 This is script automatically builds a pronunciation (word->sounds) dictionary
 
+Words can be converted in chunks across a pool of worker processes (--jobs), and pronunciations can be cached
+(--cache_dir) keyed on a hash of the letter to sound config, so a rebuild only converts words it has not seen.
+
 Copyright: University of Queensland, 2019
 Contributors:
 
 """
 
 import argparse
+import re
 import sys
-from typing import List, Tuple, Set, TextIO
+from itertools import islice
+from multiprocessing import Pool
+from typing import Dict, List, Tuple, Set, TextIO
+from kaldi_helpers.script_utilities import hash_data, UtteranceCache
+
+# Sound mapper of each worker process, see initialise_worker
+_worker_sound_mapper = None
 
 
 def extract_words(input_file_name: str) -> List[str]:
@@ -80,29 +90,130 @@ def generate_sound_mapping(word: str,
     output_file.write(' '.join(res) + '\n')
 
 
+class SoundMapper:
+    """
+    Longest-match letter to sound engine, giving the same pronunciations as generate_sound_mapping.
+    The sound map is compiled once into a single regular expression whose alternatives are ordered longest symbol
+    first (first in the config file for symbols of equal length), followed by a catch-all for unknown characters.
+    Python's regex engine tries alternatives in order, so each match is the longest known symbol at that position,
+    and whole words are mapped by the regex engine in one pass rather than searching every symbol at every index.
+    """
+
+    def __init__(self, sound_map: List[Tuple[str, str]]) -> None:
+        self.sounds = {}
+        for symbol, sound in sound_map:
+            self.sounds.setdefault(symbol, sound)  # Earlier mappings win, like a search of the sorted sound map
+        symbols = sorted(self.sounds, key=len, reverse=True)
+        alternatives = "|".join(re.escape(symbol) for symbol in symbols) if symbols else "(?!)"
+        self.pattern = re.compile(f"({alternatives})|(.)", re.DOTALL)
+
+    def map_word(self, word: str, missing_characters: Set[str]) -> str:
+        """
+        Gives the pronunciation dictionary line for a word.
+        :param word: the word to generate a pronunciation mapping for
+        :param missing_characters: a set to store any unrecognised characters in
+        :return: the word followed by its sounds, separated by spaces
+        """
+        res = [word]
+        sounds = self.sounds
+        for symbol, unknown in self.pattern.findall(word.lower()):
+            if unknown:
+                # unknown sound
+                res.append('(' + unknown + ')')
+                missing_characters.add(unknown)
+            else:
+                res.append(sounds[symbol])
+        return ' '.join(res)
+
+
+def initialise_worker(sound_map: List[Tuple[str, str]]) -> None:
+    """
+    Compiles the sound map once in each worker process.
+    :param sound_map: the sound map to base the pronunciations on
+    """
+    global _worker_sound_mapper
+    _worker_sound_mapper = SoundMapper(sound_map)
+
+
+def map_words(words: List[str]) -> List[Tuple[str, List[str]]]:
+    """
+    Maps a chunk of words with the worker's sound mapper.
+    :param words: the words to generate pronunciation mappings for
+    :return: a list of (pronunciation dictionary line, unrecognised characters) tuples, one per word
+    """
+    results = []
+    for word in words:
+        missing_characters = set()
+        line = _worker_sound_mapper.map_word(word, missing_characters)
+        results.append((line, sorted(missing_characters)))
+    return results
+
+
+def convert_words(words: List[str],
+                  sound_map: List[Tuple[str, str]],
+                  jobs: int = 1,
+                  chunk_size: int = 10000) -> Dict[str, Tuple[str, List[str]]]:
+    """
+    Generates the pronunciation mappings for a list of unique words.
+    :param words: the words to generate pronunciation mappings for
+    :param sound_map: the sound map to base the pronunciations on
+    :param jobs: number of worker processes to convert words in
+    :param chunk_size: number of words sent to a worker at a time
+    :return: a dictionary from each word to its (pronunciation dictionary line, unrecognised characters)
+    """
+    iterator = iter(words)
+    chunks = iter(lambda: list(islice(iterator, chunk_size)), [])
+    if jobs > 1:
+        with Pool(processes=jobs, initializer=initialise_worker, initargs=(sound_map,)) as pool:
+            results = [result for chunk_results in pool.imap(map_words, chunks) for result in chunk_results]
+    else:
+        initialise_worker(sound_map)
+        results = [result for chunk in chunks for result in map_words(chunk)]
+    return dict(zip(words, results))
+
+
 def generate_pronunciation_dictionary(word_list: str,
                                       pronunciation_dictionary: str,
-                                      config_file: str) -> None:
+                                      config_file: str,
+                                      jobs: int = 1,
+                                      cache_directory: str = None) -> None:
     """
     Creates a dictionary of pronunciations based on the provided word list and sound rules.
     :param word_list: the file path to the list of words to add to the pronunciation dictionary
     :param pronunciation_dictionary: the path to the file to write the pronunciation dictionary
     :param config_file: the path to the file with the symbol -> sound mapping
+    :param jobs: number of worker processes to convert words in
+    :param cache_directory: optional directory in which to cache pronunciations between runs
     """
     words = extract_words(word_list)
     sound_map = extract_sound_mappings(config_file)
     sound_map.sort(key=lambda x: len(x[0]), reverse=True)  # Sort by length of sound map
 
+    pronunciations: Dict[str, Tuple[str, List[str]]] = {}
+    cache = None
+    cache_key = None
+    if cache_directory:
+        cache = UtteranceCache(cache_directory)
+        cache_key = hash_data(sound_map, {"stage": "make_prn_dict"})
+        for entry in cache.get(cache_key) or []:
+            pronunciations[entry["word"]] = (entry["line"], entry["missing"])
+
+    new_words = [word for word in dict.fromkeys(words) if word not in pronunciations]
+    pronunciations.update(convert_words(new_words, sound_map, jobs))
+
     missing_characters = set()
 
     with open(pronunciation_dictionary, "w", encoding='utf-8') as output_file:
         output_file.write('!SIL sil\n')
         output_file.write('<UNK> spn\n')
         for word in words:
-            generate_sound_mapping(word=word,
-                                   sound_map=sound_map,
-                                   output_file=output_file,
-                                   missing_characters=missing_characters)
+            line, missing = pronunciations[word]
+            output_file.write(line + '\n')
+            missing_characters.update(missing)
+
+    if cache and new_words:
+        cache.put(cache_key, ({"word": word, "line": line, "missing": missing}
+                              for word, (line, missing) in pronunciations.items()))
 
     for character in missing_characters:
         print(f"Unexpected character: {character}", file=sys.stderr)
@@ -124,11 +235,21 @@ def main():
                         type=str,
                         required=True,
                         help="configuration file with one letter/symbol -> sound mapping in each line")
+    parser.add_argument("-n", "--jobs",
+                        type=int,
+                        default=1,
+                        help="number of worker processes to convert words in")
+    parser.add_argument("--cache_dir",
+                        type=str,
+                        required=False,
+                        help="directory in which to cache pronunciations between runs")
     arguments = parser.parse_args()
 
     generate_pronunciation_dictionary(word_list=arguments.infile,
                                       pronunciation_dictionary=arguments.outfile,
-                                      config_file=arguments.config)
+                                      config_file=arguments.config,
+                                      jobs=arguments.jobs,
+                                      cache_directory=arguments.cache_dir)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,9 @@
 Given a json file with transcript information this tools can perform
 manipulations including generating word lists.
 
+Words from the transcriptions, the additional word list and corpus.txt are streamed into a single counter, so the
+word list is written sorted in one go and word frequencies can be reported and used to prune rare words.
+
 Copyright: University of Queensland, 2019
 Contributors:
               Josh Arnold - (The University of Queensland, 2017)
@@ -14,11 +17,12 @@ Contributors:
 import argparse
 import os
 import sys
-from typing import List, Dict
-from kaldi_helpers.script_utilities import load_json_file
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List
+from kaldi_helpers.script_utilities import load_utterances
 
 
-def save_word_list(word_list: List[str], file_name: str) -> None:
+def save_word_list(word_list: Iterable[str], file_name: str) -> None:
     """
     Given a list of strings, write them to a new file named filename.
     :param word_list: list of words to write.
@@ -27,22 +31,54 @@ def save_word_list(word_list: List[str], file_name: str) -> None:
     with open(file_name, "w", encoding='utf-8') as f:
         for word in word_list:
             f.write(word + "\n",)
-        print(f"Wrote word list to {file_name}")
+        print(f"Wrote word list to {file_name}", file=sys.stderr)
+
+
+def save_word_frequencies(word_counts: Counter, file_name: str) -> None:
+    """
+    Writes each word and the number of times it occurs, most frequent first (ties sorted alphabetically).
+    :param word_counts: a counter of words.
+    :param file_name: name of file to write the word frequencies to.
+    """
+    with open(file_name, "w", encoding='utf-8') as f:
+        for word, count in sorted(word_counts.items(), key=lambda item: (-item[1], item[0])):
+            f.write(f"{word} {count}\n")
+        print(f"Wrote word frequencies to {file_name}", file=sys.stderr)
+
+
+def iterate_transcript_words(json_data: Iterable[Dict[str, str]]) -> Iterator[str]:
+    """
+    Lazily yields every word of every transcript.
+    :param json_data: Python list (or other iterable) of dictionaries read from a JSON file.
+    :return: an iterator over the words.
+    """
+    for utterance in json_data:
+        yield from utterance.get("transcript").split()
+
+
+def iterate_file_words(file_name: str) -> Iterator[str]:
+    """
+    Lazily yields every word of a text file, reading it one line at a time.
+    :param file_name: the name of the file to extract words from.
+    :return: an iterator over the words.
+    """
+    if os.path.exists(file_name):
+        with open(file_name, "r", encoding="utf-8") as f:
+            print(f"Extracting additional words from {file_name}", file=sys.stderr)
+            for line in f:
+                yield from line.split()
+    else:
+        print(f"WARNING: Additional word list file at {file_name} does not exist, skipping!", file=sys.stderr)
 
 
-def extract_word_list(json_data: List[Dict[str, str]]) -> List[str]:
+def extract_word_list(json_data: Iterable[Dict[str, str]]) -> List[str]:
     """
     Unpack a dictionary constructed from a json_file - containing the key
     "transcript" - into a (Python) list of words.
-    :param json_data: Python list of dictionaries read from a JSON file.
+    :param json_data: Python list (or other iterable) of dictionaries read from a JSON file.
     :return: list of unique words from data, sorted alphabetically.
     """
-    result: List[str] = []
-    for utterance in json_data:
-        words = utterance.get("transcript").split()
-        result.extend(words)
-    result = list(set(result))
-    return sorted(result)
+    return sorted(set(iterate_transcript_words(json_data)))
 
 
 def extract_additional_words(file_name: str) -> List[str]:
@@ -52,54 +88,58 @@ def extract_additional_words(file_name: str) -> List[str]:
     :param file_name: the name of the file to extract words from.
     :return: a list of words
     """
-    words = []
-    if os.path.exists(file_name):
-        with open(file_name, "r") as f:
-            print(f"Extracting additional words from {file_name}")
-            for line in f.readlines():
-                new_words = line.strip().split(" ")
-                words += [word for word in new_words]
-    else:
-        print(f"WARNING: Additional word list file at {file_name} does not exist, skipping!")
-    return words
+    return list(iterate_file_words(file_name))
+
+
+def count_words(json_data: Iterable[Dict[str, str]], *file_names: str) -> Counter:
+    """
+    Counts the words of the transcriptions and any additional text files in a single streaming pass.
+    :param json_data: Python list (or other iterable) of dictionaries read from a JSON file.
+    :param file_names: paths of additional text files to count the words of, empty paths are skipped.
+    :return: a counter of words.
+    """
+    word_counts = Counter(iterate_transcript_words(json_data))
+    for file_name in file_names:
+        if file_name:
+            word_counts.update(iterate_file_words(file_name))
+    return word_counts
 
 
 def generate_word_list(transcription_file: str,
                        word_list_file: str,
                        output_file: str,
-                       kaldi_corpus_file: str) -> None:
+                       kaldi_corpus_file: str,
+                       frequency_file: str = None,
+                       min_count: int = 1) -> None:
     """
     Generates the wordlist.txt file used to populate the Kaldi file structure and generate
     the lexicon.txt file.
-    :param transcription_file: path to the json file containing the transcriptions
+    :param transcription_file: path to the json (or .jsonl) file containing the transcriptions
     :param word_list_file: the path of the file to write the word list to
     :param output_file: the path of the file to write the word list to
     :param kaldi_corpus_file: file path to the corpus.txt created by json_to_kaldi.py
+    :param frequency_file: optional path of a file to write the frequency of every word to
+    :param min_count: leave out words seen fewer times than this, except those in the additional word list
     :return:
     """
-    json_data: List[Dict[str, str]] = load_json_file(transcription_file)
+    json_data: Iterator[Dict[str, str]] = load_utterances(transcription_file)
 
     print("Extracting word list(s)...", flush=True, file=sys.stderr)
 
-    # Retrieve ELAN word data
-    word_list = extract_word_list(json_data)
-
-    # Add additional words to lexicon if required
-    if word_list_file:
-        additional_words = extract_additional_words(word_list_file)
-        word_list.extend(additional_words)
-
-    if kaldi_corpus_file:
-        corpus_file_words = extract_additional_words(kaldi_corpus_file)
-        word_list.extend(corpus_file_words)
+    # Count ELAN words and corpus words, adding additional words to lexicon if required
+    word_counts = count_words(json_data, kaldi_corpus_file, word_list_file)
 
-    # Remove duplicates
-    word_list = list(set(word_list))
+    if frequency_file:
+        save_word_frequencies(word_counts, frequency_file)
 
-    print(sorted(word_list))
+    if min_count > 1:
+        required_words = set(iterate_file_words(word_list_file)) if word_list_file else set()
+        words = (word for word, count in word_counts.items() if count >= min_count or word in required_words)
+    else:
+        words = word_counts.keys()
 
     print(f"Writing wordlist to file...", flush=True, file=sys.stderr)
-    save_word_list(word_list, output_file)
+    save_word_list(sorted(words), output_file)
 
 
 def main():
@@ -107,12 +147,13 @@ def main():
     Run the entire make_wordlist.py as a command line utility.
     
     Usage: python3 make_wordlist.py [-h] -i INFILE [-o OUTFILE] [-w WORDLIST] [-t TEXTCORPUS] [-c KALDICORPUS]
+                                    [-f FREQUENCIES] [-m MIN_COUNT]
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--infile",
                         type=str,
                         required=True,
-                        help="The json file containing the transcriptions.")
+                        help="The json (or .jsonl) file containing the transcriptions.")
     parser.add_argument("-o", "--outfile",
                         type=str,
                         required=True,
@@ -125,12 +166,22 @@ def main():
                         type=str,
                         help="File path to the corpus.txt created by json_to_kaldi.py.",
                         required=True)
+    parser.add_argument("-f", "--frequencies",
+                        type=str,
+                        required=False,
+                        help="File path to write the frequency of every word to.")
+    parser.add_argument("-m", "--min_count",
+                        type=int,
+                        default=1,
+                        help="Leave out words seen fewer times than this, except those in the additional word list.")
     arguments = parser.parse_args()
 
     generate_word_list(transcription_file=arguments.infile,
                        word_list_file=arguments.word_list,
                        output_file=arguments.outfile,
-                       kaldi_corpus_file=arguments.kaldi_corpus)
+                       kaldi_corpus_file=arguments.kaldi_corpus,
+                       frequency_file=arguments.frequencies,
+                       min_count=arguments.min_count)
 
     print("Done.", file=sys.stderr)
 
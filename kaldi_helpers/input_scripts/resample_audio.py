@@ -1,7 +1,15 @@
 #!/usr/bin/python3
 
 """
-Converts audio to 16 bit 16k mono WAV
+Converts audio to 16 bit mono WAV at the sample rate given by --sample_rate (AUDIO_SAMPLE_RATE in Taskvars.yml)
+
+Files are converted by sox across a pool of --jobs workers, retrying failed conversions. A manifest records the
+hash of each file before and after conversion (together with the sample rate and channels), so a rerun skips audio
+that has already been converted with the same settings. The time taken for each file is reported.
+
+The default sox backend forks sox for every file. The native backend (--backend native) instead decodes, mixes down
+and resamples PCM WAVs in process with numpy across a pool of worker processes, writing the same 16 bit PCM WAV
+format, and falls back to sox for files it cannot decode.
 
 Copyright: University of Queensland, 2019
 Contributors:
@@ -10,15 +18,21 @@ Contributors:
 """
 
 import argparse
-import glob
 import os
 import subprocess
-import threading
+import sys
+import time
+import wave
+from multiprocessing import Pool as ProcessPool
 from multiprocessing.dummy import Pool
 from shutil import move
-from typing import Set, Tuple
-from kaldi_helpers.script_utilities import find_files_by_extensions
-from kaldi_helpers.script_utilities.globals import SOX_PATH
+from typing import Dict, List, Optional, Tuple
+from kaldi_helpers.script_utilities import convert_wav, hash_file, load_json_file, scan_directory
+from kaldi_helpers.script_utilities import write_data_to_json_file
+from kaldi_helpers.script_utilities.globals import SOX_PATH, TEMPORARY_DIRECTORY
+
+RESAMPLE_MANIFEST_NAME = "resample_manifest.json"
+BACKENDS = ["sox", "native"]
 
 
 def join_norm(p1, p2) -> str:
@@ -26,26 +40,176 @@ def join_norm(p1, p2) -> str:
     return os.path.normpath(tmp)
 
 
-def process_item(sox_arguments: Tuple[int, str, threading.Lock, Set[str], str]) -> str:
-    index, input_audio, lock, temporary_directories, parent_temporary_directory = sox_arguments
-
-    input_name = os.path.normpath(input_audio)
-
+def temporary_file_for(input_audio: str, parent_temporary_directory: str = TEMPORARY_DIRECTORY) -> str:
+    """
+    Gives the path the converted version of an audio file is written to, in a temporary folder beside it.
+    :param input_audio: path of the audio file to convert
+    :param parent_temporary_directory: name of the temporary folder
+    :return: the path of the converted file
+    """
     file_directory, file_name = os.path.split(input_audio)
-    base_directory, ext = os.path.splitext(file_name)
+    base_name, ext = os.path.splitext(file_name)
     output_directory = os.path.join(file_directory, parent_temporary_directory)
+    return join_norm(output_directory, "%s.%s" % (base_name, "wav"))
+
+
+def resample_options(sample_rate: int, channels: int) -> dict:
+    """
+    Gives the conversion settings that the manifest hashes are keyed on.
+    """
+    return {"stage": "resample_audio", "bits": 16, "sample_rate": sample_rate, "channels": channels}
+
+
+def sox_command(input_audio: str, output_file: str, sample_rate: int, channels: int) -> List[str]:
+    """
+    Builds the sox command converting an audio file to a 16 bit WAV.
+    :param input_audio: path of the audio file to convert
+    :param output_file: path to write the converted file to
+    :param sample_rate: target sample rate in Hz
+    :param channels: target number of channels
+    :return: the command as a list of arguments
+    """
+    return [SOX_PATH, os.path.normpath(input_audio), "-b", "16", "-c", str(channels), "-r", str(sample_rate),
+            "-t", "wav", output_file]
+
+
+def convert_item(input_audio: str, output_file: str, sample_rate: int, channels: int, backend: str) -> None:
+    """
+    Converts a single audio file with the given backend, raising an exception if the conversion fails.
+    :param input_audio: path of the audio file to convert
+    :param output_file: path to write the converted file to
+    :param sample_rate: target sample rate in Hz
+    :param channels: target number of channels
+    :param backend: "native" to convert in process, falling back to sox for files it cannot decode, or "sox"
+    """
+    if backend == "native":
+        try:
+            convert_wav(input_audio, output_file, sample_rate, channels)
+            return
+        except (wave.Error, EOFError):
+            pass  # Not a PCM WAV that the wave module can read
+    subprocess.run(sox_command(input_audio, output_file, sample_rate, channels),
+                   check=True,
+                   stdout=subprocess.PIPE,
+                   stderr=subprocess.PIPE)
 
-    with lock:  # Avoids race condition
-        temporary_directories.add(output_directory)
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
 
-    temporary_file_name = join_norm(output_directory, "%s.%s" % (base_directory, "wav"))
+def process_item(arguments: Tuple[str, str, int, int, int, str]) -> Tuple[str, Optional[str], float, int]:
+    """
+    Converts a single audio file, retrying if the conversion fails.
+    :param arguments: a tuple of (input audio path, output path, sample rate, channels, retries, backend)
+    :return: a tuple of (input audio path, error message or None, seconds taken, attempts made)
+    """
+    input_audio, output_file, sample_rate, channels, retries, backend = arguments
+    start = time.perf_counter()
+    error = None
+    attempt = 0
+    for attempt in range(1, retries + 2):
+        try:
+            convert_item(input_audio, output_file, sample_rate, channels, backend)
+            error = None
+            break
+        except (subprocess.CalledProcessError, OSError, ValueError) as exception:
+            stderr = getattr(exception, "stderr", None)
+            error = stderr.decode("utf-8", "replace").strip() if stderr else str(exception)
+    return input_audio, error, time.perf_counter() - start, attempt
 
-    if not os.path.exists(temporary_file_name):
-        sox_arguments = [SOX_PATH, input_name, "-b", "16", "-c", "1", "-r", "44.1k", "-t", "wav", temporary_file_name]
-        subprocess.call(sox_arguments)
-    return temporary_file_name
+
+def load_manifest(manifest_file: str) -> Dict[str, Dict[str, str]]:
+    """
+    Loads the resampling manifest, mapping each audio file to the hashes of its source and converted contents.
+    :param manifest_file: path of the manifest
+    :return: the manifest entries, empty if there is no manifest yet
+    """
+    if manifest_file and os.path.isfile(manifest_file):
+        return load_json_file(manifest_file)
+    return {}
+
+
+def is_converted(input_audio: str, output_path: str, entry: Optional[Dict[str, str]], options: dict) -> bool:
+    """
+    Determines from its manifest entry whether an audio file has already been converted with the given settings.
+    :param input_audio: path of the audio file
+    :param output_path: where the converted file ends up
+    :param entry: the manifest entry of the file, if any
+    :param options: the conversion settings, see resample_options
+    :return: True if the converted file exists and the file is unchanged since its conversion
+    """
+    if not entry or not os.path.isfile(output_path):
+        return False
+    if hash_file(output_path, options) != entry.get("output"):
+        return False
+    # The source is either the converted file itself (overwritten in place) or unchanged since it was converted
+    return output_path == input_audio or hash_file(input_audio, options) == entry.get("source")
+
+
+def resample_corpus(input_audio: List[str],
+                    sample_rate: int,
+                    channels: int = 1,
+                    jobs: int = 1,
+                    retries: int = 2,
+                    overwrite: bool = False,
+                    manifest_file: str = None,
+                    backend: str = "sox",
+                    verbose: bool = True) -> Tuple[List[str], List[str], List[Tuple[str, str]]]:
+    """
+    Converts audio files to 16 bit WAVs, skipping those the manifest shows are already converted.
+    Converted files are written to a temporary folder beside each source, and replace the source when overwriting.
+    :param input_audio: paths of the audio files to convert
+    :param sample_rate: target sample rate in Hz
+    :param channels: target number of channels
+    :param jobs: number of conversions to run at once
+    :param retries: number of times to retry a failed conversion
+    :param overwrite: replace the source files with the converted files
+    :param manifest_file: optional path of the manifest to read and update
+    :param backend: "sox" to fork sox for each file, or "native" to convert in process
+    :param verbose: report the time taken for each file
+    :return: a tuple of (converted files, skipped files, (failed file, error) tuples)
+    """
+    options = resample_options(sample_rate, channels)
+    manifest = load_manifest(manifest_file)
+
+    pending = []
+    skipped = []
+    for audio_path in input_audio:
+        temporary_file_name = temporary_file_for(audio_path)
+        output_path = audio_path if overwrite else temporary_file_name
+        if is_converted(audio_path, output_path, manifest.get(audio_path), options):
+            skipped.append(audio_path)
+            continue
+        os.makedirs(os.path.dirname(temporary_file_name), exist_ok=True)
+        pending.append((audio_path, temporary_file_name, sample_rate, channels, retries, backend))
+
+    converted = []
+    failed = []
+    temporary_files = {arguments[0]: arguments[1] for arguments in pending}
+    # sox runs in its own process so threads are enough, native conversion needs worker processes
+    pool_type = ProcessPool if backend == "native" and jobs > 1 else Pool
+    with pool_type(processes=max(jobs, 1)) as pool:
+        for audio_path, error, elapsed, attempts in pool.imap_unordered(process_item, pending):
+            if error:
+                failed.append((audio_path, error))
+                print(f"Failed to convert {audio_path} after {attempts} attempt(s): {error}", file=sys.stderr)
+                continue
+            source_hash = hash_file(audio_path, options)
+            output_path = temporary_files[audio_path]
+            if overwrite:
+                move(output_path, audio_path)
+                output_path = audio_path
+            manifest[audio_path] = {"source": source_hash, "output": hash_file(output_path, options)}
+            converted.append(audio_path)
+            if verbose:
+                print(f"Converted {audio_path} in {elapsed:.2f}s", file=sys.stderr)
+
+    if overwrite:
+        # Clean up tmp folders
+        for temporary_directory in {os.path.dirname(path) for path in temporary_files.values()}:
+            if os.path.isdir(temporary_directory) and not os.listdir(temporary_directory):
+                os.rmdir(temporary_directory)
+
+    if manifest_file:
+        write_data_to_json_file(manifest, manifest_file)
+    return converted, skipped, failed
 
 
 def main() -> None:
@@ -58,34 +222,47 @@ def main() -> None:
     parser.add_argument('-o', '--overwrite',
                         help='Write over existing files',
                         action="store_true",
-                        default=True)
+                        default=False)
+    parser.add_argument('-s', '--sample_rate',
+                        help='Sample rate to convert to in Hz, AUDIO_SAMPLE_RATE in Taskvars.yml which also sets the '
+                             'mfcc.conf sample frequency',
+                        type=int,
+                        required=True)
+    parser.add_argument('-n', '--jobs',
+                        help='Number of files to convert at once',
+                        type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument('-r', '--retries',
+                        help='Number of times to retry a failed conversion',
+                        type=int,
+                        default=2)
+    parser.add_argument('-m', '--manifest',
+                        help=f'Manifest of converted files, defaults to {RESAMPLE_MANIFEST_NAME} in the corpus',
+                        type=str,
+                        required=False)
+    parser.add_argument('-b', '--backend',
+                        help='Convert with sox, or natively in process (falling back to sox for unreadable files)',
+                        choices=BACKENDS,
+                        default="sox")
     args = parser.parse_args()
 
     base_directory = args.corpus
-    audio_extensions = {"*.wav"}
-    parent_temporary_directory = "tmp"
-
-    all_files_in_dir = glob.glob(os.path.join(base_directory, "**"), recursive=True)
-    input_audio = [ file_ for file_ in all_files_in_dir if file_.endswith(".wav")]
-    process_lock = threading.Lock()
-    temporary_directories = set()
-
-    map_arguments = [(index, audio_path, process_lock, temporary_directories, parent_temporary_directory)
-                     for index, audio_path in enumerate(input_audio)]
-
-    # Multi-Threaded Audio Re-sampling
-    with Pool() as pool:
-        outputs = pool.map(process_item, map_arguments)
-
-        if args.overwrite:
-            # Replace original files
-            for audio_file in outputs:
-                file_name = os.path.basename(audio_file)
-                parent_directory = os.path.dirname(os.path.dirname(audio_file))
-                move(audio_file, os.path.join(parent_directory, file_name))
-            # Clean up tmp folders
-            for d in temporary_directories:
-                os.rmdir(d)
+    input_audio = sorted(scan_directory(base_directory, {".wav"},
+                                        prune=lambda directory: os.path.basename(directory) == TEMPORARY_DIRECTORY))
+
+    start = time.perf_counter()
+    converted, skipped, failed = resample_corpus(input_audio=input_audio,
+                                                 sample_rate=args.sample_rate,
+                                                 jobs=args.jobs,
+                                                 retries=args.retries,
+                                                 overwrite=args.overwrite,
+                                                 backend=args.backend,
+                                                 manifest_file=args.manifest or os.path.join(base_directory,
+                                                                                             RESAMPLE_MANIFEST_NAME))
+    print(f"Converted {len(converted)}, skipped {len(skipped)} already converted, {len(failed)} failed "
+          f"in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -3,16 +3,37 @@
 """
 Splits a directory of audio (.wav) files into short segments based on silence
 
+Silence is detected with numpy rather than pydub, giving the same segment boundaries as pydub's split_on_silence
+(which earlier versions of this script used) for the same minimum silence length and threshold. The WAV is read in
+chunks to build a running sum of frame energies at every millisecond boundary, so the RMS of every window is a
+vectorised difference of two sums, and only one segment of audio is held in memory at a time when exporting.
+
+Files are split across a pool of --jobs worker processes, and each segment is written to <name>-part_<n>.wav beside
+the mirrored path of its source. With --manifest, the source file, start_ms and stop_ms of every segment are written
+in the utterance format of elan_to_json, so they can go straight into json_to_kaldi as a segments file. With
+--virtual no audio is exported at all and only the manifest is written, and --gain adds the gain that would normalise
+each segment as gain_db, computed from the energy profile.
+
 Copyright: University of Queensland, 2019
 Contributors:
               Nicholas Lambourne - (The University of Queensland, 2019)
 """
 
+import os
+import sys
+import wave
+import numpy as np
 from argparse import ArgumentParser
-from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from kaldi_helpers.script_utilities import find_all_files_in_dir_by_extensions
+from kaldi_helpers.script_utilities import find_all_files_in_dir_by_extensions, iterate_safely, write_utterances
+
+# Number of frames read from a WAV at a time while measuring its energy
+READ_CHUNK_FRAMES = 1 << 20
+# Silence kept at the start and end of each segment in milliseconds, as in pydub's split_on_silence
+KEEP_SILENCE = 100
+# Loudness that exported segments are normalised to in dBFS
+TARGET_DBFS = -20
 
 
 def match_target_amplitude(segment: AudioSegment, target_dbfs) -> AudioSegment:
@@ -26,32 +47,286 @@ def match_target_amplitude(segment: AudioSegment, target_dbfs) -> AudioSegment:
     return segment.apply_gain(dbfs_delta)
 
 
+def decode_samples(data: bytes, sample_width: int) -> np.ndarray:
+    """
+    Decodes raw WAV frames into the signed samples pydub works with: 8 bit WAVs are unsigned and are shifted to
+    signed, and 24 bit samples are widened to 32 bits the way pydub does.
+    :param data: raw little endian PCM frames, as stored in the WAV
+    :param sample_width: bytes per sample in the WAV
+    :return: an int64 array of interleaved samples
+    """
+    if sample_width == 1:
+        return np.frombuffer(data, dtype=np.uint8).astype(np.int64) - 128
+    if sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int64)
+        samples = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(samples >= 1 << 23, samples - (1 << 24), samples)
+        # pydub widens by prepending a sign byte as the low byte, so negative samples gain 0xFF in the lowest bits
+        return (samples << 8) | np.where(samples < 0, 0xFF, 0)
+    return np.frombuffer(data, dtype=np.dtype(f"<i{sample_width}")).astype(np.int64)
+
+
+class SilenceProfile:
+    """
+    Running sums of frame energies of a WAV file at every millisecond boundary, as pydub slices audio by milliseconds.
+    The energy of any whole-millisecond slice is then the difference of two sums.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        with wave.open(file_path, "rb") as wav_file:
+            self.channels = wav_file.getnchannels()
+            self.wav_sample_width = wav_file.getsampwidth()
+            # pydub holds 24 bit audio as 32 bit samples
+            self.sample_width = 4 if self.wav_sample_width == 3 else self.wav_sample_width
+            self.frame_rate = wav_file.getframerate()
+            self.frame_count = wav_file.getnframes()
+            # Length in milliseconds, as given by len(AudioSegment)
+            self.length = round(1000 * (float(self.frame_count) / self.frame_rate))
+            # First frame of each millisecond, as pydub's AudioSegment slicing computes it
+            self.boundaries = (np.arange(self.length + 1) * (self.frame_rate / 1000.0)).astype(np.int64)
+            # Squares of 32 bit samples overflow int64 when summed, so they are summed as doubles, like audioop.rms
+            # accumulates them
+            energy_type = np.int64 if self.sample_width <= 2 else np.float64
+            self.energy_sums = np.zeros(self.length + 1, dtype=energy_type)
+
+            readable = np.minimum(self.boundaries, self.frame_count)
+            energy_before_chunk = 0
+            for chunk_start in range(0, self.frame_count, READ_CHUNK_FRAMES):
+                samples = decode_samples(wav_file.readframes(READ_CHUNK_FRAMES), self.wav_sample_width)
+                samples = samples.astype(energy_type)
+                energies = (samples * samples).reshape(-1, self.channels).sum(axis=1)
+                chunk_end = chunk_start + len(energies)
+                cumulative = np.concatenate((np.zeros(1, dtype=energy_type), np.cumsum(energies))) + energy_before_chunk
+                in_chunk = (readable > chunk_start) & (readable <= chunk_end)
+                self.energy_sums[in_chunk] = cumulative[readable[in_chunk] - chunk_start]
+                energy_before_chunk = cumulative[-1]
+
+    @property
+    def max_possible_amplitude(self) -> float:
+        return (2 ** (self.sample_width * 8)) / 2
+
+    def window_rms(self, window_length: int) -> np.ndarray:
+        """
+        Computes the RMS of every window of the given length starting at each millisecond, like
+        AudioSegment[i:i + window_length].rms (frames past the end of the file count as silence).
+        :param window_length: length of the windows in milliseconds
+        :return: an array with the RMS of each window
+        """
+        starts = np.arange(self.length - window_length + 1)
+        energies = self.energy_sums[starts + window_length] - self.energy_sums[starts]
+        samples = (self.boundaries[starts + window_length] - self.boundaries[starts]) * self.channels
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rms = np.floor(np.sqrt(energies.astype(np.float64) / samples))
+        return np.where(samples > 0, rms, 0)
+
+
+def detect_silence_ranges(profile: SilenceProfile, min_silence_length: int, threshold: int) -> List[List[int]]:
+    """
+    Finds the silent sections of a file, like pydub.silence.detect_silence with a seek step of 1.
+    :param profile: the energy profile of the file
+    :param min_silence_length: the minimum length (in ms) of silence
+    :param threshold: the level below the norm (in dBFS) to consider silence
+    :return: a list of [start, end] silent ranges in milliseconds
+    """
+    if profile.length < min_silence_length:
+        return []
+    silence_threshold = (10 ** (float(-threshold) / 20)) * profile.max_possible_amplitude
+    silence_starts = np.flatnonzero(profile.window_rms(min_silence_length) <= silence_threshold)
+    if len(silence_starts) == 0:
+        return []
+    # Overlapping or adjoining silent windows join into one range
+    gaps = np.diff(silence_starts)
+    breaks = np.flatnonzero((gaps != 1) & (gaps > min_silence_length))
+    range_starts = np.concatenate(([silence_starts[0]], silence_starts[breaks + 1]))
+    range_ends = np.concatenate((silence_starts[breaks], [silence_starts[-1]])) + min_silence_length
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+
+def detect_nonsilent_ranges(profile: SilenceProfile, min_silence_length: int, threshold: int) -> List[List[int]]:
+    """
+    Finds the non-silent sections of a file, like pydub.silence.detect_nonsilent with a seek step of 1.
+    :param profile: the energy profile of the file
+    :param min_silence_length: the minimum length (in ms) of silence
+    :param threshold: the level below the norm (in dBFS) to consider silence
+    :return: a list of [start, end] non-silent ranges in milliseconds
+    """
+    silent_ranges = detect_silence_ranges(profile, min_silence_length, threshold)
+    if not silent_ranges:
+        return [[0, profile.length]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == profile.length:
+        return []
+    previous_end = 0
+    nonsilent_ranges = []
+    for start, end in silent_ranges:
+        nonsilent_ranges.append([previous_end, start])
+        previous_end = end
+    if silent_ranges[-1][1] != profile.length:
+        nonsilent_ranges.append([previous_end, profile.length])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+
+def find_segments(profile: SilenceProfile,
+                  min_silence_length: int,
+                  threshold: int,
+                  keep_silence: int = KEEP_SILENCE) -> List[Tuple[int, int]]:
+    """
+    Gives the ranges pydub.silence.split_on_silence would cut a file into.
+    :param profile: the energy profile of the file
+    :param min_silence_length: the minimum length (in ms) of silence that indicates a break
+    :param threshold: the level below the norm (in dBFS) to consider silence
+    :param keep_silence: silence (in ms) to keep on either side of each segment, split evenly when segments overlap
+    :return: a list of (start, end) segment ranges in milliseconds
+    """
+    output_ranges = [[start - keep_silence, end + keep_silence]
+                     for start, end in detect_nonsilent_ranges(profile, min_silence_length, threshold)]
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
+    return [(max(start, 0), min(end, profile.length)) for start, end in output_ranges]
+
+
+def read_segment(file_path: str, profile: SilenceProfile, start_ms: int, stop_ms: int) -> AudioSegment:
+    """
+    Reads one segment of a WAV file, like slicing the whole file as an AudioSegment.
+    :param file_path: file path of the audio file
+    :param profile: the energy profile of the file
+    :param start_ms: start of the segment in milliseconds
+    :param stop_ms: end of the segment in milliseconds
+    :return: the segment
+    """
+    start_frame, stop_frame = int(profile.boundaries[start_ms]), int(profile.boundaries[stop_ms])
+    samples = np.zeros((stop_frame - start_frame) * profile.channels, dtype=np.int64)
+    with wave.open(file_path, "rb") as wav_file:
+        if start_frame < profile.frame_count:
+            wav_file.setpos(start_frame)
+            data = wav_file.readframes(min(stop_frame, profile.frame_count) - start_frame)
+            # Frames past the end of the file are left silent, as in pydub
+            decoded = decode_samples(data, profile.wav_sample_width)
+            samples[:len(decoded)] = decoded
+    return AudioSegment(data=samples.astype(f"<i{profile.sample_width}").tobytes(),
+                        sample_width=profile.sample_width,
+                        frame_rate=profile.frame_rate,
+                        channels=profile.channels)
+
+
+def segment_gain(profile: SilenceProfile, start_ms: int, stop_ms: int, added_silence: int) -> Optional[float]:
+    """
+    Computes the gain that would normalise a segment, padded with silence, to TARGET_DBFS, from the energy profile
+    alone without reading the segment's audio.
+    :param profile: the energy profile of the file
+    :param start_ms: start of the segment in milliseconds
+    :param stop_ms: end of the segment in milliseconds
+    :param added_silence: silence (in ms) that is added to the beginning and end of the segment
+    :return: the gain in dB, or None if the segment is completely silent
+    """
+    energy = float(profile.energy_sums[stop_ms] - profile.energy_sums[start_ms])
+    frames = int(profile.boundaries[stop_ms] - profile.boundaries[start_ms])
+    frames += 2 * int(added_silence * (profile.frame_rate / 1000.0))
+    if energy == 0 or frames == 0:
+        return None
+    rms = np.sqrt(energy / (frames * profile.channels))
+    return round(TARGET_DBFS - 20 * np.log10(rms / profile.max_possible_amplitude), 2)
+
+
+def segment_file_name(audio_file_name: str, segment_index: int) -> str:
+    """
+    Gives the name of the exported file for a segment, derived from its source so that it does not depend on the order
+    in which files are found.
+    :param audio_file_name: path of the source audio, relative to the input directory
+    :param segment_index: position of the segment in the source audio
+    :return: the relative path of the segment file
+    """
+    directory, file_name = os.path.split(audio_file_name)
+    return os.path.join(directory, f"{os.path.splitext(file_name)[0]}-part_{segment_index}.wav")
+
+
 def split_audio_file_on_silence(file_path: str,
                                 output_directory: str,
                                 min_silence_length: int,
                                 threshold: int,
                                 added_silence: int,
-                                file_index: int) -> None:
+                                audio_file_name: str = None,
+                                export: bool = True,
+                                gain: bool = False) -> List[dict]:
     """
-    Splits an AudioSegment into sub-segments based on silence detected by pydub.
+    Splits an audio file into sub-segments based on silence, exporting each segment as its own file unless only the
+    segment timings are wanted.
     :param file_path: file path of the audio file to split
     :param output_directory: path to directory in which to write output files
     :param min_silence_length: the minimum length (in ms) of silence that indicates a break
     :param threshold: the level below the norm (in dBFS) to consider silence
     :param added_silence: silence to be added to the beginning and end of each split utterance
-    :param file_index: the number of the file in the directory (recursive) to mark each sub-utterance with.
+    :param audio_file_name: name of the audio file recorded in each utterance, defaults to the file name
+    :param export: write each segment, padded with silence and normalised, to its own WAV file
+    :param gain: record the gain (in dB) that normalises each segment to TARGET_DBFS as "gain_db"
+    :return: a list of utterance dictionaries (as produced by elan_to_json) giving each segment's place in the source
     """
-    audio = AudioSegment(file_path)
-    segments = split_on_silence(audio_segment=audio,
-                                min_silence_len=min_silence_length,
-                                silence_thresh=-threshold)
+    audio_file_name = audio_file_name or os.path.basename(file_path)
+    profile = SilenceProfile(file_path)
+    segments = find_segments(profile, min_silence_length, threshold)
     silence = AudioSegment.silent(duration=added_silence)
-    for segment_index, segment in enumerate(segments):
-        audio_segment = silence + segment + silence
-        normalised_segment = match_target_amplitude(audio_segment, -20)
-        export_file_name = f"_file_{file_index}-part_{segment_index}.wav"
-        print(f"Exporting {export_file_name}")
-        normalised_segment.export(Path(output_directory, export_file_name))
+    utterances = []
+    for segment_index, (start_ms, stop_ms) in enumerate(segments):
+        utterance = {
+            "audio_file_name": audio_file_name,
+            "transcript": "",
+            "start_ms": start_ms,
+            "stop_ms": stop_ms
+        }
+        if export:
+            segment = read_segment(file_path, profile, start_ms, stop_ms)
+            audio_segment = silence + segment + silence
+            normalised_segment = match_target_amplitude(audio_segment, TARGET_DBFS)
+            export_path = os.path.join(output_directory, segment_file_name(audio_file_name, segment_index))
+            os.makedirs(os.path.dirname(export_path), exist_ok=True)
+            normalised_segment.export(export_path, format="wav")
+            dbfs_delta = TARGET_DBFS - audio_segment.dBFS
+            segment_gain_db = round(dbfs_delta, 2) if np.isfinite(dbfs_delta) else None
+        else:
+            segment_gain_db = segment_gain(profile, start_ms, stop_ms, added_silence)
+        if gain:
+            utterance["gain_db"] = segment_gain_db
+        utterances.append(utterance)
+    return utterances
+
+
+def iterate_split_files(input_directory: str,
+                        output_directory: str,
+                        min_silence_length: int,
+                        threshold: int,
+                        added_silence: int,
+                        jobs: int = 1,
+                        failed_files: List[Tuple[str, str]] = None,
+                        export: bool = True,
+                        gain: bool = False) -> Iterator[dict]:
+    """
+    Lazily splits every WAV in a directory (recursively), optionally across a pool of worker processes. Files are
+    split in sorted order and their segments are yielded in that same order, so the output does not depend on the
+    number of jobs.
+    :param input_directory: directory containing audio to be split
+    :param output_directory: directory to write the segments to, mirroring the layout of the input directory
+    :param min_silence_length: the minimum length (in ms) of silence that indicates a break
+    :param threshold: the level below the norm (in dBFS) to consider silence
+    :param added_silence: silence to be added to the beginning and end of each split utterance
+    :param jobs: number of worker processes to use, 1 splits the files in the current process
+    :param failed_files: an optional list to append (file name, error message) to for each file that failed
+    :param export: write each segment to its own WAV file, otherwise only the segment timings are produced
+    :param gain: record the gain (in dB) that normalises each segment to TARGET_DBFS as "gain_db"
+    :return: an iterator over the utterances of all segments
+    """
+    arguments = [(file_path,
+                  output_directory,
+                  min_silence_length,
+                  threshold,
+                  added_silence,
+                  os.path.relpath(file_path, input_directory),
+                  export,
+                  gain)
+                 for file_path in sorted(find_all_files_in_dir_by_extensions(input_directory, {".wav"}))]
+    yield from iterate_safely(split_audio_file_on_silence, arguments, jobs, failed_files)
 
 
 def main() -> None:
@@ -76,17 +351,50 @@ def main() -> None:
                         help="Add silence to beginning and end of segments, in milliseconds",
                         type=int,
                         default=100)
-
+    parser.add_argument("-n", "--jobs",
+                        help="Number of worker processes used to split files",
+                        type=int,
+                        default=1)
+    parser.add_argument("-m", "--manifest",
+                        help="File path to write the source file, start_ms and stop_ms of each segment to, in the "
+                             "same format as elan_to_json output, use a .jsonl extension to stream JSON Lines",
+                        type=str,
+                        required=False)
+    parser.add_argument("-v", "--virtual",
+                        help="Only write the segment timings to the manifest, without exporting any audio. Kaldi "
+                             "reads the segments from the original recordings through the segments file",
+                        action="store_true")
+    parser.add_argument("-g", "--gain",
+                        help=f"Record the gain (in dB) that normalises each segment to {TARGET_DBFS} dBFS in the "
+                             f"manifest as gain_db",
+                        action="store_true")
     arguments = parser.parse_args()
-    all_audio_files = find_all_files_in_dir_by_extensions(arguments.input_dir, {"wav"})
-
-    for index, file_path in enumerate(all_audio_files):
-        split_audio_file_on_silence(file_path=file_path,
-                                    output_directory=arguments.output_dir,
-                                    min_silence_length=arguments.silence_length,
-                                    threshold=arguments.threshold,
-                                    added_silence=arguments.added_silence,
-                                    file_index=index)
+    if arguments.virtual and not arguments.manifest:
+        parser.error("--virtual needs a --manifest to write the segment timings to")
+
+    failed_files: List[Tuple[str, str]] = []
+    utterances = iterate_split_files(input_directory=arguments.input_dir,
+                                     output_directory=arguments.output_dir,
+                                     min_silence_length=arguments.silence_length,
+                                     threshold=arguments.threshold,
+                                     added_silence=arguments.added_silence,
+                                     jobs=arguments.jobs,
+                                     failed_files=failed_files,
+                                     export=not arguments.virtual,
+                                     gain=arguments.gain)
+    if arguments.manifest:
+        written = write_utterances(utterances, arguments.manifest)
+    else:
+        written = sum(1 for _ in utterances)
+    if arguments.virtual:
+        print(f"Wrote timings of {written} segments to {arguments.manifest}", file=sys.stderr)
+    else:
+        print(f"Exported {written} segments to {arguments.output_dir}", file=sys.stderr)
+
+    for file_path, error in failed_files:
+        print(f"Failed to split {file_path}: {error}", file=sys.stderr)
+    if failed_files:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
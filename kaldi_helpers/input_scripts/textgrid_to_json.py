@@ -3,6 +3,10 @@
 """
 Extracts transcription information from Praat (*.TextGrid) transcription files and outputs them in json format
 
+The tiers to extract are chosen with --tier (the "Speech" tier by default). TextGrids saved in Praat's long text format
+are read with a native parser, falling back to praatio for other formats, and files are parsed across a pool of
+--jobs worker processes.
+
 Copyright: University of Queensland, 2019
 Contributors:
               Scott Heath - (University of Queensland, 2018)
@@ -10,12 +14,172 @@ Contributors:
 """
 
 import argparse
-from praatio import tgio
-from typing import Dict
+import re
+import sys
+from typing import Dict, Iterable, Iterator, Sequence, Tuple
 from kaldi_helpers.script_utilities import *
 
+DEFAULT_TIERS = ["Speech"]
+
+# Tier headers and intervals of a long format TextGrid. Names and labels are read to the end of their line, like
+# praatio does, so that files written by praatio (which does not escape quotes) are read the same way
+TIER_PATTERN = re.compile(r'item\s*\[\d+\]:\s*class\s*=\s*"([^"\n]*)"\s*name\s*=[ \t]*([^\n]*)')
+INTERVAL_PATTERN = re.compile(r"intervals\s*\[\d+\]:\s*xmin\s*=\s*(\S+)\s*xmax\s*=\s*(\S+)\s*text\s*=[ \t]*([^\n]*)")
+
+
+def unquote(value: str) -> str:
+    """
+    Removes the quotes around a Praat string value, as praatio does.
+
+    :param value: the value as written in the file
+    :return: the string without surrounding quotes and whitespace
+    """
+    value = value.strip()
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+    return value.strip()
+
+
+def read_textgrid_text(file_name: str) -> str:
+    """
+    Reads the text of a TextGrid file, which Praat saves as UTF-16 (with a byte order mark) or UTF-8.
+
+    :param file_name: path of the TextGrid file
+    :return: the contents of the file
+    """
+    with open(file_name, "rb") as textgrid_file:
+        data = textgrid_file.read()
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        text = data.decode("utf-16")
+    else:
+        text = data.decode("utf-8-sig")
+    return text.replace("\r\n", "\n")
+
+
+def check_tiers_found(found_tier_names: List[str], tier_names: Sequence[str]) -> None:
+    """
+    Checks that a TextGrid has at least one of the selected interval tiers, so that a file without any of them is
+    reported as failed rather than silently contributing no intervals.
+
+    :param found_tier_names: names of the selected interval tiers found in the file
+    :param tier_names: names of the tiers to extract
+    """
+    if not found_tier_names:
+        raise ValueError(f"None of the interval tiers {', '.join(tier_names)} were found")
+
+
+def iterate_long_textgrid_intervals(text: str, tier_names: Sequence[str]) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    Lazily yields the intervals of the selected interval tiers of a TextGrid in Praat's long text format, skipping
+    intervals with blank labels as praatio does.
+
+    :param text: contents of the TextGrid file
+    :param tier_names: names of the tiers to extract
+    :return: an iterator over (tier name, start, stop, label) tuples, with times as written in the file
+    """
+    tiers = list(TIER_PATTERN.finditer(text))
+    check_tiers_found([unquote(tier.group(2)) for tier in tiers
+                       if tier.group(1) == "IntervalTier" and unquote(tier.group(2)) in tier_names], tier_names)
+    for index, tier in enumerate(tiers):
+        tier_class, tier_name = tier.group(1), unquote(tier.group(2))
+        if tier_class != "IntervalTier" or tier_name not in tier_names:
+            continue
+        tier_end = tiers[index + 1].start() if index + 1 < len(tiers) else len(text)
+        for start, stop, label in INTERVAL_PATTERN.findall(text, tier.end(), tier_end):
+            label = unquote(label)
+            if label:
+                yield tier_name, start, stop, label
+
+
+def iterate_textgrid_intervals(file_name: str, tier_names: Sequence[str]) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    Lazily yields the intervals of the selected interval tiers of a TextGrid file. Files in the long text format are
+    read with a native parser, other formats are read with praatio.
+
+    :param file_name: path of the TextGrid file
+    :param tier_names: names of the tiers to extract
+    :return: an iterator over (tier name, start, stop, label) tuples
+    """
+    text = read_textgrid_text(file_name)
+    if "ooTextFile short" not in text and "item [" in text:
+        yield from iterate_long_textgrid_intervals(text, tier_names)
+        return
+    from praatio import tgio
+    text_grid: tgio.Textgrid = tgio.openTextgrid(file_name)
+    check_tiers_found([tier_name for tier_name in text_grid.tierNameList
+                       if tier_name in tier_names and isinstance(text_grid.tierDict[tier_name], tgio.IntervalTier)],
+                      tier_names)
+    for tier_name in text_grid.tierNameList:
+        tier = text_grid.tierDict[tier_name]
+        if tier_name in tier_names and isinstance(tier, tgio.IntervalTier):
+            for start, stop, label in tier.entryList:
+                yield tier_name, start, stop, label
+
+
+def process_textgrid_file(file_name: str,
+                          tier_names: Sequence[str] = DEFAULT_TIERS,
+                          audio_index: AudioIndex = None) -> List[Dict[str, Union[str, int]]]:
+    """
+    Extracts the intervals of the selected tiers of a TextGrid file, in the format described in process_textgrid.
+
+    :param file_name: path of the TextGrid file
+    :param tier_names: names of the tiers to extract
+    :param audio_index: optional index of the corpus audio, if given the file must have a paired wav file in it
+    :return: list of interval data in dictionary form
+    """
+    basename, extension = os.path.splitext(os.path.basename(file_name))
+    if audio_index is not None and audio_index.paired_audio(file_name) is None:
+        raise ValueError(f"WAV file not found for {os.path.basename(file_name)}. "
+                         f"Please put it next to the TextGrid file in {os.path.dirname(file_name)}.")
+    audio_file_name = os.path.join(".", basename + ".wav")
+    intervals = []
+    for tier_name, start, stop, label in iterate_textgrid_intervals(file_name, tier_names):
+        intervals.append({
+            "audio_file_name": audio_file_name,
+            "transcript": label.replace('"', ''),
+            "start_ms": seconds_to_milliseconds(float(start)),
+            "stop_ms": seconds_to_milliseconds(float(stop))
+        })
+    return intervals
+
+
+def find_textgrid_files(input_directory: str) -> List[str]:
+    """
+    Finds the TextGrid files in a directory, recursively.
+
+    :param input_directory: directory to search
+    :return: sorted paths of the TextGrid files
+    """
+    return sorted(scan_directory(input_directory, {".TextGrid"}))
+
 
-def process_textgrid(input_directory: str) -> List[Dict[str, Union[str, int]]]:
+def iterate_textgrid_files(file_names: Iterable[str],
+                           tier_names: Sequence[str] = DEFAULT_TIERS,
+                           jobs: int = 1,
+                           failed_files: List[Tuple[str, str]] = None,
+                           audio_index: AudioIndex = None) -> Iterator[Dict[str, Union[str, int]]]:
+    """
+    Lazily yields the intervals of a collection of TextGrid files, optionally parsing them across a pool of worker
+    processes. Intervals are yielded in the order of the given files, whatever the number of jobs.
+
+    :param file_names: paths of the TextGrid files
+    :param tier_names: names of the tiers to extract from each file
+    :param jobs: number of worker processes to use, 1 parses the files in the current process
+    :param failed_files: an optional list to append (file name, error message) to for each file that failed
+    :param audio_index: optional index of the corpus audio, files without a paired wav file in it fail. Each file
+                        is only sent the entry of its own wav file
+    :return: an iterator over interval data in dictionary form
+    """
+    arguments = [(file_name,
+                  list(tier_names),
+                  None if audio_index is None else audio_index.subset([paired_audio_path(file_name)]))
+                 for file_name in file_names]
+    yield from iterate_safely(process_textgrid_file, arguments, jobs, failed_files, chunksize=16)
+
+
+def process_textgrid(input_directory: str,
+                     tier_names: Sequence[str] = DEFAULT_TIERS,
+                     jobs: int = 1) -> List[Dict[str, Union[str, int]]]:
     """
     Traverses through the textgrid files in the given directory and extracts 
     transcription information in each tier and creates a list of dictionaries,
@@ -26,25 +190,31 @@ def process_textgrid(input_directory: str) -> List[Dict[str, Union[str, int]]]:
                         'stop_ms': <stop_time_in_milliseconds>}
                         
     :param input_directory: directory path containing input_scripts files from where the method
+    :param tier_names: names of the tiers to extract from each file
+    :param jobs: number of worker processes used to parse the files
     :return: list of interval data in dictionary form
     """
-    intervals: List[Dict[str, Union[str, int]]] = []
-
-    for root, directories, files in os.walk(input_directory):
-        for filename in files:
-            basename, extension = os.path.splitext(filename)
-            if filename.endswith(".TextGrid"):
-                text_grid: tgio.Textgrid = tgio.openTextgrid(os.path.join(root, filename))
-                speech_tier: tgio.IntervalTier = text_grid.tierDict["Speech"]
-                for start, stop, label in speech_tier.entryList:
-                    label_word: str = label.replace('"', '')
-                    intervals.append({
-                        "audio_file_name": os.path.join(".", basename + ".wav"),
-                        "transcript": label_word,
-                        "start_ms": seconds_to_milliseconds(float(start)),
-                        "stop_ms": seconds_to_milliseconds(float(stop))
-                    })
-    return intervals
+    return list(iterate_textgrid(input_directory, tier_names, jobs))
+
+
+def iterate_textgrid(input_directory: str,
+                     tier_names: Sequence[str] = DEFAULT_TIERS,
+                     jobs: int = 1,
+                     failed_files: List[Tuple[str, str]] = None,
+                     audio_index: AudioIndex = None) -> Iterator[Dict[str, Union[str, int]]]:
+    """
+    Lazily yields the intervals of the textgrid files in the given directory, one file at a time.
+    See process_textgrid for the format of each interval.
+
+    :param input_directory: directory path containing input_scripts files from where the method
+    :param tier_names: names of the tiers to extract from each file
+    :param jobs: number of worker processes used to parse the files
+    :param failed_files: an optional list to append (file name, error message) to for each file that failed
+    :param audio_index: optional index of the corpus audio, see iterate_textgrid_files
+    :return: an iterator over interval data in dictionary form
+    """
+    yield from iterate_textgrid_files(find_textgrid_files(input_directory), tier_names, jobs, failed_files,
+                                      audio_index)
 
 
 def seconds_to_milliseconds(seconds: float) -> int:
@@ -62,28 +232,60 @@ def main() -> None:
     """ 
     Run the entire textgrid_to_json.py as a command line utility.
     
-    Usage: python3 textgrid_to_json.py [-h] [-i INPUT_DIR] [-o OUTPUT_DIR]
+    Usage: python3 textgrid_to_json.py [-h] [-i INPUT_DIR] [-o OUTPUT_DIR] [-j OUTPUT_JSON] [-t TIER [TIER ...]]
+                                       [-n JOBS] [-a AUDIO_INDEX]
     """
 
     parser = argparse.ArgumentParser(
         description="Search input_scripts folder for .TextGrid files and convert to JSON on stdout")
     parser.add_argument("-i", "--input_dir", help="The input_scripts data dir", type=str, default="input_scripts/data/")
     parser.add_argument("-o", "--output_dir", help="Output directory", type=str, default="input_scripts/output_scripts/tmp")
+    parser.add_argument("-j", "--output_json",
+                        help="File path to output json (defaults to one named after the output directory), "
+                             "use a .jsonl extension to stream JSON Lines",
+                        type=str)
+    parser.add_argument("-t", "--tier",
+                        help="Names of the interval tiers to extract",
+                        type=str,
+                        nargs="+",
+                        default=DEFAULT_TIERS)
+    parser.add_argument("-n", "--jobs",
+                        help="Number of worker processes used to parse TextGrid files",
+                        type=int,
+                        default=1)
+    parser.add_argument("-a", "--audio_index",
+                        help="Audio index file, TextGrid files without a wav file beside them are reported as failed",
+                        type=str)
     arguments = parser.parse_args()
 
     if not os.path.exists(arguments.output_dir):
         os.makedirs(arguments.output_dir)
 
-    intervals = process_textgrid(arguments.input_dir)
+    audio_index = None
+    if arguments.audio_index:
+        audio_index = AudioIndex(arguments.audio_index)
+        audio_index.update(arguments.input_dir)
+        audio_index.save()
+
+    failed_files: List[Tuple[str, str]] = []
+    intervals = iterate_textgrid(arguments.input_dir, arguments.tier, arguments.jobs, failed_files, audio_index)
 
-    result_base_name, name = os.path.split(arguments.output_dir)
-    if not name or name == ".":
-        outfile_name = "intervals.json"
+    if arguments.output_json:
+        output_json = arguments.output_json
     else:
-        outfile_name = os.path.join(name + ".json")
+        result_base_name, name = os.path.split(arguments.output_dir)
+        if not name or name == ".":
+            outfile_name = "intervals.json"
+        else:
+            outfile_name = os.path.join(name + ".json")
+        output_json = os.path.join(result_base_name, outfile_name)
+    write_utterances(intervals, output_json)
 
-    output_json = os.path.join(result_base_name, outfile_name)
-    write_data_to_json_file(intervals, output_json)
+    for file_name, error in failed_files:
+        print(f"Failed to process {file_name}: {error}", file=sys.stderr)
+    if failed_files:
+        print(f"{len(failed_files)} TextGrid files could not be processed.", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
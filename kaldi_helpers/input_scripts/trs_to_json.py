@@ -3,6 +3,9 @@
 """
 Parse a Transcriber (*.trs) file and extract information from it and export in json format.
 
+Files are streamed with iterparse, with the speakers indexed once per file, and can be parsed across a pool of
+worker processes with --jobs.
+
 Copyright: University of Queensland, 2019
 Contributors:
               Aninda Saha (University of Queensland, 2018)
@@ -15,10 +18,9 @@ import sys
 import argparse
 import platform
 import uuid
-import glob
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Set, Tuple, Union
-from kaldi_helpers.script_utilities import find_files_by_extensions, write_data_to_json_file
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+from kaldi_helpers.script_utilities import iterate_safely, scan_directory, write_utterances
 
 
 def conditional_log(condition: bool, text: str) -> None:
@@ -37,10 +39,48 @@ def conditional_log(condition: bool, text: str) -> None:
         sys.stderr.flush()
 
 
+def index_speakers(speakers_node: ET.Element) -> Dict[str, str]:
+    """
+    Maps the id of every speaker in a .trs file to their name, so that turns can look up their speaker without
+    searching the whole tree.
+
+    :param speakers_node: the Speakers node, or any node containing Speaker nodes
+    :return: a dictionary of speaker id to speaker name
+    """
+    return {speaker.get("id", ""): speaker.get("name", "") for speaker in speakers_node.iter("Speaker")}
+
+
+def iterate_trs(file_name: str) -> Iterator[Dict[str, Union[str, float]]]:
+    """
+    Lazily yields the utterances of a .trs file. The file is streamed with iterparse, and each turn is discarded once
+    its utterances have been extracted, so memory use does not grow with the length of the transcript.
+
+    :param file_name: file_name of the .trs file
+    :return: an iterator over the utterances of the file, see process_trs
+    """
+    wave_name = ""
+    speakers: Dict[str, str] = {}
+    parents: List[ET.Element] = []
+    for event, element in ET.iterparse(file_name, events=("start", "end")):
+        if event == "start":
+            if element.tag == "Trans":
+                wave_name = element.attrib["audio_filename"] + ".wav"
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == "Speakers":
+            speakers.update(index_speakers(element))
+        elif element.tag == "Turn":
+            yield from process_turn(wave_name, element, speakers=speakers)
+            if parents:
+                parents[-1].remove(element)
+
+
 def process_trs(file_name: str, verbose_output: bool) -> List[Dict[str, Union[str, float]]]:
 
     """
-    Method to process the trs files and return a list of utterances.
+    Method to process the trs files and return a list of utterances. Files that are not well formed XML are logged
+    and the ParseError is raised, so that they are reported as failed by iterate_trs_files.
 
     :param file_name: file_name of the .trs file
     :param verbose_output: whether or not output_scripts to stderr
@@ -54,41 +94,40 @@ def process_trs(file_name: str, verbose_output: bool) -> List[Dict[str, Union[st
 
     conditional_log(verbose_output, "Processing transcript '%s'\n" % file_name)
 
-    utterances: List[Dict[str, Union[str, float]]] = []
     try:
-        tree: ET.ElementTree = ET.parse(file_name)
-        root: ET.Element = tree.getroot()
-        wave_name: str = root.attrib["audio_filename"] + ".wav"
-        turn_nodes: List[ET.Element] = tree.findall(".//Turn")
-        for turn_node in turn_nodes:
-            utterances = utterances + process_turn(wave_name, turn_node, tree)
+        return list(iterate_trs(file_name))
     except ET.ParseError as error:
         conditional_log(True, "XML parser failed to parse '%s'!\n" % file_name)
-        conditional_log(True, str(error))
-    return utterances
+        conditional_log(True, str(error) + "\n")
+        raise
 
 
-def process_turn(wave_name: str, turn_node: ET.Element, tree: ET.ElementTree) -> List[Dict[str, Union[str, float]]]:
+def process_turn(wave_name: str,
+                 turn_node: ET.Element,
+                 tree: ET.ElementTree = None,
+                 speakers: Dict[str, str] = None) -> List[Dict[str, Union[str, float]]]:
     """
     Helper method to process each turn_node in the .trs file.
 
-    :param file_name: name of the file
-    :param turn_node: the ElementTree node to be processed
     :param wave_name: name of .wav audio file to be processed
-    :param tree: XML data represented as a tree data structure
+    :param turn_node: the ElementTree node to be processed
+    :param tree: XML data represented as a tree data structure, used to find the speakers if they are not given
+    :param speakers: a dictionary of speaker id to speaker name, see index_speakers
     :return: list of key information on utterances
     """
 
+    if speakers is None:
+        speakers = index_speakers(tree.getroot())
+
     turn_end: float = float(turn_node.attrib["endTime"])
     speaker_id: str = turn_node.get("speaker", "")
 
-    speaker_name_node: ET.Element = tree.find(".//Speaker[@id='%s']" % speaker_id)
-    if speaker_name_node is not None:
-        speaker_name: str = speaker_name_node.attrib["name"]
-    else:
+    speaker_name = speakers.get(speaker_id)
+    if speaker_name is None:
         speaker_name: str = str(uuid.uuid4())
 
-    items: List[Tuple[str, str]] = [(element.attrib["time"], element.tail.strip()) for element in turn_node.findall("./Sync")]
+    items: List[Tuple[str, str]] = [(element.attrib["time"], (element.tail or "").strip())
+                                    for element in turn_node.findall("./Sync")]
     wave_file_name = os.path.join(".", wave_name)
 
     result: List[Dict[str, Union[str, float]]] = []
@@ -109,13 +148,31 @@ def process_turn(wave_name: str, turn_node: ET.Element, tree: ET.ElementTree) ->
     return result
 
 
+def iterate_trs_files(file_names: Iterable[str],
+                      verbose_output: bool,
+                      jobs: int = 1,
+                      failed_files: List[Tuple[str, str]] = None) -> Iterator[Dict[str, Union[str, float]]]:
+    """
+    Lazily yields the utterances of each .trs file in turn, optionally parsing the files across a pool of worker
+    processes. Utterances are yielded in the order of the given files, whatever the number of jobs.
+
+    :param file_names: paths of the .trs files to process
+    :param verbose_output: whether or not output_scripts to stderr
+    :param jobs: number of worker processes to use, 1 parses the files in the current process
+    :param failed_files: an optional list to append (file name, error message) to for each file that failed
+    :return: an iterator over the utterances of all files
+    """
+    arguments = [(file_name, verbose_output) for file_name in file_names]
+    yield from iterate_safely(process_trs, arguments, jobs, failed_files)
+
+
 def main() -> None:
     """
     Run the entire trs_to_json.py as a command line utility. It processes the utterances
     and outputs to a file in the same directory as the input_scripts .trs file. The output
     files is named after the basename of the input directory appended with a .json extension.
 
-    Usage: python3 trs_to_json.py [-h] [-d INPUT_DIRECTORY] [-v] > {OUTPUT_FILE]
+    Usage: python3 trs_to_json.py [-h] [-i INPUT_DIR] [-v] [-o OUTPUT_JSON] [-n JOBS]
     """
 
     parser = argparse.ArgumentParser(description="A command line utility to convert .trs files to .json",
@@ -125,27 +182,33 @@ def main() -> None:
                         help="Input directory, default='working_dir/input/data'",
                         default="working_dir/input/data/")
     parser.add_argument('-v', '--verbose',
-                        type=str,
                         help='More logging to console.',
                         action="store_true")
     parser.add_argument("-o", "--output_json",
                         type=str,
-                        help="File name to output_scripts json",
+                        help="File name to output_scripts json, use a .jsonl extension to stream JSON Lines",
                         default="working_dir/input/output/tmp/")
+    parser.add_argument("-n", "--jobs",
+                        type=int,
+                        help="Number of worker processes used to parse .trs files",
+                        default=1)
 
     arguments: argparse.Namespace = parser.parse_args()
 
     if arguments.verbose:
-        sys.stderr.write(arguments.input_directory + "\n")
+        sys.stderr.write(arguments.input_dir + "\n")
 
-    all_files_in_dir: Set[str] = set(glob.glob(os.path.join(arguments.input_dir, "**"), recursive=True))
-    transcript_names: Set[str] = find_files_by_extensions(all_files_in_dir, {"*.trs"})
+    transcript_names: List[str] = list(scan_directory(arguments.input_dir, {".trs"}))
 
-    utterances = []
-    for file_name in transcript_names:
-        utterances = utterances + process_trs(file_name, arguments.verbose)
+    failed_files: List[Tuple[str, str]] = []
+    utterances = iterate_trs_files(sorted(transcript_names), arguments.verbose, arguments.jobs, failed_files)
+    write_utterances(utterances, arguments.output_json)
 
-    write_data_to_json_file(utterances, arguments.output_json)
+    for file_name, error in failed_files:
+        print(f"Failed to process {file_name}: {error}", file=sys.stderr)
+    if failed_files:
+        print(f"{len(failed_files)} of {len(transcript_names)} .trs files could not be processed.", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
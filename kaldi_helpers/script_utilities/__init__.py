@@ -1,3 +1,10 @@
 from .file_utilities import *
 from .json_utilities import *
+from .cache_utilities import *
+from .lexicon_utilities import *
+from .sort_utilities import *
+from .split_utilities import *
+from .audio_utilities import *
+from .elan_utilities import *
+from .pool_utilities import *
 from .globals import *
@@ -0,0 +1,277 @@
+"""
+Collection of utilities for reading, converting and writing PCM WAV audio in process with numpy, and for indexing the
+WAV files of a corpus by their headers.
+
+Copyright: University of Queensland, 2019
+"""
+
+import json
+import math
+import os
+import wave
+import numpy as np
+from typing import Dict, Iterable, Optional, Tuple
+from kaldi_helpers.script_utilities.file_utilities import DirectoryIndex, scan_directory
+from kaldi_helpers.script_utilities.json_utilities import write_json_atomically
+
+# Largest number of output samples computed at once by resample_polyphase, to bound memory use
+RESAMPLE_CHUNK_SIZE = 16384
+# Kaiser window beta and filter half length (in multiples of the larger rate factor) of the anti-aliasing filter
+KAISER_BETA = 5.0
+FILTER_HALF_LENGTH = 10
+# Bump to discard existing audio indexes when their format changes
+AUDIO_INDEX_VERSION = 1
+
+
+def read_wav(file_path: str) -> Tuple[np.ndarray, int]:
+    """
+    Reads a PCM WAV file into floating point samples.
+    :param file_path: path of the WAV file
+    :return: a tuple of (samples of shape (frames, channels) scaled to [-1, 1), sample rate)
+    """
+    with wave.open(file_path, "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        data = wav_file.readframes(wav_file.getnframes())
+    if sample_width == 1:
+        # 8 bit WAVs are unsigned
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128) / 128
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(values >= 1 << 23, values - (1 << 24), values) / float(1 << 23)
+    elif sample_width in (2, 4):
+        dtype = np.dtype(f"<i{sample_width}")
+        samples = np.frombuffer(data, dtype=dtype).astype(np.float64) / float(1 << (8 * sample_width - 1))
+    else:
+        raise wave.Error(f"Unsupported sample width of {sample_width} bytes in {file_path}")
+    return samples.reshape(-1, channels), sample_rate
+
+
+def write_wav(file_path: str, samples: np.ndarray, sample_rate: int) -> None:
+    """
+    Writes floating point samples to a 16 bit PCM WAV file, rounding and clipping them.
+    :param file_path: path of the WAV file to write
+    :param samples: samples scaled to [-1, 1), of shape (frames,) for mono or (frames, channels)
+    :param sample_rate: sample rate in Hz
+    """
+    samples = samples.reshape(len(samples), -1)
+    pcm = np.clip(np.round(samples * 32768), -32768, 32767).astype("<i2")
+    with wave.open(file_path, "wb") as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+
+
+def remix(samples: np.ndarray, channels: int) -> np.ndarray:
+    """
+    Converts samples to the given number of channels. Mixing down to mono averages the channels, like sox.
+    :param samples: samples of shape (frames, channels)
+    :param channels: the number of channels wanted
+    :return: samples of shape (frames, channels)
+    """
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    raise ValueError(f"Cannot remix {samples.shape[1]} channels to {channels}")
+
+
+def lowpass_filter(taps: int, cutoff: float) -> np.ndarray:
+    """
+    Designs a linear phase, Kaiser windowed sinc lowpass FIR filter with unit gain at DC.
+    :param taps: number of filter taps (odd)
+    :param cutoff: cutoff frequency as a fraction of the Nyquist frequency
+    :return: the filter taps
+    """
+    positions = np.arange(taps) - (taps - 1) / 2
+    filter_taps = cutoff * np.sinc(cutoff * positions) * np.kaiser(taps, KAISER_BETA)
+    return filter_taps / filter_taps.sum()
+
+
+def resample_polyphase(samples: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Resamples a signal by a rational factor with a polyphase FIR filter: conceptually upsampling by inserting zeros,
+    lowpass filtering and keeping every n-th sample, but only computing the filter taps that meet non-zero input
+    samples for the outputs that are kept. The filter's delay is compensated, so output and input are aligned.
+    :param samples: samples of shape (frames,) or (frames, channels)
+    :param sample_rate: sample rate of the input in Hz
+    :param target_rate: sample rate wanted in Hz
+    :return: the resampled samples, of length ceil(frames * target_rate / sample_rate)
+    """
+    divisor = math.gcd(sample_rate, target_rate)
+    up, down = target_rate // divisor, sample_rate // divisor
+    if up == down:
+        return samples.copy()
+
+    max_rate = max(up, down)
+    half_length = FILTER_HALF_LENGTH * max_rate
+    filter_taps = lowpass_filter(2 * half_length + 1, 1 / max_rate) * up
+    # Phase p of the filter holds taps p, p + up, p + 2 * up, ...
+    taps_per_phase = -(-len(filter_taps) // up)
+    phases = np.zeros(taps_per_phase * up)
+    phases[:len(filter_taps)] = filter_taps
+    phases = phases.reshape(taps_per_phase, up).T
+
+    frames = len(samples)
+    output_frames = -(-frames * up // down)
+    padded = np.concatenate((np.zeros((taps_per_phase,) + samples.shape[1:]),
+                             samples,
+                             np.zeros((half_length // up + 2,) + samples.shape[1:])))
+    output = np.empty((output_frames,) + samples.shape[1:])
+    tap_offsets = np.arange(taps_per_phase)
+    for start in range(0, output_frames, RESAMPLE_CHUNK_SIZE):
+        # Position of each output sample in the upsampled signal, delayed by half the filter length
+        positions = np.arange(start, min(start + RESAMPLE_CHUNK_SIZE, output_frames)) * down + half_length
+        input_indices = (positions // up)[:, None] - tap_offsets[None, :] + taps_per_phase
+        weights = phases[positions % up]
+        if samples.ndim == 1:
+            output[start:start + len(positions)] = np.einsum("ij,ij->i", padded[input_indices], weights)
+        else:
+            output[start:start + len(positions)] = np.einsum("ijc,ij->ic", padded[input_indices], weights)
+    return output
+
+
+def convert_wav(input_file: str, output_file: str, sample_rate: int, channels: int = 1) -> None:
+    """
+    Converts a PCM WAV file to a 16 bit WAV with the given sample rate and channels.
+    :param input_file: path of the WAV file to convert
+    :param output_file: path to write the converted file to
+    :param sample_rate: target sample rate in Hz
+    :param channels: target number of channels
+    """
+    samples, source_rate = read_wav(input_file)
+    samples = remix(samples, channels)
+    samples = resample_polyphase(samples, source_rate, sample_rate)
+    write_wav(output_file, samples, sample_rate)
+
+
+def read_wav_header(file_path: str) -> Dict[str, float]:
+    """
+    Reads the format of a PCM WAV file from its header, without reading the audio.
+    :param file_path: path of the WAV file
+    :return: a dictionary of sample_rate, channels, sample_width (in bytes), frames and duration_ms
+    """
+    with wave.open(file_path, "rb") as wav_file:
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.getnframes()
+        return {"sample_rate": sample_rate,
+                "channels": wav_file.getnchannels(),
+                "sample_width": wav_file.getsampwidth(),
+                "frames": frames,
+                "duration_ms": frames * 1000 / sample_rate if sample_rate else 0.0}
+
+
+def paired_audio_path(transcript_path: str) -> str:
+    """
+    Gives the path of the WAV file a transcript is paired with, which has the same name in the same directory.
+    """
+    return os.path.normpath(os.path.splitext(transcript_path)[0] + ".wav")
+
+
+def is_under_directory(path: str, directory_path: str) -> bool:
+    """
+    Checks whether a normalised path lies under a normalised directory, without touching the file system.
+    :param path: the path to check
+    :param directory_path: the directory
+    :return: True if the path is inside the directory or one of its subdirectories
+    """
+    if directory_path == os.curdir:
+        return not os.path.isabs(path) and path != os.pardir and not path.startswith(os.pardir + os.sep)
+    return path.startswith(directory_path + os.sep)
+
+
+class AudioIndex:
+    """
+    An index of the WAV files in a corpus, holding the format of each file as read from its header, so that stages
+    can look up whether a transcript has audio, and how long it is, without touching the audio again. Entries are
+    kept with the size and modification time of their file and are only read again when these change. The index can
+    be saved to disk, so repeated runs over the same corpus only read the headers of new or changed files.
+    Files the wave module cannot read, such as compressed WAVs, are indexed with an "error" in place of their format.
+    """
+
+    def __init__(self, index_path: str = None) -> None:
+        self.index_path = index_path
+        self.entries: Dict[str, dict] = {}
+        self.changed = False
+        if index_path and os.path.isfile(index_path):
+            with open(index_path, "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+            if index.get("version") == AUDIO_INDEX_VERSION:
+                self.entries = index["files"]
+
+    def read(self, audio_path: str) -> dict:
+        """
+        Indexes a WAV file, reading its header unless its size and modification time are unchanged.
+        :param audio_path: path of the WAV file
+        :return: the entry of the file
+        """
+        audio_path = os.path.normpath(audio_path)
+        status = os.stat(audio_path)
+        entry = self.entries.get(audio_path)
+        if entry is None or entry["size"] != status.st_size or entry["mtime"] != status.st_mtime_ns:
+            entry = {"size": status.st_size, "mtime": status.st_mtime_ns}
+            try:
+                entry.update(read_wav_header(audio_path))
+            except (wave.Error, EOFError) as error:
+                entry["error"] = f"{type(error).__name__}: {error}"
+            self.entries[audio_path] = entry
+            self.changed = True
+        return entry
+
+    def update(self, directory_path: str, directory_index: DirectoryIndex = None) -> None:
+        """
+        Indexes the WAV files in a directory tree, and forgets the files under it that no longer exist.
+        :param directory_path: root of the corpus
+        :param directory_index: optional directory index to read unchanged directory listings from
+        """
+        directory_path = os.path.normpath(directory_path)
+        found = {os.path.normpath(audio_path)
+                 for audio_path in scan_directory(directory_path, {".wav"}, index=directory_index)}
+        for audio_path in sorted(found):
+            self.read(audio_path)
+        for audio_path in [path for path in self.entries
+                           if is_under_directory(path, directory_path) and path not in found]:
+            del self.entries[audio_path]
+            self.changed = True
+
+    def info(self, audio_path: str) -> Optional[dict]:
+        """
+        Looks up an indexed WAV file.
+        :param audio_path: path of the WAV file
+        :return: its entry, with sample_rate, channels, sample_width, frames and duration_ms (or an error if its
+                 header could not be read), or None if the file is not in the index
+        """
+        return self.entries.get(os.path.normpath(audio_path))
+
+    def paired_audio(self, transcript_path: str) -> Optional[str]:
+        """
+        Finds the WAV file paired with a transcript, see paired_audio_path.
+        :param transcript_path: path of the transcript
+        :return: the path of the WAV file, or None if it is not in the index
+        """
+        audio_path = paired_audio_path(transcript_path)
+        return audio_path if audio_path in self.entries else None
+
+    def subset(self, audio_paths: Iterable[str]) -> "AudioIndex":
+        """
+        Gives an unsaved index holding only the given files, which is cheap to send to a worker process.
+        :param audio_paths: paths of the WAV files to keep, those not in the index are left out
+        :return: the smaller index
+        """
+        subset = AudioIndex()
+        for audio_path in audio_paths:
+            entry = self.info(audio_path)
+            if entry is not None:
+                subset.entries[os.path.normpath(audio_path)] = entry
+        return subset
+
+    def save(self) -> None:
+        """
+        Writes the index to disk if it has changed, see write_json_atomically.
+        """
+        if self.index_path and self.changed:
+            write_json_atomically({"version": AUDIO_INDEX_VERSION, "files": self.entries}, self.index_path)
+            self.changed = False
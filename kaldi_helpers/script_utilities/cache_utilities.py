@@ -0,0 +1,79 @@
+"""
+Collection of utilities for caching the per-file results of pipeline stages on disk, keyed on content hashes.
+
+Copyright: University of Queensland, 2019
+"""
+
+import hashlib
+import json
+import os
+from typing import Iterable, List, Optional
+from kaldi_helpers.script_utilities.json_utilities import load_jsonl_file, write_json_atomically
+
+# Bump to invalidate every existing cache entry when the format of cached data changes
+CACHE_VERSION = 1
+
+
+def hash_file(file_path: str, options: dict = None) -> str:
+    """
+    Computes a hash of the contents of a file together with the options used to process it.
+    :param file_path: path to the file to hash
+    :param options: JSON serialisable options that affect how the file is processed
+    :return: the hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(json.dumps([CACHE_VERSION, options], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_data(data: object, options: dict = None) -> str:
+    """
+    Computes a hash of JSON serialisable data together with the options used to process it.
+    :param data: JSON serialisable data to hash
+    :param options: JSON serialisable options that affect how the data is processed
+    :return: the hexadecimal digest
+    """
+    serialised = json.dumps([CACHE_VERSION, options, data], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialised.encode("utf-8")).hexdigest()
+
+
+class UtteranceCache:
+    """
+    A directory of JSON Lines files, each holding the utterances produced from one source file and named after
+    the hash of that source file and its processing options.
+    """
+
+    def __init__(self, cache_directory: str) -> None:
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory, exist_ok=True)
+        self.cache_directory = cache_directory
+
+    def path_for(self, key: str) -> str:
+        """
+        Gives the path of the cache file for a key, sharded by the first two characters of the key.
+        :param key: a hash produced by hash_file or hash_data
+        :return: the path to the cache file
+        """
+        return os.path.join(self.cache_directory, key[:2], key + ".jsonl")
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        """
+        Looks up the utterances stored for a key.
+        :param key: a hash produced by hash_file or hash_data
+        :return: the cached list of utterances, or None if there is no entry for the key
+        """
+        path = self.path_for(key)
+        if not os.path.isfile(path):
+            return None
+        return list(load_jsonl_file(path))
+
+    def put(self, key: str, utterances: Iterable[dict]) -> None:
+        """
+        Stores the utterances for a key, atomically, see write_json_atomically.
+        :param key: a hash produced by hash_file or hash_data
+        :param utterances: the utterances to store
+        """
+        write_json_atomically(utterances, self.path_for(key), json_lines=True)
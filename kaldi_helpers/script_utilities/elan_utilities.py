@@ -0,0 +1,173 @@
+"""
+Collection of utilities for reading single tiers of ELAN (.eaf) files without building a full pympi Eaf object.
+
+The file is streamed through expat, the parser beneath ElementTree's iterparse, without building any elements: time
+slots are collected, and annotations are only read for the requested tier. Reference tiers need the annotations of their parent
+tiers to find their times, so for those the parent chain is read in a second pass. The annotation data matches what
+pympi's Eaf.get_annotation_data_for_tier gives for the same tier.
+
+Copyright: University of Queensland, 2019
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+from xml.parsers import expat
+
+ALIGNABLE_ANNOTATION = "ALIGNABLE_ANNOTATION"
+REF_ANNOTATION = "REF_ANNOTATION"
+# Number of bytes fed to the parser at a time
+READ_CHUNK_SIZE = 1 << 16
+
+
+class EafScanner:
+    """
+    Streams an eaf file through expat, collecting the time slots, the attributes of every tier and the annotations
+    of the given tiers. No element objects are built, and end tags and text are only handled inside the given tiers,
+    by swapping the parser's handlers in and out as tiers start.
+    """
+
+    def __init__(self, tier_ids: Set[str]) -> None:
+        self.tier_ids = tier_ids
+        self.time_slots: Dict[str, Optional[str]] = {}
+        self.tiers: Dict[str, Dict[str, str]] = {}
+        self.annotations: Dict[str, List[tuple]] = {}
+        self.current_tier_id = ""
+        self.current_tier: Optional[List[tuple]] = None
+        self.finished_tiers: Set[str] = set()
+        self.annotation: list = []
+        self.text: List[str] = []
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start_element
+
+    def start_element(self, name: str, attributes: Dict[str, str]) -> None:
+        if name == "TIME_SLOT":
+            self.time_slots[attributes["TIME_SLOT_ID"]] = attributes.get("TIME_VALUE")
+        elif name == "TIER":
+            tier_id = attributes["TIER_ID"]
+            self.tiers[tier_id] = attributes
+            if tier_id in self.tier_ids:
+                self.current_tier_id = tier_id
+                self.current_tier = self.annotations.setdefault(tier_id, [])
+                self.parser.EndElementHandler = self.end_element
+        elif self.current_tier is None:
+            return
+        elif name == ALIGNABLE_ANNOTATION:
+            self.annotation = [ALIGNABLE_ANNOTATION, attributes["ANNOTATION_ID"], attributes["TIME_SLOT_REF1"],
+                               attributes["TIME_SLOT_REF2"], ""]
+        elif name == REF_ANNOTATION:
+            self.annotation = [REF_ANNOTATION, attributes["ANNOTATION_ID"], attributes["ANNOTATION_REF"], ""]
+        elif name == "ANNOTATION_VALUE":
+            self.text = []
+            self.parser.CharacterDataHandler = self.text.append
+
+    def end_element(self, name: str) -> None:
+        if name == "ANNOTATION_VALUE":
+            self.annotation[-1] = "".join(self.text)
+            self.parser.CharacterDataHandler = None
+        elif name == ALIGNABLE_ANNOTATION or name == REF_ANNOTATION:
+            self.current_tier.append(tuple(self.annotation))
+        elif name == "TIER":
+            self.finished_tiers.add(self.current_tier_id)
+            self.current_tier = None
+            self.parser.EndElementHandler = None
+
+    def scan(self, file_name: str, stop_when_read: bool = False) -> None:
+        """
+        Reads an eaf file.
+        :param file_name: path of the eaf file
+        :param stop_when_read: stop reading as soon as all the given tiers have been read
+        """
+        with open(file_name, "rb") as eaf_file:
+            while True:
+                data = eaf_file.read(READ_CHUNK_SIZE)
+                self.parser.Parse(data, not data)
+                if not data or (stop_when_read and self.finished_tiers >= self.tier_ids):
+                    break
+
+
+def scan_eaf(file_name: str,
+             tier_ids: Set[str],
+             stop_when_read: bool = False) -> Tuple[Dict[str, Optional[str]],
+                                                    Dict[str, Dict[str, str]],
+                                                    Dict[str, List[tuple]]]:
+    """
+    Reads the time slots, the attributes of every tier and the annotations of the given tiers of an eaf file in a
+    single streaming pass.
+    :param file_name: path of the eaf file
+    :param tier_ids: ids of the tiers to read the annotations of
+    :param stop_when_read: stop reading as soon as the given tiers have been read, in which case the attributes of
+                           later tiers are not read
+    :return: a tuple of (time slot values by id, tier attributes by tier id, annotations by tier id), where each
+             annotation is either (ALIGNABLE_ANNOTATION, id, start time slot, end time slot, value) or
+             (REF_ANNOTATION, id, referenced annotation id, value)
+    """
+    scanner = EafScanner(tier_ids)
+    scanner.scan(file_name, stop_when_read)
+    return scanner.time_slots, scanner.tiers, scanner.annotations
+
+
+def time_slot_value(time_slots: Dict[str, Optional[str]], time_slot: str) -> Optional[int]:
+    """
+    Gives the time of a time slot in milliseconds, or None if the time slot is unaligned.
+    :param time_slots: dictionary of time slot id to its time value as written in the file, see scan_eaf
+    :param time_slot: id of the time slot
+    :return: the time in milliseconds, or None
+    """
+    time_value = time_slots[time_slot]
+    return time_value if time_value is None else int(time_value)
+
+
+def read_eaf_tier(file_name: str, tier_id: str) -> Tuple[List[tuple], Dict[str, str]]:
+    """
+    Reads the annotations of a single tier of an eaf file.
+    :param file_name: path of the eaf file
+    :param tier_id: id of the tier to read
+    :return: a tuple of (annotation data, tier attributes such as PARTICIPANT). The annotation data is a list of
+             (start ms, end ms, value) tuples for aligned annotations, and (start ms, end ms, value, parent value)
+             tuples for reference annotations, giving the times of the aligned annotation each belongs to. A tier
+             holding both kinds gives both, in document order
+    :raises KeyError: if the file has no tier with the given id
+    """
+    time_slots, tiers, annotations = scan_eaf(file_name, {tier_id})
+    if tier_id not in tiers:
+        raise KeyError(tier_id)
+    tier_annotations = annotations.get(tier_id, [])
+    references = [annotation for annotation in tier_annotations if annotation[0] == REF_ANNOTATION]
+    if not references:
+        return [(time_slot_value(time_slots, start_slot), time_slot_value(time_slots, end_slot), value)
+                for _, _, start_slot, end_slot, value in tier_annotations], tiers[tier_id]
+
+    # Read the annotations of the parent chain, which the reference annotations point into
+    ancestors: Set[str] = set()
+    parent = tiers[tier_id].get("PARENT_REF")
+    while parent and parent in tiers and parent not in ancestors:
+        ancestors.add(parent)
+        parent = tiers[parent].get("PARENT_REF")
+    _, _, ancestor_annotations = scan_eaf(file_name, ancestors, stop_when_read=True)
+
+    aligned: Dict[str, Tuple[str, str, str]] = {}
+    referenced: Dict[str, str] = {}
+    for annotation_list in list(ancestor_annotations.values()) + [tier_annotations]:
+        for annotation in annotation_list:
+            if annotation[0] == ALIGNABLE_ANNOTATION:
+                aligned[annotation[1]] = annotation[2:]
+            else:
+                referenced[annotation[1]] = annotation[2]
+
+    annotation_data = []
+    for annotation in tier_annotations:
+        if annotation[0] == ALIGNABLE_ANNOTATION:
+            _, _, start_slot, end_slot, value = annotation
+            annotation_data.append((time_slot_value(time_slots, start_slot),
+                                    time_slot_value(time_slots, end_slot),
+                                    value))
+            continue
+        _, _, reference, value = annotation
+        while reference not in aligned:
+            reference = referenced[reference]
+        start_slot, end_slot, parent_value = aligned[reference]
+        annotation_data.append((time_slot_value(time_slots, start_slot),
+                                time_slot_value(time_slots, end_slot),
+                                value,
+                                parent_value))
+    return annotation_data, tiers[tier_id]
@@ -6,26 +6,53 @@ Contributors:
              Nicholas Lambourne - (University of Queensland, 2018)
 """
 
-import glob
+import json
 import os
-from typing import Set, List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from kaldi_helpers.script_utilities.json_utilities import write_json_atomically
 
+# Bump to discard existing directory indexes when their format changes
+DIRECTORY_INDEX_VERSION = 1
 
-def find_files_by_extensions(set_of_all_files: Set[str], extensions: Set[str]) -> Set[str]:
+
+def normalise_extension(extension: str) -> str:
+    """
+    Puts a file extension in the form compared against by the functions in this module, so that "wav", ".wav",
+    "*.wav" and ".WAV" are all the same extension.
+    :param extension: a file extension, with or without a leading "*" or "."
+    :return: the lower case extension with a leading "."
+    """
+    return "." + extension.lstrip("*").lstrip(".").lower()
+
+
+def normalise_extensions(extensions: Iterable[str]) -> Set[str]:
+    """
+    Normalises a collection of file extensions, see normalise_extension.
+    :param extensions: file extensions, with or without a leading "*" or "."
+    :return: the set of normalised extensions
+    """
+    return {normalise_extension(extension) for extension in extensions}
+
+
+def has_extension(file_path: str, extensions: Set[str]) -> bool:
+    """
+    Checks whether a file has one of the given normalised extensions.
+    :param file_path: path or name of the file
+    :param extensions: extensions as given by normalise_extensions
+    :return: True if the file has one of the extensions
+    """
+    return os.path.splitext(file_path)[1].lower() in extensions
+
+
+def find_files_by_extensions(set_of_all_files: Iterable[str], extensions: Iterable[str]) -> Set[str]:
     """
     Searches for all files in the set of files with the given extensions.
     :param set_of_all_files: set of file names in string format
-    :param extensions: file extension being searched for
+    :param extensions: file extensions being searched for, e.g. "wav", ".wav" or "*.wav", matched case insensitively
     :return: set of file_names matched with given extension. if none exists, returns an empty set.
     """
-    results = set()
-    print(set_of_all_files)
-    for file_path in set_of_all_files:
-        name, extension = os.path.splitext(file_path)
-        print(extension)
-        if extension in extensions:
-            results.add(file_path)
-    return results
+    extensions = normalise_extensions(extensions)
+    return {file_path for file_path in set_of_all_files if has_extension(file_path, extensions)}
 
 
 def find_first_file_by_extension(set_of_all_files: List[str], extensions: List[str]) -> str:
@@ -42,13 +69,120 @@ def find_first_file_by_extension(set_of_all_files: List[str], extensions: List[s
     return ""
 
 
-def find_all_files_in_dir_by_extensions(directory_path: str, extensions: Set[str]) -> Set[str]:
+class DirectoryIndex:
+    """
+    An on-disk index of the files and subdirectories of every directory in a tree, for repeated scans of the same
+    corpus. Each listing is stored with the modification time of its directory, which changes whenever an entry is
+    added, removed or renamed in it, so an unchanged directory costs a stat instead of a listing. Directories that
+    have changed are listed again, and save writes the index back if anything was updated.
+    """
+
+    def __init__(self, index_path: str) -> None:
+        self.index_path = index_path
+        self.listings: Dict[str, dict] = {}
+        self.changed = False
+        if os.path.isfile(index_path):
+            with open(index_path, "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+            if index.get("version") == DIRECTORY_INDEX_VERSION:
+                self.listings = index["directories"]
+
+    def listing(self, directory_path: str) -> Tuple[List[str], List[str]]:
+        """
+        Lists a directory, from the index if the directory is unchanged since it was indexed.
+        :param directory_path: path of the directory
+        :return: a tuple of (sorted file names, sorted subdirectory names)
+        """
+        modified = os.stat(directory_path).st_mtime_ns
+        entry = self.listings.get(directory_path)
+        if entry is None or entry["mtime"] != modified:
+            files, directories = list_directory(directory_path)
+            entry = self.listings[directory_path] = {"mtime": modified, "files": files, "directories": directories}
+            self.changed = True
+        return entry["files"], entry["directories"]
+
+    def save(self) -> None:
+        """
+        Writes the index to disk if it has changed, see write_json_atomically.
+        """
+        if self.changed:
+            write_json_atomically({"version": DIRECTORY_INDEX_VERSION, "directories": self.listings}, self.index_path)
+            self.changed = False
+
+
+def list_directory(directory_path: str) -> Tuple[List[str], List[str]]:
+    """
+    Lists a directory with os.scandir. Symbolic links to directories are listed as directories, like glob does.
+    :param directory_path: path of the directory
+    :return: a tuple of (sorted file names, sorted subdirectory names)
+    """
+    files = []
+    directories = []
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                directories.append(entry.name)
+            else:
+                files.append(entry.name)
+    return sorted(files), sorted(directories)
+
+
+def is_hidden(name: str) -> bool:
+    """
+    Checks whether a file or directory is hidden, i.e. its name starts with a ".", like the macOS "._" files and
+    version control folders that glob skips.
+    :param name: name of the file or directory
+    :return: True if it is hidden
+    """
+    return name.startswith(".")
+
+
+def scan_directory(directory_path: str,
+                   extensions: Iterable[str] = None,
+                   prune: Callable[[str], bool] = None,
+                   index: Optional[DirectoryIndex] = None,
+                   include_hidden: bool = False) -> Iterator[str]:
+    """
+    Lazily yields the files in a directory tree, filtering them by extension as each directory is read. Directories
+    are read one at a time with os.scandir, depth first and in sorted order, so the order is deterministic. Like
+    glob, symbolic links to directories are followed and hidden files and directories are skipped unless asked for.
+    Each directory is only read once, so symbolic links that loop back into the tree do not recurse forever.
+    :param directory_path: root of the tree to scan
+    :param extensions: extensions of the files to yield, e.g. "wav", ".wav" or "*.wav", matched case insensitively.
+                       All files are yielded if not given
+    :param prune: optional function given the path of each subdirectory, returning True to skip it entirely
+    :param index: optional directory index to read unchanged directory listings from, see DirectoryIndex
+    :param include_hidden: also yield hidden files and scan hidden directories, see is_hidden
+    :return: an iterator over the paths of the matching files
+    """
+    extensions = None if extensions is None else normalise_extensions(extensions)
+    list_ = index.listing if index is not None else list_directory
+    directories = [directory_path]
+    seen: Set[Tuple[int, int]] = set()
+    while directories:
+        directory = directories.pop()
+        status = os.stat(directory)
+        if (status.st_dev, status.st_ino) in seen:
+            continue
+        seen.add((status.st_dev, status.st_ino))
+        files, subdirectories = list_(directory)
+        for file_name in files:
+            if (extensions is None or has_extension(file_name, extensions)) and \
+                    (include_hidden or not is_hidden(file_name)):
+                yield os.path.join(directory, file_name)
+        for subdirectory in reversed(subdirectories):
+            if not include_hidden and is_hidden(subdirectory):
+                continue
+            subdirectory_path = os.path.join(directory, subdirectory)
+            if prune is None or not prune(subdirectory_path):
+                directories.append(subdirectory_path)
+
+
+def find_all_files_in_dir_by_extensions(directory_path: str, extensions: Iterable[str]) -> Set[str]:
     """
     Find all files with given extensions in a directory recursively
     :param directory_path: path to directory to recursively search
     :param extensions: the set of allowed extensions
     :return: a set of file paths
     """
-    path = str(os.path.join(directory_path, "**"))
-    all_files_in_dir: Set[str] = set(glob.glob(path, recursive=True))
-    return find_files_by_extensions(all_files_in_dir, extensions)
+    return set(scan_directory(directory_path, extensions))
@@ -8,3 +8,6 @@ DEFAULT_DATA_DIRECTORY = os.path.join(".", "resources", "corpora", "abui_toy_cor
 AUDIO_EXTENSIONS = ["*.wav"]
 TEMPORARY_DIRECTORY = "tmp"
 SOX_PATH = os.path.join("/", "usr", "bin", "sox")
+
+# Used by clean_json.py, a prebuilt English word lookup file so the nltk corpus is not downloaded for every run
+ENGLISH_LEXICON_PATH = os.path.join(os.path.expanduser("~"), ".cache", "kaldi_helpers", "english_words.lookup")
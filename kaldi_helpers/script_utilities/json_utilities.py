@@ -7,9 +7,12 @@ Contributors:
 """
 
 import json
-from typing import Union
+import os
+from typing import Iterable, Iterator, Union
 from _io import TextIOWrapper
 
+JSONL_EXTENSION = ".jsonl"
+
 
 def load_json_file(file_name: str) -> object:
     """
@@ -40,3 +43,97 @@ def write_data_to_json_file(data: object, output: Union[str, TextIOWrapper]) ->
             file.write(json_data_string)
     else:
         print(json_data_string, file=output, flush=True)
+
+
+def load_jsonl_file(file_name: str) -> Iterator[dict]:
+    """
+    Given a filename (parameter) containing JSON Lines (one JSON object per line), lazily
+    yield each object as a python dictionary. Only one line is held in memory at a time.
+    :param file_name: name of file containing JSON Lines to read from.
+    :return an iterator over the Python dictionaries in the file.
+    """
+    with open(file_name, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def write_data_to_jsonl_file(data: Iterable[object], output: Union[str, TextIOWrapper]) -> int:
+    """
+    Writes each item of the given iterable as one line of JSON to the given output_scripts
+    location (either a file - specified as a string, or a stream like sys.stdout). Items are
+    written as they are produced, so the iterable can be a generator of any length.
+    :param data: an iterable of Python objects to be converted to JSON and written.
+    :param output: the file to write the objects to.
+    :return: the number of objects written.
+    """
+    count = 0
+    if isinstance(output, str):
+        with open(output, "w", encoding="utf-8") as file:
+            for item in data:
+                file.write(json.dumps(item, ensure_ascii=False) + "\n")
+                count += 1
+    else:
+        for item in data:
+            print(json.dumps(item, ensure_ascii=False), file=output)
+            count += 1
+        output.flush()
+    return count
+
+
+def is_jsonl_file(file_name: Union[str, TextIOWrapper]) -> bool:
+    """
+    Determines whether the given file should be treated as JSON Lines, based on its extension.
+    :param file_name: the path to the file, or an output stream (never JSON Lines).
+    :return: True if the file has the JSON Lines extension, False otherwise.
+    """
+    return isinstance(file_name, str) and file_name.lower().endswith(JSONL_EXTENSION)
+
+
+def load_utterances(file_name: str) -> Iterator[dict]:
+    """
+    Yields the utterances stored in either a JSON list file or a JSON Lines file (chosen by
+    extension). JSON Lines files are streamed, JSON list files have to be loaded in full.
+    :param file_name: name of the file containing the utterances.
+    :return an iterator over the utterance dictionaries.
+    """
+    if is_jsonl_file(file_name):
+        yield from load_jsonl_file(file_name)
+    else:
+        yield from load_json_file(file_name)
+
+
+def write_utterances(utterances: Iterable[dict], output: Union[str, TextIOWrapper]) -> int:
+    """
+    Writes utterances to the given output_scripts location as JSON Lines if the output is a
+    .jsonl file (streaming), otherwise as a single JSON list.
+    :param utterances: an iterable of utterance dictionaries.
+    :param output: the file to write the utterances to.
+    :return: the number of utterances written.
+    """
+    if is_jsonl_file(output):
+        return write_data_to_jsonl_file(utterances, output)
+    utterances = list(utterances)
+    write_data_to_json_file(utterances, output)
+    return len(utterances)
+
+
+def write_json_atomically(data: object, file_name: str, json_lines: bool = False) -> None:
+    """
+    Writes data to a compact JSON (or JSON Lines) file. It is written to a temporary file first and then moved into
+    place, so concurrent writers and interrupted runs never leave a partial file behind.
+    :param data: the data to write, an iterable of objects when writing JSON Lines
+    :param file_name: path of the file to write, its directory is created if needed
+    :param json_lines: write one object per line, see write_data_to_jsonl_file
+    """
+    directory = os.path.dirname(file_name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{file_name}.{os.getpid()}.tmp"
+    if json_lines:
+        write_data_to_jsonl_file(data, temporary_path)
+    else:
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+    os.replace(temporary_path, file_name)
@@ -0,0 +1,100 @@
+"""
+Collection of utilities for building and reading compact, memory mapped word lookup files.
+
+A lookup file holds a sorted array of UTF-8 encoded words:
+    magic (8 bytes) | word count N (uint32) | N + 1 word offsets (uint32) | concatenated words
+Opening one only maps the file into memory, so it is effectively instant regardless of the number of words, and
+membership tests are binary searches over the mapped array.
+
+Copyright: University of Queensland, 2019
+"""
+
+import mmap
+import os
+import struct
+from typing import Dict, Iterable
+
+LOOKUP_FILE_MAGIC = b"KHWORDS1"
+_COUNT_FORMAT = "<I"
+_OFFSET_SIZE = struct.calcsize(_COUNT_FORMAT)
+
+
+def build_word_lookup_file(words: Iterable[str], file_path: str) -> int:
+    """
+    Writes a sorted, de-duplicated word lookup file. The file is written to a temporary path and then moved into
+    place, so readers never see a partially written file.
+    :param words: the words to store
+    :param file_path: path of the lookup file to write
+    :return: the number of unique words written
+    """
+    encoded_words = sorted({word.encode("utf-8") for word in words})
+    offsets = [0]
+    for encoded_word in encoded_words:
+        offsets.append(offsets[-1] + len(encoded_word))
+
+    directory = os.path.dirname(file_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(LOOKUP_FILE_MAGIC)
+        file.write(struct.pack(_COUNT_FORMAT, len(encoded_words)))
+        file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        file.write(b"".join(encoded_words))
+    os.replace(temporary_path, file_path)
+    return len(encoded_words)
+
+
+class WordLookup:
+    """
+    Read-only, set-like view of a word lookup file built by build_word_lookup_file. Supports `word in lookup` and
+    len(lookup). Results of previous membership tests are remembered, since corpora repeat the same words often.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        with open(file_path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(LOOKUP_FILE_MAGIC)] != LOOKUP_FILE_MAGIC:
+            self._map.close()
+            raise ValueError(f"{file_path} is not a word lookup file.")
+        header_size = len(LOOKUP_FILE_MAGIC)
+        self._count = struct.unpack_from(_COUNT_FORMAT, self._map, header_size)[0]
+        self._offsets_start = header_size + _OFFSET_SIZE
+        self._words_start = self._offsets_start + (self._count + 1) * _OFFSET_SIZE
+        self._memo: Dict[str, bool] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, word: object) -> bool:
+        if not isinstance(word, str):
+            return False
+        found = self._memo.get(word)
+        if found is None:
+            found = self._search(word.encode("utf-8"))
+            self._memo[word] = found
+        return found
+
+    def _word_at(self, index: int) -> bytes:
+        start, end = struct.unpack_from("<2I", self._map, self._offsets_start + index * _OFFSET_SIZE)
+        return self._map[self._words_start + start:self._words_start + end]
+
+    def _search(self, encoded_word: bytes) -> bool:
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self._word_at(middle)
+            if candidate < encoded_word:
+                low = middle + 1
+            elif candidate > encoded_word:
+                high = middle
+            else:
+                return True
+        return False
+
+    def close(self) -> None:
+        """
+        Unmaps the lookup file.
+        """
+        self._map.close()
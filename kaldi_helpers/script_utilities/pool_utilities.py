@@ -0,0 +1,55 @@
+"""
+Collection of utilities for processing the files of a corpus across a pool of worker processes.
+
+Copyright: University of Queensland, 2019
+"""
+
+from multiprocessing import Pool
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+
+def call_safely(task: Tuple[Callable[..., list], tuple]) -> Tuple[tuple, list, str]:
+    """
+    Calls a function for use in a worker pool. Rather than raising, any error is caught and returned so that one bad
+    file does not stop the rest of the corpus from being processed.
+    :param task: a tuple of (function, arguments to call it with)
+    :return: a tuple of (arguments, results, error message or an empty string on success)
+    """
+    function, arguments = task
+    try:
+        return arguments, function(*arguments), ""
+    except Exception as error:
+        return arguments, [], f"{type(error).__name__}: {error}"
+
+
+def iterate_safely(function: Callable[..., list],
+                   arguments: Iterable[tuple],
+                   jobs: int = 1,
+                   failed_files: List[Tuple[str, str]] = None,
+                   chunksize: int = 1) -> Iterator:
+    """
+    Lazily calls a function returning a list of results for each tuple of arguments, optionally across a pool of
+    worker processes, and yields the results in the order of the arguments, so the output does not depend on the
+    number of jobs. The first argument of each call is taken to be the file being processed.
+    :param function: module level function to call, taking the file name as its first argument
+    :param arguments: a tuple of arguments for each call
+    :param jobs: number of worker processes to use, 1 makes the calls in the current process
+    :param failed_files: an optional list to append (file name, error message) to for each call that failed
+    :param chunksize: number of calls sent to a worker at a time
+    :return: an iterator over the results of all calls
+    """
+    tasks = ((function, tuple(call_arguments)) for call_arguments in arguments)
+
+    def collect(results: Iterable[Tuple[tuple, list, str]]) -> Iterator:
+        for call_arguments, call_results, error in results:
+            if error:
+                if failed_files is not None:
+                    failed_files.append((call_arguments[0], error))
+            else:
+                yield from call_results
+
+    if jobs > 1:
+        with Pool(processes=jobs) as pool:
+            yield from collect(pool.imap(call_safely, tasks, chunksize=chunksize))
+    else:
+        yield from collect(map(call_safely, tasks))
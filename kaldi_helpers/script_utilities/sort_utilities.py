@@ -0,0 +1,89 @@
+"""
+Collection of utilities for sorting more lines of text than comfortably fit in memory.
+
+Copyright: University of Queensland, 2019
+"""
+
+import heapq
+import os
+import tempfile
+from typing import Iterable, Iterator, List, TextIO
+
+# Number of lines buffered in memory before a sorted run is spilled to disk
+DEFAULT_BUFFER_LINES = 200000
+
+
+class ExternalSorter:
+    """
+    Collects lines of text and gives them back in sorted order, like appending to a list and sorting it, but with
+    bounded memory use. Whenever the in memory buffer holds max_lines lines it is sorted and spilled to a temporary
+    file as a run. Reading the sorter k-way merges the runs with whatever is left in the buffer.
+    Each line should end with a newline, as the runs are written to and read back from text files line by line.
+    """
+
+    def __init__(self, max_lines: int = DEFAULT_BUFFER_LINES, temporary_directory: str = None) -> None:
+        self.max_lines = max_lines
+        self.temporary_directory = temporary_directory
+        self.buffer: List[str] = []
+        self.run_paths: List[str] = []
+        self.line_count = 0
+
+    def __len__(self) -> int:
+        return self.line_count
+
+    def append(self, line: str) -> None:
+        """
+        Adds a line, spilling the buffer to disk if it is full.
+        :param line: the line to add, ending with a newline
+        """
+        self.buffer.append(line)
+        self.line_count += 1
+        if len(self.buffer) >= self.max_lines:
+            self._spill()
+
+    def extend(self, lines: Iterable[str]) -> None:
+        """
+        Adds several lines, see append.
+        :param lines: the lines to add
+        """
+        for line in lines:
+            self.append(line)
+
+    def _spill(self) -> None:
+        self.buffer.sort()
+        file_descriptor, run_path = tempfile.mkstemp(prefix="kaldi_helpers_sort_",
+                                                     suffix=".txt",
+                                                     dir=self.temporary_directory)
+        with open(file_descriptor, "w", encoding="utf-8", newline="") as run_file:
+            run_file.writelines(self.buffer)
+        self.run_paths.append(run_path)
+        self.buffer = []
+
+    def __iter__(self) -> Iterator[str]:
+        self.buffer.sort()
+        run_files = [open(run_path, "r", encoding="utf-8", newline="") for run_path in self.run_paths]
+        try:
+            yield from heapq.merge(*run_files, self.buffer)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+    def write_to(self, output_file: TextIO) -> int:
+        """
+        Writes every line in sorted order.
+        :param output_file: open text file to write to
+        :return: the number of lines written
+        """
+        output_file.writelines(self)
+        return self.line_count
+
+    def close(self) -> None:
+        """
+        Deletes the spilled runs and empties the sorter.
+        """
+        for run_path in self.run_paths:
+            if os.path.exists(run_path):
+                os.remove(run_path)
+        self.run_paths = []
+        self.buffer = []
+        self.line_count = 0
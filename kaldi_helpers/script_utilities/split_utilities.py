@@ -0,0 +1,171 @@
+"""
+Collection of utilities for splitting utterances into training and testing sets.
+
+Copyright: University of Queensland, 2019
+"""
+
+import bisect
+import hashlib
+import json
+import math
+import os
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+from kaldi_helpers.script_utilities.json_utilities import load_json_file, write_data_to_json_file
+
+TRAINING = "training"
+TESTING = "testing"
+
+# How utterances can be grouped so that every utterance in a group ends up in the same set
+GROUP_BY_OPTIONS = ["utterance", "speaker", "recording"]
+# interleave sends every n-th group to testing, in the order they are seen
+# hash assigns each group from a seeded hash of its key, independent of order
+SPLIT_METHODS = ["interleave", "hash"]
+
+
+class DataSplitter:
+    """
+    Assigns utterances to the training or testing set in a single streaming pass.
+
+    Utterances are grouped by utterance, speaker or recording, and every utterance in a group goes to the same set,
+    so that e.g. no speaker appears in both sets. Groups can be stratified by the duration of their first utterance,
+    in which case the test fraction is applied within each duration bin. With the interleave method the split is
+    exact per stratum; by default (interleave, grouped by utterance, no strata) it sends every tenth utterance to
+    testing like earlier versions of json_to_kaldi. With the hash method the split only depends on the seed and
+    the group keys, so adding data never moves existing groups.
+
+    The assignments of speaker and recording groups are remembered, one entry per group, and can be saved to a JSON
+    manifest and loaded again to reuse the same split for known groups, as long as the split options have not
+    changed. Single utterances are never remembered, so splitting by utterance keeps no per-utterance state; the hash
+    method reproduces such a split on later builds without a manifest.
+    """
+
+    def __init__(self,
+                 test_fraction: float = 0.1,
+                 group_by: str = "utterance",
+                 method: str = "interleave",
+                 duration_bins: List[int] = None,
+                 seed: int = 0,
+                 manifest_file: str = None) -> None:
+        if group_by not in GROUP_BY_OPTIONS:
+            raise ValueError(f"Unknown group_by option: {group_by}, expected one of {GROUP_BY_OPTIONS}")
+        if method not in SPLIT_METHODS:
+            raise ValueError(f"Unknown split method: {method}, expected one of {SPLIT_METHODS}")
+        if not 0 <= test_fraction <= 1:
+            raise ValueError(f"Test fraction must be between 0 and 1, got {test_fraction}")
+        self.test_fraction = Fraction(test_fraction).limit_denominator(1000)
+        self.group_by = group_by
+        self.method = method
+        self.duration_bins = sorted(duration_bins) if duration_bins else []
+        self.seed = seed
+        self.manifest_file = manifest_file
+
+        self.assignments: Dict[str, str] = {}
+        self.group_counts: Dict[int, int] = {}
+        self.set_counts: Dict[str, int] = {TRAINING: 0, TESTING: 0}
+        if manifest_file and os.path.isfile(manifest_file):
+            manifest = load_json_file(manifest_file)
+            if manifest.get("options") == self.options():
+                self.assignments = manifest.get("assignments", {})
+
+    def options(self) -> dict:
+        """
+        Gives the options that determine the split, as stored in the manifest.
+        :return: a dictionary of split options
+        """
+        return {
+            "test_fraction": str(self.test_fraction),
+            "group_by": self.group_by,
+            "method": self.method,
+            "duration_bins": self.duration_bins,
+            "seed": self.seed,
+        }
+
+    def group_key(self, utterance: dict) -> str:
+        """
+        Gives the key of the group an utterance belongs to.
+        :param utterance: an utterance dictionary
+        :return: the group key
+        """
+        audio_file_name = utterance.get("audio_file_name", "").replace("\\", "/")
+        if self.group_by == "recording":
+            return audio_file_name
+        if self.group_by == "speaker" and "speaker_id" in utterance:
+            return utterance["speaker_id"]
+        # Utterances without a speaker are grouped on their own
+        return json.dumps([audio_file_name,
+                           utterance.get("speaker_id"),
+                           utterance.get("start_ms", 0),
+                           utterance.get("stop_ms", 0)])
+
+    def is_grouped(self, utterance: dict) -> bool:
+        """
+        Checks whether an utterance is grouped with others, in which case the assignment of its group is remembered.
+        :param utterance: an utterance dictionary
+        :return: True if the utterance is grouped by speaker or recording
+        """
+        return self.group_by == "recording" or (self.group_by == "speaker" and "speaker_id" in utterance)
+
+    def stratum(self, utterance: dict) -> int:
+        """
+        Gives the duration bin of an utterance, 0 when not stratifying.
+        :param utterance: an utterance dictionary
+        :return: index of the duration bin
+        """
+        duration_ms = utterance.get("stop_ms", 0) - utterance.get("start_ms", 0)
+        return bisect.bisect_right(self.duration_bins, duration_ms)
+
+    def hash_fraction(self, stratum: int, group_key: str) -> float:
+        """
+        Maps a group to a number in [0, 1) using a seeded hash.
+        :param stratum: the stratum of the group
+        :param group_key: the group key
+        :return: the hashed value
+        """
+        digest = hashlib.sha1(f"{self.seed}:{stratum}:{group_key}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+    def _assign_group(self, stratum: int, group_key: str) -> str:
+        if self.method == "hash":
+            return TESTING if self.hash_fraction(stratum, group_key) < self.test_fraction else TRAINING
+        # The n-th group of a stratum goes to testing whenever n * test_fraction passes an integer
+        count = self.group_counts.get(stratum, 0)
+        self.group_counts[stratum] = count + 1
+        if math.ceil(count * self.test_fraction) != math.ceil((count + 1) * self.test_fraction):
+            return TESTING
+        return TRAINING
+
+    def assign(self, utterance: dict) -> str:
+        """
+        Assigns an utterance to a set.
+        :param utterance: an utterance dictionary
+        :return: TRAINING or TESTING
+        """
+        group_key = self.group_key(utterance)
+        data_set = self.assignments.get(group_key)
+        if data_set is None:
+            data_set = self._assign_group(self.stratum(utterance), group_key)
+            self.set_counts[data_set] += 1
+            if self.is_grouped(utterance):
+                self.assignments[group_key] = data_set
+        return data_set
+
+    def counts(self) -> Tuple[int, int]:
+        """
+        Gives the number of new groups assigned to each set, not counting those read from the manifest.
+        :return: a tuple of (training groups, testing groups)
+        """
+        return self.set_counts[TRAINING], self.set_counts[TESTING]
+
+    def save(self, manifest_file: Optional[str] = None) -> None:
+        """
+        Writes the split options and group assignments to a JSON manifest.
+        :param manifest_file: path to write to, defaults to the manifest the splitter was created with
+        """
+        manifest_file = manifest_file or self.manifest_file
+        if not manifest_file:
+            return
+        directory = os.path.dirname(manifest_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        write_data_to_json_file({"options": self.options(), "assignments": self.assignments}, manifest_file)
@@ -83,7 +83,12 @@ fi
 
 local=data/local
 mkdir $local/tmp
-ngram-count -order $lm_order -write-vocab $local/tmp/vocab-full.txt -wbdiscount -text $local/corpus.txt -lm $local/tmp/lm.arpa
+# Use the n-gram counts from make_ngram_counts.py if present (of at least lm_order), else count corpus.txt
+if [ -f $local/ngram_counts.txt ]; then
+    ngram-count -order $lm_order -write-vocab $local/tmp/vocab-full.txt -wbdiscount -read $local/ngram_counts.txt -lm $local/tmp/lm.arpa
+else
+    ngram-count -order $lm_order -write-vocab $local/tmp/vocab-full.txt -wbdiscount -text $local/corpus.txt -lm $local/tmp/lm.arpa
+fi
 
 echo
 echo "===== MAKING G.fst ====="
@@ -1,7 +1,8 @@
 import os
+import pytest
 from _pytest.capture import CaptureFixture
 from kaldi_helpers.input_scripts.clean_json import *
-from kaldi_helpers.script_utilities import write_data_to_json_file
+from kaldi_helpers.script_utilities import write_data_to_json_file, build_word_lookup_file
 
 EXAMPLE_JSON_DATA = [
     {"transcript": "Comment t'appelles tu?"},
@@ -18,6 +19,16 @@ def test_get_english_words() -> None:
     assert "français" not in english_words
 
 
+def test_get_english_words_offline(tmp_path) -> None:
+    lexicon_path = str(tmp_path / "english.lookup")
+    with pytest.raises(FileNotFoundError):
+        get_english_words(lexicon_path, offline=True)
+    build_word_lookup_file(["test", "house"], lexicon_path)
+    english_words = get_english_words(lexicon_path, offline=True)
+    assert "test" in english_words
+    assert "français" not in english_words
+
+
 def test_clean_utterance_remove_english() -> None:
     example_utterance = {"transcript": "je veux une petite dejeuner"}
     english_words = get_english_words()
@@ -76,6 +87,101 @@ def test_clean_json_data_full() -> None:
     ]
 
 
+def test_utterance_cleaner_matches_clean_utterance() -> None:
+    english_words = {"house", "water", "dinner"}
+    punctuation = string.punctuation + "…’“–”‘°"
+    utterances = EXAMPLE_JSON_DATA + [
+        {"transcript": "the house by the water"},
+        {"transcript": "<silence> ama hada <silence>"},
+        {"transcript": "ama 123 hada"},
+        {"transcript": "ama h4da"},
+        {"transcript": "ama @eng@ hada"},
+        {"transcript": "“quoted” words … and ? marks"},
+        {"transcript": "?! ..."},
+    ]
+    cleaner = UtteranceCleaner(remove_english=True,
+                               english_words=english_words,
+                               punctuation=punctuation,
+                               special_cases=["<silence>"])
+    for utterance in utterances:
+        expected_words, expected_count = clean_utterance(utterance,
+                                                         remove_english=True,
+                                                         english_words=english_words,
+                                                         punctuation=punctuation,
+                                                         special_cases=["<silence>"])
+        assert cleaner.clean_words(utterance["transcript"]) == (expected_words, expected_count)
+        if is_valid_utterance(expected_words, expected_count, True, False, None):
+            assert cleaner.clean_transcript(utterance["transcript"]) == " ".join(expected_words).strip()
+        else:
+            assert cleaner.clean_transcript(utterance["transcript"]) is None
+
+
+def test_iterate_cached_clean_json_data(tmp_path) -> None:
+    dirty_data = [
+        {"audio_file_name": "a.wav", "transcript": "Comment t'appelles tu?"},
+        {"audio_file_name": "a.wav", "transcript": "Je m'appelle François."},
+        {"audio_file_name": "b.wav", "transcript": "Vraiment? Je n'ai jamais lu ça."},
+    ]
+    cache_directory = str(tmp_path / "cache")
+    expected = clean_json_data([dict(utterance) for utterance in dirty_data])
+    first_run = list(iterate_cached_clean_json_data([dict(utterance) for utterance in dirty_data],
+                                                    create_utterance_cleaner(),
+                                                    cache_directory))
+    second_run = list(iterate_cached_clean_json_data([dict(utterance) for utterance in dirty_data],
+                                                     create_utterance_cleaner(),
+                                                     cache_directory))
+    assert first_run == expected
+    assert second_run == expected
+    # One cache entry per audio file
+    assert len(list(tmp_path.glob("cache/*/*.jsonl"))) == 2
+
+
+def test_language_id_cache_persists(tmp_path) -> None:
+    cache_file = str(tmp_path / "langid.jsonl")
+    identifier = get_langid_identifier()
+    transcripts = ["the cat sat on the mat", "je ne sais pas", "The  cat sat ON the mat", "je ne sais pas"]
+    cache = LanguageIdCache(cache_file)
+    decisions = [cache.classify(transcript, identifier) for transcript in transcripts]
+    # Cached decisions are the ones langid makes, which depend on case and whitespace
+    assert decisions == [tuple(identifier.classify(transcript)) for transcript in transcripts]
+    assert len(cache.new_transcripts) == 3
+    cache.save()
+    reloaded = LanguageIdCache(cache_file)
+    assert reloaded.decisions == cache.decisions
+    assert [reloaded.classify(transcript, None) for transcript in transcripts] == decisions
+    assert reloaded.new_transcripts == []
+
+
+def test_utterance_cleaner_langid_matches_is_valid_utterance() -> None:
+    identifier = get_langid_identifier()
+    utterances = EXAMPLE_JSON_DATA + [
+        {"transcript": "where is the dinner this morning"},
+        {"transcript": "ngaya yuwa ngaya balga"},
+        {"transcript": "where is the dinner this morning"},
+        # Punctuation left as its own word cleans to an empty word, so the cleaned transcript has a double space
+        {"transcript": "ngaya yuwa - ngaya balga"},
+        {"transcript": "Where is the dinner ! this morning"},
+    ]
+    # The cached decisions of the batch engine match the uncached path
+    expected = []
+    for utterance in utterances:
+        clean_words, english_word_count = clean_utterance(utterance,
+                                                          remove_english=True,
+                                                          english_words=set(),
+                                                          punctuation=string.punctuation,
+                                                          special_cases=[])
+        if is_valid_utterance(clean_words, english_word_count, True, True, identifier):
+            expected.append(" ".join(clean_words).strip())
+    cleaner = UtteranceCleaner(remove_english=True,
+                               use_langid=True,
+                               punctuation=string.punctuation,
+                               langid_identifier=identifier,
+                               batch_size=2)
+    cleaned = [utterance["transcript"] for utterance in cleaner.clean(dict(utterance) for utterance in utterances)]
+    assert cleaned == expected
+    assert "where is the dinner this morning" not in cleaned
+
+
 def test_clean_json_data_full_file() -> None:
     file_in_name = 'file_in.json'
     file_out_name = 'file_out.json'
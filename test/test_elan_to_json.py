@@ -1,3 +1,6 @@
+import glob
+import pytest
+import shutil
 from kaldi_helpers.input_scripts.elan_to_json import *
 
 SCRIPT_PATH = os.path.join('.', 'kaldi_helpers', 'elan_to_json.py')
@@ -30,3 +33,126 @@ def test_process_eaf():
     assert len(utterances) == len(contents)
     for dictionary in utterances:
         assert dictionary in contents
+
+
+def test_process_eaf_files_parallel():
+    input_dir = os.path.join(".", "test", "testfiles", "elan")
+    input_eaf_files = glob.glob(os.path.join(input_dir, "*.eaf"))
+
+    serial_annotations, serial_failures = process_eaf_files(input_eaf_files, "Phrase", jobs=1)
+    parallel_annotations, parallel_failures = process_eaf_files(reversed(input_eaf_files), "Phrase", jobs=2)
+
+    # Output order does not depend on the number of jobs or the order the files were found in
+    assert serial_annotations == parallel_annotations
+    assert [annotation["audio_file_name"] for annotation in serial_annotations] == \
+        ["first.wav", "first.wav", "second.wav", "second.wav"]
+
+    # A missing WAV is reported rather than stopping the whole run
+    assert serial_failures == parallel_failures
+    assert len(serial_failures) == 1
+    failed_file, error = serial_failures[0]
+    assert os.path.basename(failed_file) == "missing_audio.eaf"
+    assert "WAV file not found" in error
+
+
+def test_process_eaf_files_cached(tmp_path):
+    input_eaf_file = os.path.join(".", "test", "testfiles", "elan", "first.eaf")
+    cache_directory = str(tmp_path / "cache")
+
+    annotations = process_eaf_cached(input_eaf_file, "Phrase", cache_directory)
+    assert annotations == process_eaf(input_eaf_file, "Phrase")
+
+    # A second run is served from the cache, keyed on the file contents and tier
+    key = hash_file(input_eaf_file, {"stage": "elan_to_json", "tier": "Phrase"})
+    assert UtteranceCache(cache_directory).get(key) == annotations
+    assert process_eaf_cached(input_eaf_file, "Phrase", cache_directory) == annotations
+
+    # Changing the tier misses the cache
+    assert process_eaf_cached(input_eaf_file, "Translation", cache_directory) != annotations
+
+
+def test_process_eaf_cached_checks_audio(tmp_path):
+    for name in ["first.eaf", "first.wav"]:
+        shutil.copy(os.path.join(".", "test", "testfiles", "elan", name), str(tmp_path / name))
+    input_eaf_file = str(tmp_path / "first.eaf")
+    cache_directory = str(tmp_path / "cache")
+    annotations = process_eaf_cached(input_eaf_file, "Phrase", cache_directory)
+
+    # A cached file whose audio has been removed still fails, with or without an audio index
+    os.remove(str(tmp_path / "first.wav"))
+    with pytest.raises(ValueError):
+        process_eaf_cached(input_eaf_file, "Phrase", cache_directory)
+    with pytest.raises(ValueError):
+        process_eaf_cached(input_eaf_file, "Phrase", cache_directory, AudioIndex())
+    assert annotations
+
+
+def test_read_eaf_tier_matches_pympi(tmp_path):
+    from pympi.Elan import Eaf
+
+    eaf = Eaf()
+    eaf.add_linguistic_type("gloss-lt", "Symbolic_Association", timealignable=False)
+    eaf.add_tier("Phrase", part="Speaker A")
+    eaf.add_tier("Words")
+    eaf.add_tier("Gloss", ling="gloss-lt", parent="Phrase")
+    eaf.add_tier("Gloss2", ling="gloss-lt", parent="Gloss")
+    for index in range(20):
+        eaf.add_annotation("Phrase", index * 1000, index * 1000 + 800, f"phrase {index}")
+        eaf.add_annotation("Words", index * 1000 + 100, index * 1000 + 300, "")
+        eaf.add_ref_annotation("Gloss", "Phrase", index * 1000 + 400, f"gloss {index}")
+        eaf.add_ref_annotation("Gloss2", "Gloss", index * 1000 + 400, f"gloss2 {index}")
+    file_name = str(tmp_path / "tiers.eaf")
+    eaf.to_file(file_name)
+
+    parsed = Eaf(file_name)
+    for tier_name in ["Phrase", "Words", "Gloss", "Gloss2", "default"]:
+        annotations, parameters = read_eaf_tier(file_name, tier_name)
+        assert sorted(annotations) == sorted(parsed.get_annotation_data_for_tier(tier_name))
+        assert parameters == parsed.get_parameters_for_tier(tier_name)
+
+    with pytest.raises(KeyError):
+        read_eaf_tier(file_name, "Missing")
+
+
+def test_read_eaf_tier_mixed_tier(tmp_path):
+    # A tier holding both aligned and reference annotations gives both kinds, in document order
+    file_name = str(tmp_path / "mixed.eaf")
+    with open(file_name, "w", encoding="utf-8") as eaf_file:
+        eaf_file.write("""<?xml version="1.0" encoding="UTF-8"?>
+<ANNOTATION_DOCUMENT FORMAT="2.8" VERSION="2.8">
+    <TIME_ORDER>
+        <TIME_SLOT TIME_SLOT_ID="ts1" TIME_VALUE="0"/>
+        <TIME_SLOT TIME_SLOT_ID="ts2" TIME_VALUE="800"/>
+        <TIME_SLOT TIME_SLOT_ID="ts3" TIME_VALUE="1000"/>
+        <TIME_SLOT TIME_SLOT_ID="ts4" TIME_VALUE="1500"/>
+    </TIME_ORDER>
+    <TIER TIER_ID="Phrase" LINGUISTIC_TYPE_REF="default-lt">
+        <ANNOTATION><ALIGNABLE_ANNOTATION ANNOTATION_ID="a1" TIME_SLOT_REF1="ts1" TIME_SLOT_REF2="ts2">
+            <ANNOTATION_VALUE>first</ANNOTATION_VALUE></ALIGNABLE_ANNOTATION></ANNOTATION>
+    </TIER>
+    <TIER TIER_ID="Mixed" LINGUISTIC_TYPE_REF="default-lt" PARENT_REF="Phrase">
+        <ANNOTATION><ALIGNABLE_ANNOTATION ANNOTATION_ID="a2" TIME_SLOT_REF1="ts3" TIME_SLOT_REF2="ts4">
+            <ANNOTATION_VALUE>aligned</ANNOTATION_VALUE></ALIGNABLE_ANNOTATION></ANNOTATION>
+        <ANNOTATION><REF_ANNOTATION ANNOTATION_ID="a3" ANNOTATION_REF="a1">
+            <ANNOTATION_VALUE>reference</ANNOTATION_VALUE></REF_ANNOTATION></ANNOTATION>
+    </TIER>
+</ANNOTATION_DOCUMENT>
+""")
+    annotations, parameters = read_eaf_tier(file_name, "Mixed")
+    assert annotations == [(1000, 1500, "aligned"), (0, 800, "reference", "first")]
+    assert [annotation["transcript"] for annotation in extract_eaf_annotations(file_name, "Mixed")] == \
+        ["reference", "aligned"]
+
+
+def test_process_eaf_files_with_audio_index(tmp_path):
+    input_dir = os.path.join(".", "test", "testfiles", "elan")
+    input_eaf_files = glob.glob(os.path.join(input_dir, "*.eaf"))
+    audio_index = AudioIndex(str(tmp_path / "audio_index.json"))
+    audio_index.update(input_dir)
+
+    failed_files = []
+    annotations = list(iterate_eaf_files(input_eaf_files, "Phrase", jobs=2, failed_files=failed_files,
+                                         audio_index=audio_index))
+    assert annotations == process_eaf_files(input_eaf_files, "Phrase")[0]
+    assert [os.path.basename(file_name) for file_name, error in failed_files] == ["missing_audio.eaf"]
+    assert "WAV file not found" in failed_files[0][1]
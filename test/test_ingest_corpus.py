@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import pytest
+import shutil
+from praatio import tgio
+from kaldi_helpers.input_scripts.elan_to_json import process_eaf
+from kaldi_helpers.input_scripts.ingest_corpus import *
+from kaldi_helpers.input_scripts.textgrid_to_json import process_textgrid_file
+from kaldi_helpers.input_scripts.trs_to_json import process_trs
+from kaldi_helpers.script_utilities import pool_utilities, scan_directory, AudioIndex
+
+TEST_FILES = os.path.join(".", "test", "testfiles")
+
+
+def test_iterate_corpus(tmp_path) -> None:
+    # A mixed corpus, with each format in its own subfolder
+    for name in ["first.eaf", "first.wav", "missing_audio.eaf"]:
+        os.makedirs(tmp_path / "elan", exist_ok=True)
+        shutil.copy(os.path.join(TEST_FILES, "elan", name), str(tmp_path / "elan" / name))
+    os.makedirs(tmp_path / "trs" / "nested")
+    shutil.copy(os.path.join(TEST_FILES, "test.trs"), str(tmp_path / "trs" / "nested" / "test.trs"))
+    text_grid = tgio.Textgrid()
+    text_grid.addTier(tgio.IntervalTier("Speech", [(0, 1.5, "hello")], 0, 2))
+    text_grid.addTier(tgio.IntervalTier("Other", [(0, 2, "other")], 0, 2))
+    text_grid.save(str(tmp_path / "grid.TextGrid"), useShortForm=False)
+    shutil.copy(os.path.join(TEST_FILES, "elan", "first.wav"), str(tmp_path / "grid.wav"))
+    with open(str(tmp_path / "notes.txt"), "w") as notes:
+        notes.write("not a transcription")
+
+    eaf_file = str(tmp_path / "elan" / "first.eaf")
+    trs_file = str(tmp_path / "trs" / "nested" / "test.trs")
+    textgrid_file = str(tmp_path / "grid.TextGrid")
+    assert sorted(scan_directory(str(tmp_path), [".eaf", ".TextGrid"])) == \
+        [eaf_file, str(tmp_path / "elan" / "missing_audio.eaf"), textgrid_file]
+
+    # Utterances of every format come out in sorted file order, and the failed file is reported
+    expected = process_eaf(eaf_file, "Phrase") + process_textgrid_file(textgrid_file, ["Speech", "Other"]) + \
+        process_trs(trs_file, False)
+    options = {"tier": "Phrase", "textgrid_tiers": ["Speech", "Other"]}
+    failed_files = []
+    assert list(iterate_corpus(str(tmp_path), options, failed_files=failed_files)) == expected
+    assert [os.path.basename(file_name) for file_name, error in failed_files] == ["missing_audio.eaf"]
+    assert list(iterate_corpus(str(tmp_path), options, jobs=2)) == expected
+    audio_index = AudioIndex()
+    audio_index.update(str(tmp_path))
+    failed_files = []
+    assert list(iterate_corpus(str(tmp_path), options, jobs=2, failed_files=failed_files,
+                               audio_index=audio_index)) == expected
+    assert [os.path.basename(file_name) for file_name, error in failed_files] == ["missing_audio.eaf"]
+
+    # Formats can be selected by extension
+    assert list(iterate_corpus(str(tmp_path), options, extensions=[".trs"])) == process_trs(trs_file, False)
+    with pytest.raises(ValueError):
+        list(iterate_corpus(str(tmp_path), options, extensions=[".xlsx"]))
+
+
+def parse_text(file_name: str, options: dict) -> List[dict]:
+    with open(file_name) as file:
+        return [{"audio_file_name": "first.wav", "transcript": line.strip()} for line in file]
+
+
+def test_register_parser(tmp_path, monkeypatch) -> None:
+    with open(str(tmp_path / "first.TXT"), "w") as text_file:
+        text_file.write("hello there\n")
+
+    register_parser(".txt", parse_text)
+    try:
+        expected = [{"audio_file_name": "first.wav", "transcript": "hello there"}]
+        assert list(iterate_corpus(str(tmp_path), extensions=[".txt"])) == expected
+        # Workers that are started rather than forked do not see the registration, but are sent the parser
+        monkeypatch.setattr(pool_utilities, "Pool", multiprocessing.get_context("spawn").Pool)
+        failed_files = []
+        assert list(iterate_corpus(str(tmp_path), extensions=[".txt"], jobs=2, failed_files=failed_files)) == \
+            expected
+        assert failed_files == []
+    finally:
+        del PARSERS[".txt"]
@@ -1,4 +1,8 @@
-from kaldi_helpers.json_to_kaldi import *
+import json
+import shutil
+import subprocess
+from typing import Dict, List, Set
+from kaldi_helpers.input_scripts.json_to_kaldi import *
 
 SCRIPT_PATH: str = os.path.join(".", "kaldi_helpers", "json_to_kaldi.py")
 
@@ -37,3 +41,77 @@ def test_json_to_kaldi2():
     command_result = process.wait()  # catch return code
     assert command_result != 0 # assert failure
 
+
+
+def test_deterministic_ids(tmp_path) -> None:
+    input_json = str(tmp_path / "utterances.jsonl")
+    with open(input_json, "w", encoding="utf-8") as file:
+        for start_ms in range(0, 20000, 1000):
+            file.write(json.dumps({"audio_file_name": "a.wav", "transcript": "ama hada",
+                                   "start_ms": start_ms, "stop_ms": start_ms + 1000}) + "\n")
+        # A duplicate utterance, and one with a speaker
+        file.write(json.dumps({"audio_file_name": "a.wav", "transcript": "ama hada",
+                               "start_ms": 0, "stop_ms": 1000}) + "\n")
+        file.write(json.dumps({"audio_file_name": "b.wav", "transcript": "hada", "speaker_id": "Speaker A",
+                               "start_ms": 0, "stop_ms": 1000}) + "\n")
+
+    def build(output_folder: str, buffer_lines: int = DEFAULT_BUFFER_LINES) -> Dict[str, str]:
+        create_kaldi_structure(input_json=input_json,
+                               output_folder=output_folder,
+                               silence_markers=False,
+                               text_corpus=None,
+                               corpus_file=None,
+                               deterministic_ids=True,
+                               buffer_lines=buffer_lines)
+        contents = {}
+        for subset in ["training", "testing"]:
+            for name in ["segments", "text", "spk2gender", "wav.scp", "utt2spk"]:
+                with open(os.path.join(output_folder, subset, name), encoding="utf-8") as file:
+                    contents[f"{subset}/{name}"] = file.read()
+        return contents
+
+    first_build = build(str(tmp_path / "first"))
+    second_build = build(str(tmp_path / "second"))
+    assert first_build == second_build
+    # Spilling sorted runs to disk gives the same files as sorting in memory
+    assert build(str(tmp_path / "spilled"), buffer_lines=3) == first_build
+    utterance_ids = [line.split()[0] for subset in ["training", "testing"]
+                     for line in first_build[f"{subset}/segments"].splitlines()]
+    assert len(utterance_ids) == 22
+    assert len(set(utterance_ids)) == 22
+
+
+def test_deterministic_ids_survive_edits(tmp_path) -> None:
+    utterances = [{"audio_file_name": "a.wav", "transcript": f"ama hada {index}",
+                   "start_ms": index * 1000, "stop_ms": index * 1000 + 1000} for index in range(1, 6)]
+    inserted = {"audio_file_name": "a.wav", "transcript": "na mai", "start_ms": 0, "stop_ms": 1000}
+
+    def build_ids(name: str, input_utterances: List[dict]) -> Dict[str, str]:
+        input_json = str(tmp_path / f"{name}.jsonl")
+        with open(input_json, "w", encoding="utf-8") as file:
+            for utterance in input_utterances:
+                file.write(json.dumps(utterance) + "\n")
+        output_folder = str(tmp_path / name)
+        create_kaldi_structure(input_json=input_json,
+                               output_folder=output_folder,
+                               silence_markers=False,
+                               text_corpus=None,
+                               corpus_file=None,
+                               deterministic_ids=True)
+        ids = {}
+        for subset in ["training", "testing"]:
+            with open(os.path.join(output_folder, subset, "text"), encoding="utf-8") as file:
+                for line in file:
+                    utterance_id, transcript = line.split(" ", 1)
+                    ids[transcript.strip()] = utterance_id
+        return ids
+
+    original = build_ids("original", utterances)
+    assert len(original) == 5
+    # Inserting or removing an utterance leaves the ids of all the others unchanged
+    inserted_ids = build_ids("inserted", [inserted] + utterances)
+    assert len(inserted_ids) == 6
+    assert {transcript: inserted_ids[transcript] for transcript in original} == original
+    removed = build_ids("removed", utterances[1:])
+    assert removed == {transcript: original[transcript] for transcript in removed}
+    assert len(removed) == 4
@@ -0,0 +1,57 @@
+import io
+from collections import Counter
+from kaldi_helpers.input_scripts.make_ngram_counts import *
+from kaldi_helpers.script_utilities import write_utterances
+
+SENTENCES = [
+    "ama hada ngaya",
+    "hada ngaya",
+    "ama ama",
+    "yuwa",
+]
+
+
+def reference_counts(sentences: List[str], order: int) -> Dict[Tuple[str, ...], int]:
+    counts = Counter()
+    for sentence in sentences:
+        words = [SENTENCE_START] + sentence.split() + [SENTENCE_END]
+        for n in range(1, order + 1):
+            counts.update(tuple(words[i:i + n]) for i in range(len(words) - n + 1))
+    return dict(counts)
+
+
+def test_ngram_counts() -> None:
+    counts = NGramCounts(3)
+    counts.add_sentences((sentence.split() for sentence in SENTENCES), compact_every=3)
+    assert dict(counts.iterate_counts()) == reference_counts(SENTENCES, 3)
+    assert counts.totals() == [6, 9, 7]
+    output_file = io.StringIO()
+    assert counts.write_counts(output_file) == 22
+    assert "<s> ama hada\t1\n" in output_file.getvalue()
+
+
+def test_merge_saved_shards(tmp_path) -> None:
+    first, second = NGramCounts(2), NGramCounts(2)
+    first.add_sentences(sentence.split() for sentence in SENTENCES[:2])
+    second.add_sentences(sentence.split() for sentence in SENTENCES[2:])
+    second.save(str(tmp_path / "second.npz"))
+    first.merge(NGramCounts.load(str(tmp_path / "second.npz")))
+    assert dict(first.iterate_counts()) == reference_counts(SENTENCES, 2)
+
+
+def test_build_ngram_counts_cached(tmp_path) -> None:
+    utterance_file = str(tmp_path / "utterances.jsonl")
+    write_utterances([{"transcript": sentence} for sentence in SENTENCES[:2]], utterance_file)
+    text_file = tmp_path / "corpus.txt"
+    text_file.write_text("\n".join(SENTENCES[2:]) + "\n\n", encoding="utf-8")
+    cache_directory = str(tmp_path / "cache")
+
+    counts = build_ngram_counts([utterance_file, str(text_file)], 3, cache_directory)
+    assert dict(counts.iterate_counts()) == reference_counts(SENTENCES, 3)
+    assert len(list(tmp_path.glob("cache/*/*.npz"))) == 2
+
+    # Only the changed source is counted again
+    text_file.write_text("yuwa ama\n", encoding="utf-8")
+    counts = build_ngram_counts([utterance_file, str(text_file)], 3, cache_directory)
+    assert dict(counts.iterate_counts()) == reference_counts(SENTENCES[:2] + ["yuwa ama"], 3)
+    assert len(list(tmp_path.glob("cache/*/*.npz"))) == 3
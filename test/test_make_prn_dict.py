@@ -0,0 +1,47 @@
+import io
+from kaldi_helpers.input_scripts.make_prn_dict import *
+
+SOUND_MAP = [("a", "a"), ("aa", "aː"), ("n", "n"), ("ng", "ŋ"), ("ngg", "ŋg"), ("g", "k"), ("A", "never"),
+             ("ng", "duplicate"), ("'", "ʔ"), ("i", "i")]
+
+
+def test_sound_mapper_matches_generate_sound_mapping() -> None:
+    sound_map = sorted(SOUND_MAP, key=lambda x: len(x[0]), reverse=True)
+    sound_mapper = SoundMapper(sound_map)
+    for word in ["Ngaanggi", "nganga", "a'ang", "xyz", "Aangx", "", "ngggg"]:
+        expected_file = io.StringIO()
+        expected_missing = set()
+        generate_sound_mapping(word, sound_map, expected_file, expected_missing)
+        missing = set()
+        assert sound_mapper.map_word(word, missing) + "\n" == expected_file.getvalue()
+        assert missing == expected_missing
+
+
+def test_generate_pronunciation_dictionary(tmp_path) -> None:
+    word_list = tmp_path / "words.txt"
+    word_list.write_text("nganga\nxang\n", encoding="utf-8")
+    config = tmp_path / "letter_to_sound.txt"
+    config.write_text("# comment\na a\nng ŋ\nn n\ng k\n", encoding="utf-8")
+    lexicon = tmp_path / "lexicon.txt"
+    generate_pronunciation_dictionary(str(word_list), str(lexicon), str(config))
+    assert lexicon.read_text(encoding="utf-8") == "!SIL sil\n<UNK> spn\nnganga ŋ a ŋ a\nxang (x) a ŋ\n"
+
+
+def test_generate_pronunciation_dictionary_parallel_and_cached(tmp_path) -> None:
+    word_list = tmp_path / "words.txt"
+    word_list.write_text("\n".join(["nganga", "xang", "nganga", "gaa'i"] * 50), encoding="utf-8")
+    config = tmp_path / "letter_to_sound.txt"
+    config.write_text("\n".join(f"{symbol} {sound}" for symbol, sound in SOUND_MAP), encoding="utf-8")
+    expected = tmp_path / "expected.txt"
+    generate_pronunciation_dictionary(str(word_list), str(expected), str(config))
+
+    cache_directory = str(tmp_path / "cache")
+    for jobs in [2, 1]:
+        lexicon = tmp_path / f"lexicon_{jobs}.txt"
+        generate_pronunciation_dictionary(str(word_list), str(lexicon), str(config),
+                                          jobs=jobs, cache_directory=cache_directory)
+        assert lexicon.read_text(encoding="utf-8") == expected.read_text(encoding="utf-8")
+    # One cache entry for the config, holding each unique word once
+    cache_files = list(tmp_path.glob("cache/*/*.jsonl"))
+    assert len(cache_files) == 1
+    assert len(cache_files[0].read_text(encoding="utf-8").splitlines()) == 3
@@ -1,6 +1,7 @@
 import os
-from kaldi_helpers.make_wordlist import *
+from kaldi_helpers.input_scripts.make_wordlist import *
 from typing import List
+from kaldi_helpers.script_utilities import write_utterances
 
 
 def test_save_word_list() -> None:
@@ -27,3 +28,25 @@ def test_extract_word_list() -> None:
     assert result == ["Hello", "I", "love", "test", "too", "world"]
 
 
+
+
+def test_generate_word_list(tmp_path, capsys) -> None:
+    transcription_file = str(tmp_path / "utterances.jsonl")
+    write_utterances([{"transcript": "ama hada ama"}, {"transcript": "hada ngaya ama"}], transcription_file)
+    word_list_file = tmp_path / "additional_words.txt"
+    word_list_file.write_text("balga\n", encoding="utf-8")
+    corpus_file = tmp_path / "corpus.txt"
+    corpus_file.write_text("ama  yuwa\n", encoding="utf-8")
+    output_file = tmp_path / "wordlist.txt"
+    frequency_file = tmp_path / "frequencies.txt"
+
+    generate_word_list(transcription_file, str(word_list_file), str(output_file), str(corpus_file),
+                       frequency_file=str(frequency_file))
+    assert output_file.read_text(encoding="utf-8") == "ama\nbalga\nhada\nngaya\nyuwa\n"
+    assert frequency_file.read_text(encoding="utf-8") == "ama 4\nhada 2\nbalga 1\nngaya 1\nyuwa 1\n"
+    # The vocabulary is never printed
+    assert capsys.readouterr().out == ""
+
+    # Rare words are pruned, apart from the additional word list
+    generate_word_list(transcription_file, str(word_list_file), str(output_file), str(corpus_file), min_count=2)
+    assert output_file.read_text(encoding="utf-8") == "ama\nbalga\nhada\n"
@@ -4,7 +4,9 @@ Test script for validating resample audio script.
 @author Aninda Saha
 """
 
+import numpy as np
 from kaldi_helpers.input_scripts.resample_audio import *
+from kaldi_helpers.script_utilities import read_wav, write_wav
 
 SCRIPT_PATH = os.path.join(".", "kaldi_helpers", "resample_audio.py")
 
@@ -20,7 +22,8 @@ def test_join_normalised_path() -> None:
 
 def test_resample_audio() -> None:
 
-    result: subprocess.CompletedProcess = subprocess.run(["python", SCRIPT_PATH, "--corpus", DEFAULT_DATA_DIRECTORY],
+    result: subprocess.CompletedProcess = subprocess.run(["python", SCRIPT_PATH, "--corpus", DEFAULT_DATA_DIRECTORY,
+                                                          "--sample_rate", "16000"],
                                                          check=True)
     assert result.returncode == 0
 
@@ -32,6 +35,83 @@ def test_resample_audio() -> None:
         process: subprocess.Popen = subprocess.Popen([SOX_PATH, "--i", "-r", os.path.join(DEFAULT_DATA_DIRECTORY, os.path.basename(file))],
                                 stdout=subprocess.PIPE)
         sample_rate: str = process.stdout.read()
-        assert int(sample_rate) == 44100
+        assert int(sample_rate) == 16000
 
 
+
+
+def fake_sox(tmp_path, monkeypatch, fail_first: int = 0) -> str:
+    """
+    Stands in for sox with a script that copies its input to its output, failing the first fail_first calls.
+    """
+    calls_file = tmp_path / "sox_calls.txt"
+    script = tmp_path / "sox"
+    script.write_text("#!/bin/sh\n"
+                      f"echo call >> {calls_file}\n"
+                      f"if [ $(wc -l < {calls_file}) -le {fail_first} ]; then echo broken >&2; exit 2; fi\n"
+                      "for last; do true; done\n"
+                      "cp \"$1\" \"$last\"\n")
+    script.chmod(0o755)
+    monkeypatch.setattr("kaldi_helpers.input_scripts.resample_audio.SOX_PATH", str(script))
+    return str(calls_file)
+
+
+def test_resample_corpus_skips_converted_files(tmp_path, monkeypatch) -> None:
+    calls_file = fake_sox(tmp_path, monkeypatch)
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    audio = []
+    for name in ["a.wav", "b.wav"]:
+        (corpus / name).write_bytes(name.encode("utf-8"))
+        audio.append(str(corpus / name))
+    manifest_file = str(corpus / "manifest.json")
+
+    converted, skipped, failed = resample_corpus(audio, sample_rate=16000, jobs=2, overwrite=True,
+                                                 manifest_file=manifest_file)
+    assert (sorted(converted), skipped, failed) == (audio, [], [])
+    assert not (corpus / "tmp").exists()
+
+    converted, skipped, failed = resample_corpus(audio, sample_rate=16000, jobs=2, overwrite=True,
+                                                 manifest_file=manifest_file)
+    assert (converted, sorted(skipped), failed) == ([], audio, [])
+    # A different sample rate converts again
+    converted, skipped, failed = resample_corpus(audio, sample_rate=22050, overwrite=True,
+                                                 manifest_file=manifest_file)
+    assert sorted(converted) == audio
+    with open(calls_file) as file:
+        assert len(file.readlines()) == 4
+
+
+def test_resample_corpus_retries(tmp_path, monkeypatch) -> None:
+    fake_sox(tmp_path, monkeypatch, fail_first=2)
+    (tmp_path / "a.wav").write_bytes(b"a")
+    audio = [str(tmp_path / "a.wav")]
+    converted, skipped, failed = resample_corpus(audio, sample_rate=16000, retries=0)
+    assert failed == [(audio[0], "broken")]
+    converted, skipped, failed = resample_corpus(audio, sample_rate=16000, retries=1)
+    assert (converted, failed) == (audio, [])
+    assert (tmp_path / "tmp" / "a.wav").read_bytes() == b"a"
+
+
+def test_resample_corpus_native_backend(tmp_path, monkeypatch) -> None:
+    calls_file = fake_sox(tmp_path, monkeypatch)
+    times = np.arange(44100) / 44100
+    stereo = np.stack([0.5 * np.sin(2 * np.pi * 440 * times), 0.25 * np.sin(2 * np.pi * 440 * times)], axis=1)
+    write_wav(str(tmp_path / "stereo.wav"), stereo, 44100)
+    write_wav(str(tmp_path / "mono.wav"), stereo[:, 0], 16000)
+    (tmp_path / "broken.wav").write_bytes(b"not a wav file")
+    audio = [str(tmp_path / name) for name in ["broken.wav", "mono.wav", "stereo.wav"]]
+
+    converted, skipped, failed = resample_corpus(audio, sample_rate=16000, jobs=2, backend="native")
+    assert (sorted(converted), failed) == (audio, [])
+    with wave.open(str(tmp_path / "tmp" / "stereo.wav"), "rb") as wav_file:
+        assert wav_file.getparams()[:4] == (1, 2, 16000, 16000)
+    samples, sample_rate = read_wav(str(tmp_path / "tmp" / "stereo.wav"))
+    expected = 0.375 * np.sin(2 * np.pi * 440 * np.arange(16000) / 16000)
+    assert np.abs(samples[1000:-1000, 0] - expected[1000:-1000]).max() < 0.001
+    # 16 bit mono audio at the target rate is copied exactly
+    with open(tmp_path / "mono.wav", "rb") as source, open(tmp_path / "tmp" / "mono.wav", "rb") as output:
+        assert source.read() == output.read()
+    # Only the file the native backend could not read went to sox
+    with open(calls_file) as file:
+        assert len(file.readlines()) == 1
@@ -0,0 +1,95 @@
+"""
+Test script for validating split on silence script, comparing its segments with pydub's split_on_silence.
+"""
+
+import wave
+import numpy as np
+from pydub import AudioSegment
+from pydub.silence import split_on_silence
+from kaldi_helpers.input_scripts.split_on_silence import *
+
+
+def write_test_wav(file_path: str, sample_rate: int, channels: int, sample_width: int) -> None:
+    random = np.random.RandomState(sample_rate + channels + sample_width)
+    frames = sample_rate * 3 + 7
+    amplitude = 2 ** (8 * sample_width - 1) - 1
+    samples = random.uniform(-0.5, 0.5, (frames, channels)) * amplitude
+    # Two quiet gaps long enough to split on, one too short, and a quiet tail
+    for start, stop in [(0.4, 0.9), (1.3, 1.4), (1.8, 2.3), (2.8, 3.0)]:
+        samples[int(start * sample_rate):int(stop * sample_rate)] *= 0.001
+    samples = samples.astype(np.int64)
+    if sample_width == 1:
+        data = (samples + 128).astype(np.uint8).tobytes()
+    elif sample_width == 3:
+        data = b"".join(int(value).to_bytes(3, "little", signed=True) for value in samples.ravel())
+    else:
+        data = samples.astype(f"<i{sample_width}").tobytes()
+    with wave.open(file_path, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(data)
+
+
+def test_segments_match_pydub(tmp_path, monkeypatch) -> None:
+    # Read in small chunks so that chunk boundaries fall inside windows
+    monkeypatch.setattr("kaldi_helpers.input_scripts.split_on_silence.READ_CHUNK_FRAMES", 1000)
+    for sample_rate, channels, sample_width in [(16000, 1, 2), (22050, 2, 2), (44100, 1, 1), (11025, 1, 3),
+                                                (8000, 2, 4)]:
+        file_path = str(tmp_path / f"audio_{sample_rate}_{channels}_{sample_width}.wav")
+        write_test_wav(file_path, sample_rate, channels, sample_width)
+        audio = AudioSegment.from_wav(file_path)
+        expected = split_on_silence(audio, min_silence_len=180, silence_thresh=-20)
+
+        profile = SilenceProfile(file_path)
+        assert profile.length == len(audio)
+        segments = find_segments(profile, min_silence_length=180, threshold=20)
+        assert len(segments) == len(expected) == 3
+        for (start_ms, stop_ms), expected_segment in zip(segments, expected):
+            assert read_segment(file_path, profile, start_ms, stop_ms).raw_data == expected_segment.raw_data
+
+
+def test_silent_file(tmp_path) -> None:
+    file_path = str(tmp_path / "silent.wav")
+    with wave.open(file_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(b"\0" * 16000 * 2)
+    assert find_segments(SilenceProfile(file_path), min_silence_length=200, threshold=16) == []
+
+
+def test_iterate_split_files(tmp_path) -> None:
+    input_directory = tmp_path / "input"
+    output_directory = tmp_path / "output"
+    (input_directory / "speaker").mkdir(parents=True)
+    write_test_wav(str(input_directory / "speaker" / "recording.wav"), 16000, 1, 2)
+    write_test_wav(str(input_directory / "another.wav"), 22050, 2, 2)
+
+    failed_files = []
+    serial = list(iterate_split_files(str(input_directory), str(output_directory), 180, 20, 100,
+                                      failed_files=failed_files))
+    parallel = list(iterate_split_files(str(input_directory), str(output_directory), 180, 20, 100, jobs=2))
+    assert serial == parallel
+    assert not failed_files
+    assert [utterance["audio_file_name"] for utterance in serial] == \
+        ["another.wav"] * 3 + [os.path.join("speaker", "recording.wav")] * 3
+    assert serial[0] == {"audio_file_name": "another.wav", "transcript": "", "start_ms": 0, "stop_ms": 478}
+    assert (output_directory / "another-part_2.wav").is_file()
+    assert (output_directory / "speaker" / "recording-part_0.wav").is_file()
+
+
+def test_virtual_split(tmp_path) -> None:
+    input_directory = tmp_path / "input"
+    input_directory.mkdir()
+    write_test_wav(str(input_directory / "recording.wav"), 16000, 1, 2)
+
+    exported = list(iterate_split_files(str(input_directory), str(tmp_path / "exported"), 180, 20, 100, gain=True))
+    virtual = list(iterate_split_files(str(input_directory), str(tmp_path / "virtual"), 180, 20, 100,
+                                       export=False, gain=True))
+    assert not (tmp_path / "virtual").exists()
+    assert len(exported) == len(virtual) == 3
+    for exported_utterance, virtual_utterance in zip(exported, virtual):
+        assert exported_utterance["start_ms"] == virtual_utterance["start_ms"]
+        assert exported_utterance["stop_ms"] == virtual_utterance["stop_ms"]
+        assert abs(exported_utterance["gain_db"] - virtual_utterance["gain_db"]) < 0.1
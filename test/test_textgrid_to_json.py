@@ -4,7 +4,9 @@ Test script for validating textgrid to json conversion pipeline.
 @author Aninda Saha
 """
 
-from kaldi_helpers.textgrid_to_json import *
+import shutil
+from praatio import tgio
+from kaldi_helpers.input_scripts.textgrid_to_json import *
 
 SCRIPT_PATH = os.path.join(".", "kaldi_helpers", "textgrid_to_json.py")
 
@@ -41,3 +43,68 @@ def test_textgrid_to_json() -> None:
     assert utterances == contents
 
     os.remove(json_name)
+
+
+def test_native_parser_matches_praatio(tmp_path) -> None:
+
+    file_name = os.path.join(TEST_FILES_BASE_DIR, "test.TextGrid")
+    text_grid = tgio.openTextgrid(file_name)
+    for tier_name in text_grid.tierNameList:
+        expected = [(tier_name, float(start), float(stop), label)
+                    for start, stop, label in text_grid.tierDict[tier_name].entryList]
+        native = [(name, float(start), float(stop), label)
+                  for name, start, stop, label in iterate_textgrid_intervals(file_name, [tier_name])]
+        assert native == expected
+
+    # Short format files are read with praatio
+    short_file_name = str(tmp_path / "short.TextGrid")
+    text_grid.save(short_file_name, useShortForm=True)
+    assert process_textgrid_file(short_file_name, ["Speech"]) == \
+        [dict(interval, audio_file_name=os.path.join(".", "short.wav"))
+         for interval in process_textgrid_file(file_name, ["Speech"])]
+
+
+def test_iterate_textgrid_files(tmp_path) -> None:
+
+    tiers = tgio.Textgrid()
+    tiers.addTier(tgio.IntervalTier("Speech", [(0, 1.5, 'say "hello"'), (2, 3, "bye")], 0, 4))
+    tiers.addTier(tgio.IntervalTier("Other", [(0, 4, "other")], 0, 4))
+    tiers.save(str(tmp_path / "first.TextGrid"), useShortForm=False)
+    broken_file_name = str(tmp_path / "broken.TextGrid")
+    with open(broken_file_name, "w") as broken_file:
+        broken_file.write("not a TextGrid")
+
+    file_names = [broken_file_name, str(tmp_path / "first.TextGrid")]
+    expected = [{"audio_file_name": os.path.join(".", "first.wav"), "transcript": "say hello",
+                 "start_ms": 0, "stop_ms": 1500},
+                {"audio_file_name": os.path.join(".", "first.wav"), "transcript": "bye",
+                 "start_ms": 2000, "stop_ms": 3000}]
+    failed_files = []
+    assert list(iterate_textgrid_files(file_names, ["Speech"], failed_files=failed_files)) == expected
+    assert [file_name for file_name, error in failed_files] == [broken_file_name]
+    assert list(iterate_textgrid_files(file_names, ["Speech"], jobs=2)) == expected
+
+    # With an audio index, files without a paired wav file fail
+    audio_index = AudioIndex()
+    audio_index.update(str(tmp_path))
+    failed_files = []
+    assert list(iterate_textgrid_files(file_names, ["Speech"], failed_files=failed_files,
+                                       audio_index=audio_index)) == []
+    assert sorted(file_name for file_name, error in failed_files) == sorted(file_names)
+    shutil.copy(os.path.join(".", "test", "testfiles", "elan", "first.wav"), str(tmp_path / "first.wav"))
+    audio_index.update(str(tmp_path))
+    assert list(iterate_textgrid_files(file_names, ["Speech"], jobs=2, audio_index=audio_index)) == expected
+    assert [interval["transcript"] for interval in process_textgrid(str(tmp_path), ["Speech", "Other"])] == \
+        ["say hello", "bye", "other"]
+
+
+def test_missing_tiers_fail(tmp_path) -> None:
+    tiers = tgio.Textgrid()
+    tiers.addTier(tgio.IntervalTier("Other", [(0, 4, "other")], 0, 4))
+    for short_form in [False, True]:
+        file_name = str(tmp_path / f"other_{short_form}.TextGrid")
+        tiers.save(file_name, useShortForm=short_form)
+        failed_files = []
+        assert list(iterate_textgrid_files([file_name], ["Speech"], failed_files=failed_files)) == []
+        assert failed_files == [(file_name, "ValueError: None of the interval tiers Speech were found")]
+        assert process_textgrid_file(file_name, ["Speech", "Other"])[0]["transcript"] == "other"
@@ -4,7 +4,9 @@ Test script for validating trs to json conversion methods.
 @author Aninda Saha
 """
 
+import glob
 from kaldi_helpers.input_scripts.trs_to_json import *
+from kaldi_helpers.script_utilities import find_files_by_extensions, TEST_FILES_BASE_DIR
 
 SCRIPT_PATH = os.path.join(".", "kaldi_helpers", "trs_to_json.py")
 
@@ -111,3 +113,34 @@ def test_trs_to_json():
     assert (len(contents) == len(utterances))
     assert contents == utterances
 
+
+def test_iterate_trs_files(tmp_path, capsys) -> None:
+    trs_file = tmp_path / "story.trs"
+    trs_file.write_text('<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+                        '<Trans audio_filename="story"><Speakers>'
+                        '<Speaker id="spk1" name="Ann"/><Speaker id="spk2" name="Bob"/></Speakers>'
+                        '<Episode><Section startTime="0" endTime="4">'
+                        '<Turn startTime="0" endTime="2" speaker="spk1"><Sync time="0"/>one<Sync time="1"/>two</Turn>'
+                        '<Turn startTime="2" endTime="4" speaker="spk2"><Sync time="2"/>three</Turn>'
+                        '</Section></Episode></Trans>', encoding="ISO-8859-1")
+    broken_file = tmp_path / "broken.trs"
+    broken_file.write_text("<Trans audio_filename='broken'><Turn>")
+
+    expected = [{"speaker_id": "Ann", "audio_file_name": os.path.join(".", "story.wav"), "transcript": "one",
+                 "start_ms": 0.0, "stop_ms": 1000.0},
+                {"speaker_id": "Ann", "audio_file_name": os.path.join(".", "story.wav"), "transcript": "two",
+                 "start_ms": 1000.0, "stop_ms": 2000.0},
+                {"speaker_id": "Bob", "audio_file_name": os.path.join(".", "story.wav"), "transcript": "three",
+                 "start_ms": 2000.0, "stop_ms": 4000.0}]
+    file_names = [str(broken_file), str(trs_file)]
+    failed_files = []
+    assert list(iterate_trs_files(file_names, False, failed_files=failed_files)) == expected
+    assert [file_name for file_name, error in failed_files] == [str(broken_file)]
+    assert failed_files[0][1].startswith("ParseError: ")
+    assert f"XML parser failed to parse '{broken_file}'!" in capsys.readouterr().err
+    failed_files = []
+    assert list(iterate_trs_files(file_names, False, jobs=2, failed_files=failed_files)) == expected
+    assert [file_name for file_name, error in failed_files] == [str(broken_file)]
+
+    tree = ET.parse(str(trs_file))
+    assert process_turn("story.wav", tree.findall(".//Turn")[1], tree) == expected[2:]
@@ -1,4 +1,7 @@
+import glob
 import sys
+import numpy as np
+from typing import List
 from kaldi_helpers.script_utilities import *
 from _pytest.capture import CaptureFixture
 
@@ -36,6 +39,116 @@ def test_write_data_to_json_stdout(capsys: CaptureFixture):
     assert out == json.dumps(EXAMPLE_JSON_DATA, indent=4) + "\n"
 
 
+def test_write_data_to_jsonl_file_path():
+    count = write_data_to_jsonl_file((utterance for utterance in EXAMPLE_JSON_DATA), "test_file.jsonl")
+    assert count == len(EXAMPLE_JSON_DATA)
+    with open("test_file.jsonl", "r", encoding="utf-8") as test_file:
+        lines = test_file.read().splitlines()
+    assert len(lines) == len(EXAMPLE_JSON_DATA)
+    assert json.loads(lines[1]) == EXAMPLE_JSON_DATA[1]
+    assert list(load_jsonl_file("test_file.jsonl")) == EXAMPLE_JSON_DATA
+    os.remove("test_file.jsonl")
+
+
+def test_load_and_write_utterances_by_extension():
+    assert write_utterances(iter(EXAMPLE_JSON_DATA), "test_file.json") == len(EXAMPLE_JSON_DATA)
+    assert write_utterances(iter(EXAMPLE_JSON_DATA), "test_file.jsonl") == len(EXAMPLE_JSON_DATA)
+    with open("test_file.json", "r") as test_file:
+        assert json.load(test_file) == EXAMPLE_JSON_DATA
+    assert list(load_utterances("test_file.json")) == EXAMPLE_JSON_DATA
+    assert list(load_utterances("test_file.jsonl")) == EXAMPLE_JSON_DATA
+    os.remove("test_file.json")
+    os.remove("test_file.jsonl")
+
+
+def test_word_lookup_file(tmp_path):
+    lookup_path = str(tmp_path / "words.lookup")
+    words = ["water", "house", "préférer", "house", "a", "zebra"]
+    assert build_word_lookup_file(words, lookup_path) == 5
+    lookup = WordLookup(lookup_path)
+    assert len(lookup) == 5
+    for word in words:
+        assert word in lookup
+    for word in ["", "b", "hous", "houses", "préférér", "zz"]:
+        assert word not in lookup
+    lookup.close()
+
+
+def test_external_sorter(tmp_path):
+    lines = [f"utterance-{(i * 7919) % 1000:04d} ça {i}\n" for i in range(1000)]
+    sorter = ExternalSorter(max_lines=64, temporary_directory=str(tmp_path))
+    sorter.extend(lines)
+    assert len(sorter.run_paths) == 1000 // 64
+    assert len(sorter) == 1000
+    assert list(sorter) == sorted(lines)
+    sorter.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def make_split_utterances(count: int) -> List[dict]:
+    return [{"audio_file_name": f"recording_{i % 7}.wav",
+             "speaker_id": f"speaker_{i % 13}",
+             "start_ms": i * 1000,
+             "stop_ms": i * 1000 + (i % 5 + 1) * 1000} for i in range(count)]
+
+
+def test_data_splitter_default_interleave():
+    splitter = DataSplitter()
+    assignments = [splitter.assign(utterance) for utterance in make_split_utterances(95)]
+    assert assignments == [TESTING if i % 10 == 0 else TRAINING for i in range(95)]
+    # Without a manifest, splitting by utterance keeps no per-utterance state
+    assert splitter.assignments == {}
+    assert splitter.counts() == (85, 10)
+
+
+def test_data_splitter_groups_and_strata():
+    utterances = make_split_utterances(1000)
+    splitter = DataSplitter(test_fraction=0.25, group_by="speaker")
+    speaker_sets = {}
+    for utterance in utterances:
+        speaker_sets.setdefault(utterance["speaker_id"], set()).add(splitter.assign(utterance))
+    assert all(len(data_sets) == 1 for data_sets in speaker_sets.values())
+
+    splitter = DataSplitter(test_fraction=0.2, duration_bins=[2000, 4000])
+    testing_by_stratum = {}
+    for utterance in utterances:
+        if splitter.assign(utterance) == TESTING:
+            stratum = splitter.stratum(utterance)
+            testing_by_stratum[stratum] = testing_by_stratum.get(stratum, 0) + 1
+    assert testing_by_stratum == {0: 40, 1: 80, 2: 80}
+
+
+def test_data_splitter_hash_and_manifest(tmp_path):
+    utterances = make_split_utterances(500)
+    splitter = DataSplitter(method="hash", group_by="recording", seed=3)
+    forwards = [splitter.assign(utterance) for utterance in utterances]
+    backwards = DataSplitter(method="hash", group_by="recording", seed=3)
+    assert [backwards.assign(utterance) for utterance in reversed(utterances)] == list(reversed(forwards))
+
+    manifest_file = str(tmp_path / "split.json")
+    splitter = DataSplitter(test_fraction=0.5, group_by="recording", manifest_file=manifest_file)
+    first = [splitter.assign(utterance) for utterance in utterances]
+    splitter.save()
+    # One entry is kept per recording, and known groups keep their set even though the order changed
+    assert len(splitter.assignments) == 7
+    reused = DataSplitter(test_fraction=0.5, group_by="recording", manifest_file=manifest_file)
+    assert [reused.assign(utterance) for utterance in reversed(utterances)] == list(reversed(first))
+    # A manifest made with other options is ignored
+    assert DataSplitter(test_fraction=0.2, group_by="recording", manifest_file=manifest_file).assignments == {}
+
+    # Single utterances are not remembered, even with a manifest or when they have no speaker to group by
+    splitter = DataSplitter(manifest_file=str(tmp_path / "utterances.json"))
+    for utterance in utterances:
+        splitter.assign(utterance)
+    assert splitter.assignments == {}
+    splitter = DataSplitter(group_by="speaker")
+    for utterance in utterances:
+        if utterance["start_ms"] % 2000:
+            utterance = {key: value for key, value in utterance.items() if key != "speaker_id"}
+        splitter.assign(utterance)
+    assert len(splitter.assignments) == 13
+
+
 def test_find_first_file_by_extension() -> None:
     all_files_in_dir = list(glob.glob(os.path.join(TEST_FILES_BASE_DIR, "**"), recursive=True))
     all_files_in_dir.sort()
@@ -52,4 +165,119 @@ def test_find_first_file_by_extension() -> None:
     third_test: str = find_first_file_by_extension(all_files_in_dir, list(["*.py", "*.xlsx"]))
     assert os.path.split(third_test)[1].endswith(".xlsx")
     assert os.path.basename(third_test) != "howdy.xlsx"
-    assert os.path.basename(third_test) == "charm.xlsx"
\ No newline at end of file
+    assert os.path.basename(third_test) == "charm.xlsx"
+
+def test_normalise_extension() -> None:
+    assert {normalise_extension(extension) for extension in ["wav", ".wav", "*.wav", ".WAV"]} == {".wav"}
+    assert find_files_by_extensions({"a/b.WAV", "a/c.wav", "a/d.eaf", "a/wav"}, {"wav"}) == {"a/b.WAV", "a/c.wav"}
+
+
+def make_tree(root) -> None:
+    for path in ["a.wav", "b.eaf", "one/c.wav", "one/two/d.WAV", "tmp/e.wav"]:
+        os.makedirs(os.path.dirname(str(root / path)) or str(root), exist_ok=True)
+        with open(str(root / path), "w"):
+            pass
+
+
+def test_scan_directory(tmp_path, capsys: CaptureFixture) -> None:
+    make_tree(tmp_path)
+    relative = lambda paths: [os.path.relpath(path, str(tmp_path)) for path in paths]
+
+    assert relative(scan_directory(str(tmp_path), {"*.wav"})) == \
+        ["a.wav", os.path.join("one", "c.wav"), os.path.join("one", "two", "d.WAV"), os.path.join("tmp", "e.wav")]
+    assert relative(scan_directory(str(tmp_path), {"eaf"})) == ["b.eaf"]
+    assert len(list(scan_directory(str(tmp_path)))) == 5
+    # Pruned directories are not read at all
+    assert relative(scan_directory(str(tmp_path), {"wav"}, prune=lambda path: os.path.basename(path) == "one")) == \
+        ["a.wav", os.path.join("tmp", "e.wav")]
+    assert find_all_files_in_dir_by_extensions(str(tmp_path), {".eaf"}) == {str(tmp_path / "b.eaf")}
+
+    # Hidden files and directories are skipped like glob does, unless asked for
+    os.makedirs(str(tmp_path / ".git"))
+    for path in ["._b.eaf", ".git/x.eaf"]:
+        with open(str(tmp_path / path), "w"):
+            pass
+    assert relative(scan_directory(str(tmp_path), {"eaf"})) == ["b.eaf"]
+    assert relative(scan_directory(str(tmp_path), {"eaf"}, include_hidden=True)) == \
+        ["._b.eaf", "b.eaf", os.path.join(".git", "x.eaf")]
+    assert capsys.readouterr().out == ""
+
+
+def test_scan_directory_follows_symlinks(tmp_path) -> None:
+    corpus = tmp_path / "corpus"
+    for path in ["corpus/real/x.eaf", "shared/y.eaf", "more/z.eaf"]:
+        os.makedirs(str(tmp_path / os.path.dirname(path)), exist_ok=True)
+        with open(str(tmp_path / path), "w"):
+            pass
+    os.symlink(str(tmp_path / "shared"), str(corpus / "linked"))
+    # A symbolic link to a directory is scanned rather than yielded as a file, whatever its name
+    os.symlink(str(tmp_path / "more"), str(corpus / "dir.eaf"))
+    relative = lambda paths: sorted(os.path.relpath(path, str(corpus)) for path in paths)
+
+    expected = [os.path.join("dir.eaf", "z.eaf"), os.path.join("linked", "y.eaf"), os.path.join("real", "x.eaf")]
+    assert relative(path for path in glob.glob(os.path.join(str(corpus), "**", "*.eaf"), recursive=True)
+                    if os.path.isfile(path)) == expected
+    assert relative(scan_directory(str(corpus), {"eaf"})) == expected
+    # Links back into the tree are not followed again
+    os.symlink(str(corpus), str(corpus / "real" / "loop"))
+    assert relative(scan_directory(str(corpus), {"eaf"})) == expected
+    index = DirectoryIndex(str(tmp_path / "index.json"))
+    assert relative(scan_directory(str(corpus), {"eaf"}, index=index)) == expected
+
+
+def test_directory_index(tmp_path) -> None:
+    corpus = tmp_path / "corpus"
+    make_tree(corpus)
+    index_path = str(tmp_path / "index" / "directories.json")
+
+    index = DirectoryIndex(index_path)
+    expected = list(scan_directory(str(corpus), {"wav"}))
+    assert list(scan_directory(str(corpus), {"wav"}, index=index)) == expected
+    index.save()
+    assert os.path.isfile(index_path)
+
+    # Unchanged directories are read from the index
+    index = DirectoryIndex(index_path)
+    assert list(scan_directory(str(corpus), {"wav"}, index=index)) == expected
+    assert not index.changed
+
+    # A new file changes the modification time of its directory, which is listed again
+    with open(str(corpus / "one" / "f.wav"), "w"):
+        pass
+    os.utime(str(corpus / "one"), ns=(0, os.stat(str(corpus / "one")).st_mtime_ns + 1))
+    assert str(corpus / "one" / "f.wav") in list(scan_directory(str(corpus), {"wav"}, index=index))
+    assert index.changed
+
+
+def test_audio_index(tmp_path) -> None:
+    corpus = tmp_path / "corpus"
+    os.makedirs(str(corpus / "nested"))
+    write_wav(str(corpus / "short.wav"), np.zeros(8000), 16000)
+    write_wav(str(corpus / "nested" / "long.wav"), np.zeros((44100 * 2, 2)), 44100)
+    with open(str(corpus / "compressed.wav"), "wb") as compressed_file:
+        compressed_file.write(b"not a wav")
+    index_path = str(tmp_path / "audio_index.json")
+
+    audio_index = AudioIndex(index_path)
+    audio_index.update(str(corpus))
+    assert audio_index.info(str(corpus / "short.wav")) == dict(audio_index.info(str(corpus / "short.wav")),
+                                                               sample_rate=16000, channels=1, sample_width=2,
+                                                               frames=8000, duration_ms=500.0)
+    assert audio_index.info(str(corpus / "nested" / "long.wav"))["channels"] == 2
+    assert "error" in audio_index.info(str(corpus / "compressed.wav"))
+    assert audio_index.paired_audio(str(corpus / "nested" / "long.eaf")) == str(corpus / "nested" / "long.wav")
+    assert audio_index.paired_audio(str(corpus / "missing.eaf")) is None
+    assert list(audio_index.subset([str(corpus / "short.wav"), str(corpus / "missing.wav")]).entries) == \
+        [str(corpus / "short.wav")]
+    audio_index.save()
+
+    # Unchanged files are not read again, and removed files are forgotten
+    audio_index = AudioIndex(index_path)
+    audio_index.update(str(corpus))
+    assert not audio_index.changed
+    os.remove(str(corpus / "nested" / "long.wav"))
+    audio_index.update(str(corpus))
+    assert audio_index.info(str(corpus / "nested" / "long.wav")) is None
+    write_wav(str(corpus / "short.wav"), np.zeros(16000), 16000)
+    audio_index.update(str(corpus))
+    assert audio_index.info(str(corpus / "short.wav"))["duration_ms"] == 1000.0